@@ -0,0 +1,693 @@
+"""
+Benchmark the ProcessPlan.py inspection pipeline offline against a local stand-in for the Socrata SODA api.
+
+A local http server imitates the endpoints the inspection uses: the Data Freshness Report, paged
+ .json?$limit=&$offset= requests with the X-SODA2-Fields header (suppressed for very wide datasets, as Socrata does),
+ the same pages as .csv exports with a header row,
+ SoQL count() aggregate queries, keyset paging on :id, view metadata, Last-Modified headers and gzip compression.
+The datasets served are synthetic, generated from a configurable number of rows, columns and null density. Which
+ values are null is deterministic so the expected null counts are known and every run's output csv files are verified.
+The full main() pipeline is run one or more times, with any ProcessPlan variables overridden, and the wall time,
+ the per stage timings and counters from the performance summary, and the verification outcome are written to a json
+ results file. A previous results file can be given to compare against so speedups and regressions are measured.
+Example: python BenchmarkReplay.py --dataset 200000,12,0.2 --runs 3 --set DATASET_WORKER_COUNT=8 --compare old.json
+Csv transport against json: python BenchmarkReplay.py --set USE_AGGREGATE_NULL_COUNTING=False --set TRANSPORT_FORMAT="'csv'"
+Date: 20261017
+"""
+
+# IMPORTS
+from collections import namedtuple
+from SocketServer import ThreadingMixIn
+import argparse
+import ast
+import BaseHTTPServer
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import StringIO
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+import ProcessPlan
+
+# VARIABLES (alphabetic)
+Variable = namedtuple("Variable", ["value"])
+BenchmarkDatasetSpec = namedtuple("BenchmarkDatasetSpec", ["row_count", "column_count", "null_density"])
+DEFAULT_DATASET_SPECS = Variable(("45000,5,0.10", "300,3,0.0", "100,4,0.5", "20000,40,0.3", "2000,150,0.2"))
+DEFAULT_LATENCY_MILLISECONDS = Variable(20)
+DEFAULT_RUN_COUNT = Variable(1)
+LAST_MODIFIED_HEADER_VALUE = Variable("Tue, 01 May 2018 00:00:00 GMT")
+LAST_UPDATED_STAMP = Variable("2018-05-01T00:00:00.000")
+NULL_PATTERN_MODULUS = Variable(10007)
+RESULTS_FILE_NAME = Variable("benchmark_results")
+SUPPRESS_FIELDS_HEADER_ABOVE_COLUMNS = Variable(100)
+
+
+# CLASSES (alphabetic)
+class SodaStandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answer requests the way the SODA endpoints used by ProcessPlan.py do, from the server's synthetic datasets
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """
+        Route a GET request to the freshness report, a dataset page, or a dataset aggregate query
+
+        :return: None
+        """
+        self.server.count_request()
+        if self.server.latency_seconds > 0:
+            time.sleep(self.server.latency_seconds)
+        parsed_url = urlparse.urlsplit(self.path)
+        query_parameters = dict(urlparse.parse_qsl(parsed_url.query))
+        api_id, extension = os.path.splitext(os.path.basename(parsed_url.path))
+        if api_id == ProcessPlan.DATA_FRESHNESS_REPORT_API_ID.value:
+            self._send_body(body=json.dumps(self.server.build_freshness_report()),
+                            content_type="application/json; charset=UTF-8", response_headers={})
+            return
+        synthetic_dataset = self.server.synthetic_datasets.get(api_id)
+        if synthetic_dataset is not None and parsed_url.path.startswith("/api/views/"):
+            self._send_body(body=json.dumps(synthetic_dataset.build_view_metadata()),
+                            content_type="application/json; charset=UTF-8", response_headers={})
+            return
+        if synthetic_dataset is None or extension not in (".json", ".csv"):
+            self._send_status_only(status_code=404)
+            return
+        select_clause = query_parameters.get("$select", "")
+        is_row_id_selected = select_clause.startswith(":id")
+        response_headers = {"Last-Modified": LAST_MODIFIED_HEADER_VALUE.value}
+        if synthetic_dataset.column_count <= self.server.suppress_fields_header_above_columns:
+            field_names = [":id"] + synthetic_dataset.field_names if is_row_id_selected else synthetic_dataset.field_names
+            response_headers["X-SODA2-Fields"] = json.dumps(field_names)
+        if "count(" in select_clause:
+            aggregate_row = synthetic_dataset.build_aggregate_row(select_clause=select_clause)
+            self._send_body(body=json.dumps([aggregate_row]), content_type="application/json; charset=UTF-8",
+                            response_headers=response_headers)
+            return
+        limit_amount = int(query_parameters.get("$limit", 1000))
+        offset = int(query_parameters.get("$offset", 0))
+        # Keyset paging; row ids are zero padded so their order is the record order
+        row_id_match = re.match(r":id\s*>\s*'row-(\d+)'", query_parameters.get("$where", ""))
+        if row_id_match:
+            offset += int(row_id_match.group(1)) + 1
+        records = synthetic_dataset.build_records(offset=offset, limit_amount=limit_amount,
+                                                  is_row_id_included=is_row_id_selected)
+        if extension == ".csv":
+            # A cell for every field of every record, empty for the null values
+            field_names = [":id"] + synthetic_dataset.field_names if is_row_id_selected else synthetic_dataset.field_names
+            csv_body = StringIO.StringIO()
+            csv_writer = csv.writer(csv_body, lineterminator="\n")
+            csv_writer.writerow(field_names)
+            for record in records:
+                csv_writer.writerow([record.get(field_name, "").encode("utf8") for field_name in field_names])
+            self._send_body(body=csv_body.getvalue(), content_type="text/csv; charset=UTF-8",
+                            response_headers=response_headers)
+        else:
+            self._send_body(body=json.dumps(records), content_type="application/json; charset=UTF-8",
+                            response_headers=response_headers)
+        return
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output readable; the request count is reported instead
+        return
+
+    def _send_body(self, body, content_type, response_headers):
+        """
+        Send a 200 response with a body, gzip compressed when the client accepts it
+
+        :param body: json or csv text
+        :param content_type: value of the Content-Type header
+        :param response_headers: dictionary of extra headers
+        :return: None
+        """
+        if "gzip" in (self.headers.getheader("Accept-Encoding") or ""):
+            compressed_body = StringIO.StringIO()
+            gzip_file = gzip.GzipFile(fileobj=compressed_body, mode="wb", compresslevel=1)
+            gzip_file.write(body)
+            gzip_file.close()
+            body = compressed_body.getvalue()
+            response_headers["Content-Encoding"] = "gzip"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header_name, header_value in response_headers.items():
+            self.send_header(header_name, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def _send_status_only(self, status_code):
+        """
+        Send an empty response with the given status code
+
+        :param status_code: Http status code
+        :return: None
+        """
+        self.send_response(status_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return
+
+
+class SodaStandInServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded local http server holding the synthetic datasets served by SodaStandInRequestHandler
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, synthetic_datasets, latency_seconds, suppress_fields_header_above_columns):
+        """
+        :param server_address: tuple of host and port. Port 0 picks a free port.
+        :param synthetic_datasets: list of SyntheticDataset
+        :param latency_seconds: Delay added before answering each request
+        :param suppress_fields_header_above_columns: Datasets wider than this get no X-SODA2-Fields header
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, SodaStandInRequestHandler)
+        self.latency_seconds = latency_seconds
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.suppress_fields_header_above_columns = suppress_fields_header_above_columns
+        self.synthetic_datasets = dict((dataset.api_id, dataset) for dataset in synthetic_datasets)
+
+    def build_freshness_report(self):
+        """
+        Build the Data Freshness Report records listing every synthetic dataset
+
+        :return: list of freshness report record dictionaries
+        """
+        freshness_report = []
+        for synthetic_dataset in sorted(self.synthetic_datasets.values(), key=lambda dataset: dataset.api_id):
+            freshness_report.append({"dataset_name": synthetic_dataset.dataset_name,
+                                     "link": "https://data.maryland.gov/d/{}".format(synthetic_dataset.api_id),
+                                     "data_provided_by": "Benchmark Provider",
+                                     ProcessPlan.FRESHNESS_REPORT_LAST_UPDATED_FIELD.value: LAST_UPDATED_STAMP.value})
+        return freshness_report
+
+    def count_request(self):
+        """
+        Count a request made to the server
+
+        :return: None
+        """
+        with self.lock:
+            self.request_count += 1
+        return
+
+
+class SyntheticDataset(object):
+    """
+    Dataset of generated records whose null values follow a deterministic pattern of the requested density
+
+    Like Socrata, null values are left out of a record rather than sent as null. The second field holds non ascii
+    text and some values of the third field are empty strings or only whitespace. Empty strings are values, except in
+    a csv export, where they are written as an empty cell like a null.
+    """
+
+    def __init__(self, api_id, dataset_name, row_count, column_count, null_density):
+        """
+        :param api_id: Four by four style api id the dataset is served under
+        :param dataset_name: Name listed in the freshness report
+        :param row_count: Number of records
+        :param column_count: Number of fields
+        :param null_density: Fraction, 0 to 1, of values that are null
+        """
+        self.api_id = api_id
+        self.column_count = column_count
+        self.dataset_name = dataset_name
+        self.field_names = ["field_{}".format(column_index) for column_index in range(column_count)]
+        self.null_counts_by_empty_string_rule = {}
+        self.null_density = null_density
+        self.null_threshold = int(null_density * NULL_PATTERN_MODULUS.value)
+        self.row_count = row_count
+
+    def build_aggregate_row(self, select_clause):
+        """
+        Answer a SoQL select of count(*) and count(`field`) expressions
+
+        :param select_clause: value of the $select parameter
+        :return: dictionary of alias to count, as strings like Socrata returns them
+        """
+        null_counts = self.calculate_expected_null_counts(is_empty_string_null=False)
+        aggregate_row = {}
+        for count_argument, alias in re.findall(r"count\(([^)]*)\)\s+AS\s+(\w+)", select_clause, re.IGNORECASE):
+            field_name = count_argument.strip().strip("`")
+            if field_name == "*":
+                aggregate_row[alias] = str(self.row_count)
+            else:
+                aggregate_row[alias] = str(self.row_count - null_counts.get(field_name, self.row_count))
+        return aggregate_row
+
+    def build_view_metadata(self):
+        """
+        Build the view metadata listing the columns, with a hidden column and a system column like Socrata has
+
+        :return: view metadata dictionary
+        """
+        columns = [{"id": -1, "fieldName": ":sid", "name": "sid"}]
+        for column_index, field_name in enumerate(self.field_names):
+            columns.append({"id": column_index, "fieldName": field_name, "name": field_name.upper()})
+        columns.append({"id": self.column_count, "fieldName": "hidden_field", "name": "HIDDEN", "flags": ["hidden"]})
+        return {"id": self.api_id,
+                "name": self.dataset_name,
+                "viewLastModified": 1525132800,
+                "columns": columns}
+
+    def build_records(self, offset, limit_amount, is_row_id_included=False):
+        """
+        Build the records of a page
+
+        :param offset: Index of the first record
+        :param limit_amount: Largest number of records in the page
+        :param is_row_id_included: When True each record has the :id system field
+        :return: list of record dictionaries
+        """
+        records = []
+        for row_index in range(offset, min(offset + limit_amount, self.row_count)):
+            record = {":id": "row-{:09d}".format(row_index)} if is_row_id_included else {}
+            for column_index, field_name in enumerate(self.field_names):
+                if self.is_null(row_index=row_index, column_index=column_index):
+                    continue
+                elif self.is_empty(row_index=row_index, column_index=column_index):
+                    record[field_name] = ""
+                elif self.is_whitespace(row_index=row_index, column_index=column_index):
+                    record[field_name] = "  "
+                elif column_index == 1:
+                    record[field_name] = u"\u00e9t\u00e9 {} {}".format(row_index, column_index)
+                else:
+                    record[field_name] = "value {} {}".format(row_index, column_index)
+            records.append(record)
+        return records
+
+    def calculate_expected_null_counts(self, is_empty_string_null):
+        """
+        Count the null values of each field, once for each rule on empty strings
+
+        :param is_empty_string_null: When True empty strings are counted as nulls, as they are in a csv export
+        :return: dictionary of field name to null count
+        """
+        if is_empty_string_null not in self.null_counts_by_empty_string_rule:
+            null_counts = {}
+            for column_index, field_name in enumerate(self.field_names):
+                null_counts[field_name] = sum(1 for row_index in range(self.row_count)
+                                              if self.is_null(row_index=row_index, column_index=column_index)
+                                              or (is_empty_string_null
+                                                  and self.is_empty(row_index=row_index, column_index=column_index)))
+            self.null_counts_by_empty_string_rule[is_empty_string_null] = null_counts
+        return self.null_counts_by_empty_string_rule[is_empty_string_null]
+
+    def is_empty(self, row_index, column_index):
+        """
+        Decide whether a value of the third field is an empty string rather than a value or a null
+
+        :param row_index: Index of the record
+        :param column_index: Index of the field
+        :return: True when the value is an empty string
+        """
+        return column_index == 2 and row_index % 7 == 0
+
+    def is_whitespace(self, row_index, column_index):
+        """
+        Decide whether a value of the third field is only whitespace rather than a value or a null
+
+        :param row_index: Index of the record
+        :param column_index: Index of the field
+        :return: True when the value is only whitespace
+        """
+        return column_index == 2 and row_index % 7 == 3
+
+    def is_null(self, row_index, column_index):
+        """
+        Decide whether a value is null using a cheap hash of its position
+
+        :param row_index: Index of the record
+        :param column_index: Index of the field
+        :return: True when the value is null
+        """
+        position_hash = ((row_index * 73856093) ^ (column_index * 19349663)) % NULL_PATTERN_MODULUS.value
+        return position_hash < self.null_threshold
+
+
+# FUNCTIONS (alphabetic)
+def build_synthetic_datasets(dataset_specs):
+    """
+    Build a synthetic dataset for each spec
+
+    :param dataset_specs: list of BenchmarkDatasetSpec
+    :return: list of SyntheticDataset
+    """
+    synthetic_datasets = []
+    for spec_index, dataset_spec in enumerate(dataset_specs):
+        synthetic_datasets.append(SyntheticDataset(api_id="bnch-{:04d}".format(spec_index),
+                                                   dataset_name="Benchmark Dataset {}".format(spec_index),
+                                                   row_count=dataset_spec.row_count,
+                                                   column_count=dataset_spec.column_count,
+                                                   null_density=dataset_spec.null_density))
+    return synthetic_datasets
+
+def calculate_median(values):
+    """
+    Calculate the median of a list of numbers
+
+    :param values: list of numbers
+    :return: median value, or None for an empty list
+    """
+    if not values:
+        return None
+    sorted_values = sorted(values)
+    middle_index = len(sorted_values) // 2
+    if len(sorted_values) % 2:
+        return sorted_values[middle_index]
+    else:
+        return (sorted_values[middle_index - 1] + sorted_values[middle_index]) / 2.0
+
+def compare_benchmark_results(previous_results, current_results):
+    """
+    Print how the current results compare with a previous results file
+
+    :param previous_results: results dictionary read from a previous results file
+    :param current_results: results dictionary of this benchmark
+    :return: None
+    """
+    previous_wall_seconds = previous_results.get("median_wall_seconds")
+    current_wall_seconds = current_results.get("median_wall_seconds")
+    print("COMPARISON with results of {}".format(previous_results.get("benchmark_date")))
+    if previous_wall_seconds and current_wall_seconds:
+        print("Median wall seconds: {:.2f} -> {:.2f} ({:.2f}x)".format(previous_wall_seconds,
+                                                                      current_wall_seconds,
+                                                                      previous_wall_seconds / current_wall_seconds))
+    previous_stage_seconds = previous_results.get("median_stage_seconds", {})
+    for stage_name, current_seconds in sorted(current_results.get("median_stage_seconds", {}).items()):
+        previous_seconds = previous_stage_seconds.get(stage_name)
+        if previous_seconds is None:
+            continue
+        print("  {}: {:.2f} -> {:.2f}".format(stage_name, previous_seconds, current_seconds))
+    return
+
+def is_dataset_read_from_csv_export(api_id):
+    """
+    Decide whether the run counted the nulls of a dataset from csv export pages, where empty strings are nulls
+
+    Aggregate queries and keyset paging count empty strings as values whatever the transport format.
+    :param api_id: Api id of the synthetic dataset
+    :return: True when the dataset was streamed or sampled from csv pages
+    """
+    is_aggregate_counted = ProcessPlan.USE_AGGREGATE_NULL_COUNTING.value and not ProcessPlan.PROFILE_METRICS.value
+    is_keyset_paged = ProcessPlan.KEYSET_PAGING_BY_DEFAULT.value or api_id in ProcessPlan.KEYSET_PAGING_API_IDS.value
+    return ProcessPlan.TRANSPORT_FORMAT.value == "csv" and not is_aggregate_counted and not is_keyset_paged
+
+def parse_command_line_arguments():
+    """
+    Parse the benchmark options
+
+    :return: argparse namespace
+    """
+    parser = argparse.ArgumentParser(description="Benchmark ProcessPlan.py against a local Socrata stand-in server")
+    parser.add_argument("--dataset", action="append", dest="dataset_specs", metavar="ROWS,COLUMNS,NULL_DENSITY",
+                        help="Synthetic dataset to serve. Repeat for more datasets. Default: {}".format(
+                            " ".join(DEFAULT_DATASET_SPECS.value)))
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUN_COUNT.value, help="Number of times main() is run")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MILLISECONDS.value,
+                        help="Delay the stand-in server adds to every request")
+    parser.add_argument("--set", action="append", dest="variable_overrides", default=[], metavar="NAME=VALUE",
+                        help="Override a ProcessPlan variable, value as a python literal. Repeatable.")
+    parser.add_argument("--output", default=None, help="Results json file. Default: dated file in this folder.")
+    parser.add_argument("--compare", default=None, help="Previous results json file to compare against")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Run main() as this many shard processes at once, then merge their outputs")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of main()")
+    return parser.parse_args()
+
+def parse_dataset_spec(dataset_spec_string):
+    """
+    Parse a ROWS,COLUMNS,NULL_DENSITY dataset spec
+
+    :param dataset_spec_string: spec string such as '20000,12,0.25'
+    :return: BenchmarkDatasetSpec namedtuple
+    """
+    row_count, column_count, null_density = dataset_spec_string.split(",")
+    return BenchmarkDatasetSpec(row_count=int(row_count), column_count=int(column_count),
+                                null_density=float(null_density))
+
+def parse_variable_overrides(variable_override_strings):
+    """
+    Parse NAME=VALUE overrides of ProcessPlan variables
+
+    :param variable_override_strings: list of 'NAME=VALUE' strings with python literal values
+    :return: dictionary of variable name to value
+    """
+    variable_overrides = {}
+    for override_string in variable_override_strings:
+        variable_name, value_string = override_string.split("=", 1)
+        if not isinstance(getattr(ProcessPlan, variable_name, None), ProcessPlan.Variable):
+            raise ValueError("ProcessPlan has no variable named {}".format(variable_name))
+        variable_overrides[variable_name] = ast.literal_eval(value_string)
+    return variable_overrides
+
+def read_performance_summary(file_path):
+    """
+    Read the stage times and counters from a performance summary csv written by ProcessPlan.py
+
+    :param file_path: Path to the performance summary csv
+    :return: tuple of a dictionary of stage name to seconds and a dictionary of counter name to total
+    """
+    stage_seconds = {}
+    counters = {}
+    with open(file_path, "rb") as file_handler:
+        for row in csv.reader(file_handler):
+            if len(row) != 2:
+                continue
+            stage_match = re.match(r"Stage time (\w+) \(seconds\)", row[0])
+            if stage_match:
+                stage_seconds[stage_match.group(1)] = float(row[1])
+            elif row[0].startswith("Total ") and row[0] != "Total datasets processed":
+                counters[row[0][len("Total "):]] = int(row[1])
+    return stage_seconds, counters
+
+def read_sampled_percent_intervals(file_path):
+    """
+    Read the null percent interval of each field from the csv file of a sampled dataset
+
+    :param file_path: Path to the dataset csv file
+    :return: dictionary of field name to a tuple of the lower and upper percent bounds
+    """
+    percent_intervals = {}
+    with open(file_path, "rb") as file_handler:
+        is_field_row = False
+        for row in csv.reader(file_handler):
+            if is_field_row:
+                percent_intervals[row[0]] = (float(row[3]), float(row[4]))
+            elif row and row[0] == "FIELD NAME":
+                is_field_row = True
+    return percent_intervals
+
+def run_inspection_pipeline(server_url, output_folder, variable_overrides, is_verbose, shard_count=1):
+    """
+    Run ProcessPlan.main() against the stand-in server, writing its csv files to the output folder
+
+    With more than one shard, each shard is a forked process sharing the output folder, as separate nodes would share
+    a network folder, and their outputs are merged once all have finished.
+    :param server_url: Root url of the stand-in server
+    :param output_folder: Folder for the csv output of the run
+    :param variable_overrides: dictionary of ProcessPlan variable name to value
+    :param is_verbose: When False the printed output of main() is discarded
+    :param shard_count: Number of shard processes
+    :return: Wall seconds taken by main(), including the merge
+    """
+    ProcessPlan.ROOT_URL_FOR_DATASET_ACCESS = ProcessPlan.Variable("{}/resource/".format(server_url))
+    ProcessPlan.ROOT_URL_FOR_VIEW_METADATA = ProcessPlan.Variable("{}/api/views/".format(server_url))
+    ProcessPlan.ROOT_PATH_FOR_CSV_OUTPUT = ProcessPlan.Variable(output_folder)
+    for variable_name, value in variable_overrides.items():
+        setattr(ProcessPlan, variable_name, ProcessPlan.Variable(value))
+    original_stdout = sys.stdout
+    if not is_verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        start_time = time.time()
+        ProcessPlan.process_start_time = start_time
+        if shard_count == 1:
+            ProcessPlan.main()
+        else:
+            shard_processes = [multiprocessing.Process(target=ProcessPlan.main,
+                                                       kwargs={"shard_index": shard_index, "shard_count": shard_count})
+                               for shard_index in range(shard_count)]
+            for shard_process in shard_processes:
+                shard_process.start()
+            for shard_process in shard_processes:
+                shard_process.join()
+            ProcessPlan.merge_shard_outputs(root_file_destination_location=output_folder,
+                                            run_date_string=ProcessPlan.build_today_date_string(),
+                                            shard_count=shard_count)
+        wall_seconds = time.time() - start_time
+    finally:
+        if not is_verbose:
+            sys.stdout.close()
+            sys.stdout = original_stdout
+    return wall_seconds
+
+def start_stand_in_server(synthetic_datasets, latency_seconds):
+    """
+    Start the stand-in server on a free local port in a background thread
+
+    :param synthetic_datasets: list of SyntheticDataset to serve
+    :param latency_seconds: Delay added before answering each request
+    :return: the running SodaStandInServer
+    """
+    stand_in_server = SodaStandInServer(server_address=("127.0.0.1", 0),
+                                        synthetic_datasets=synthetic_datasets,
+                                        latency_seconds=latency_seconds,
+                                        suppress_fields_header_above_columns=SUPPRESS_FIELDS_HEADER_ABOVE_COLUMNS.value)
+    server_thread = threading.Thread(target=stand_in_server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return stand_in_server
+
+def verify_inspection_outputs(output_folder, synthetic_datasets):
+    """
+    Compare the overview csv written by a run with the known null counts of the synthetic datasets
+
+    Sampled datasets only estimate their null counts, so they are verified on the record count and the share of fields
+     whose true null percent falls inside the confidence interval written for it is reported as their coverage.
+    :param output_folder: Folder holding the csv output of the run
+    :param synthetic_datasets: list of SyntheticDataset that were served
+    :return: tuple of lists of the verified, mismatched and problem dataset names, and a dictionary of sampled dataset
+     name to its interval coverage
+    """
+    today_date_string = ProcessPlan.build_today_date_string()
+    overview_rows = {}
+    overview_file_path = os.path.join(output_folder, ProcessPlan.build_csv_file_name_with_date(
+        today_date_string=today_date_string, filename=ProcessPlan.OVERVIEW_STATS_FILE_NAME.value))
+    if os.path.exists(overview_file_path):
+        with open(overview_file_path, "rb") as file_handler:
+            for row in csv.DictReader(file_handler):
+                overview_rows[row["DATASET NAME"]] = row
+    problem_names = []
+    problem_file_path = os.path.join(output_folder, ProcessPlan.build_csv_file_name_with_date(
+        today_date_string=today_date_string, filename=ProcessPlan.PROBLEM_DATASETS_FILE_NAME.value))
+    if os.path.exists(problem_file_path):
+        with open(problem_file_path, "rb") as file_handler:
+            problem_names = [row["DATASET NAME"] for row in csv.DictReader(file_handler)]
+
+    verified_names = []
+    mismatched_names = []
+    sampling_coverage = {}
+    for synthetic_dataset in synthetic_datasets:
+        if synthetic_dataset.dataset_name in problem_names:
+            continue
+        overview_row = overview_rows.get(synthetic_dataset.dataset_name)
+        expected_null_counts = synthetic_dataset.calculate_expected_null_counts(
+            is_empty_string_null=is_dataset_read_from_csv_export(api_id=synthetic_dataset.api_id))
+        expected_null_total = sum(expected_null_counts.values())
+        if overview_row is not None and overview_row["SAMPLED"] == "TRUE":
+            percent_intervals = read_sampled_percent_intervals(file_path=os.path.join(
+                output_folder, overview_row["FILE NAME"]))
+            covered_field_count = sum(
+                1 for field_name, null_count in expected_null_counts.items()
+                if field_name in percent_intervals
+                and percent_intervals[field_name][0] - 0.005
+                <= null_count * 100.0 / synthetic_dataset.row_count
+                <= percent_intervals[field_name][1] + 0.005)
+            sampling_coverage[synthetic_dataset.dataset_name] = covered_field_count / float(len(expected_null_counts))
+            if int(overview_row["TOTAL RECORD COUNT"]) == synthetic_dataset.row_count:
+                verified_names.append(synthetic_dataset.dataset_name)
+            else:
+                mismatched_names.append(synthetic_dataset.dataset_name)
+        elif (overview_row is not None
+                and int(overview_row["TOTAL RECORD COUNT"]) == synthetic_dataset.row_count
+                and int(overview_row["TOTAL NULL VALUE COUNT"]) == expected_null_total):
+            verified_names.append(synthetic_dataset.dataset_name)
+        else:
+            mismatched_names.append(synthetic_dataset.dataset_name)
+    return verified_names, mismatched_names, problem_names, sampling_coverage
+
+def write_benchmark_results(file_path, benchmark_results):
+    """
+    Write the benchmark results to a json file
+
+    :param file_path: Path to the results file
+    :param benchmark_results: results dictionary
+    :return: None
+    """
+    with open(file_path, "w") as file_handler:
+        json.dump(benchmark_results, file_handler, indent=2, sort_keys=True)
+    return
+
+
+# FUNCTIONALITY
+def main():
+    command_line_arguments = parse_command_line_arguments()
+    dataset_specs = [parse_dataset_spec(dataset_spec_string=spec_string)
+                     for spec_string in (command_line_arguments.dataset_specs or DEFAULT_DATASET_SPECS.value)]
+    variable_overrides = parse_variable_overrides(
+        variable_override_strings=command_line_arguments.variable_overrides)
+    synthetic_datasets = build_synthetic_datasets(dataset_specs=dataset_specs)
+    stand_in_server = start_stand_in_server(synthetic_datasets=synthetic_datasets,
+                                            latency_seconds=command_line_arguments.latency_ms / 1000.0)
+    server_url = "http://127.0.0.1:{}".format(stand_in_server.server_address[1])
+    print("Stand-in server at {} serving {} datasets".format(server_url, len(synthetic_datasets)))
+
+    runs = []
+    for run_number in range(1, command_line_arguments.runs + 1):
+        output_folder = tempfile.mkdtemp(prefix="socrata_benchmark_")
+        requests_before_run = stand_in_server.request_count
+        try:
+            wall_seconds = run_inspection_pipeline(server_url=server_url,
+                                                   output_folder=output_folder,
+                                                   variable_overrides=variable_overrides,
+                                                   is_verbose=command_line_arguments.verbose,
+                                                   shard_count=command_line_arguments.shards)
+            stage_seconds, counters = read_performance_summary(file_path=os.path.join(
+                output_folder, ProcessPlan.build_csv_file_name_with_date(
+                    today_date_string=ProcessPlan.build_today_date_string(),
+                    filename=ProcessPlan.PERFORMANCE_SUMMARY_FILE_NAME.value)))
+            verified_names, mismatched_names, problem_names, sampling_coverage = verify_inspection_outputs(
+                output_folder=output_folder, synthetic_datasets=synthetic_datasets)
+        finally:
+            shutil.rmtree(output_folder, ignore_errors=True)
+        runs.append({"run_number": run_number,
+                     "wall_seconds": wall_seconds,
+                     "server_requests": stand_in_server.request_count - requests_before_run,
+                     "stage_seconds": stage_seconds,
+                     "counters": counters,
+                     "verified_datasets": verified_names,
+                     "mismatched_datasets": mismatched_names,
+                     "problem_datasets": problem_names,
+                     "sampled_dataset_coverage": sampling_coverage})
+        print("Run {}: {:.2f}s, {} requests, {} verified, {} mismatched, {} problem".format(
+            run_number, wall_seconds, runs[-1]["server_requests"], len(verified_names), len(mismatched_names),
+            len(problem_names)))
+        for dataset_name, coverage in sorted(sampling_coverage.items()):
+            print("  Sampled {}: {:.0%} of fields inside their confidence interval".format(dataset_name, coverage))
+    stand_in_server.shutdown()
+
+    median_stage_seconds = {}
+    for stage_name in runs[0]["stage_seconds"]:
+        median_stage_seconds[stage_name] = calculate_median([run["stage_seconds"][stage_name] for run in runs])
+    benchmark_results = {"benchmark_date": ProcessPlan.build_today_date_string(),
+                         "latency_milliseconds": command_line_arguments.latency_ms,
+                         "variable_overrides": variable_overrides,
+                         "datasets": [dict(spec._asdict(), api_id=dataset.api_id)
+                                      for spec, dataset in zip(dataset_specs, synthetic_datasets)],
+                         "runs": runs,
+                         "median_wall_seconds": calculate_median([run["wall_seconds"] for run in runs]),
+                         "median_stage_seconds": median_stage_seconds}
+    results_file_path = command_line_arguments.output or "{}_{}.json".format(
+        RESULTS_FILE_NAME.value, time.strftime("%Y%m%d_%H%M%S"))
+    write_benchmark_results(file_path=results_file_path, benchmark_results=benchmark_results)
+    print("Median wall seconds {:.2f}. Results written to {}".format(benchmark_results["median_wall_seconds"],
+                                                                      results_file_path))
+
+    if command_line_arguments.compare:
+        with open(command_line_arguments.compare, "r") as file_handler:
+            previous_results = json.load(file_handler)
+        compare_benchmark_results(previous_results=previous_results, current_results=benchmark_results)
+
+if __name__ == "__main__":
+    main()
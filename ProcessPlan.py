@@ -11,270 +11,4060 @@ Output a csv file providing an overview of the entire process findings, a csv fi
 Author: CJuice
 Date: 20180501
 Revisions:
+20261017: Datasets are inspected concurrently by a pool of DATASET_WORKER_COUNT workers. Each inspection returns its
+ results and only the main thread writes the csv files.
+20261017: Pages of a dataset are prefetched, PAGES_IN_FLIGHT_PER_DATASET at a time, while the current page is counted.
+20261017: Nulls are counted a page at a time instead of one threaded call per record. Counts now accumulate across
+ pages rather than being reset on each page.
+20261017: Page responses are decoded as a stream of records rather than loaded whole with json.loads.
+20261017: All requests go through a shared http client with keep-alive connections, gzip and retries with backoff.
+ A dataset is only recorded as problematic, and a failed freshness report request no longer exits, after the
+ retries are used up.
+20261017: Incremental runs. Results are cached by api id with the dataset's last updated stamp, from the freshness
+ report or the response headers, and unchanged datasets are written from the cache instead of being downloaded.
+20261017: Aggregate mode. Socrata counts the values of each field with SoQL count() queries, and nulls are count(*)
+ minus count(field). Datasets where aggregation fails fall back to streaming every record.
+20261017: Overview and problem csv files are opened once per run and written through the csv module with a buffer.
+20261017: Time spent per stage (connect, first byte, download, decode, null count, csv write, sleeps) and bytes,
+ records, pages and requests are tracked per dataset, written to a stage timings csv and totalled in the summary.
+20261017: The json file asserts run under __main__ so BenchmarkReplay.py can import and run main() offline.
+20261017: Page sizes adapt per dataset, within PAGE_SIZE_MIN_RECORDS and PAGE_SIZE_MAX_RECORDS, from the column count and
+ the bytes and download time per record seen on previous pages. Replaces the fixed LIMIT_MAX_AND_OFFSET.
+20261017: Keyset paging; datasets in KEYSET_PAGING_API_IDS, or all with KEYSET_PAGING_BY_DEFAULT, are read ordered by
+ :id with each page after the last :id seen. Offset paging remains the fallback when keyset paging fails.
+20261017: Every request waits on a shared token bucket rate limiter with a concurrency cap, replacing the fixed 0.2s
+ sleep between pages. The rate rises while responses are healthy and falls on 429/503 and Retry-After.
+20261017: Checkpoint and resume. Finished datasets, report file sizes, counters, and the counts and next offset of
+ datasets part way through are saved to _RUN_CHECKPOINT.json every CHECKPOINT_INTERVAL_SECONDS. --resume continues
+ from there, cutting the report csv files back to their checkpointed size so no row is duplicated.
+20261017: Field names of datasets whose X-SODA2-Fields header is suppressed come from the view metadata endpoint
+ through an on-disk schema cache, replacing the hand saved json files of the two known wide datasets.
+20261017: Sampling mode. Datasets above SAMPLING_ROW_THRESHOLD records, and those in SAMPLING_API_IDS, are estimated
+ from a stratified random sample of pages with a confidence interval per field, marked as sampled in the csv files.
+ Replaces skipping the real property dataset.
+20261017: Sharded runs. --shard-index and --shard-count inspect only the datasets whose hashed api id falls in the
+ shard, writing partial output files and a shard summary. --merge combines the shards into the usual files.
+20261017: Result history. Every run appends its dataset and field results to an indexed sqlite store keyed by run
+ date, api id and field. --diff reports the datasets and fields whose null percent, record count or field set changed
+ between two runs, and --trend lists a dataset's or field's results across all runs, without reading old csv files.
+20261017: Field profiles. Streamed records are also profiled in the same pass, per field and in fixed memory: empty and
+ whitespace only values, min and max length, an approximate distinct count (HyperLogLog) and the most frequent values
+ (space-saving), written as extra columns of the dataset csv. Metrics are FieldProfileMetric subclasses named in
+ PROFILE_METRICS.
+20261017: Field profiles are opt in. PROFILE_METRICS is empty by default, and naming any metric streams every dataset
+ that is not sampled, in place of aggregate counting, so that a profile is always produced when one is asked for.
+20261017: Scheduling. The inventory is keyed by api id, so datasets sharing a name are all inspected. Datasets start
+ in order of expected cost, from cached or historical record and column counts or a count(*) query, most expensive
+ first. An optional time budget defers datasets not expected to finish to the next run, which starts with them.
+20261017: Null counts are held in a DatasetResult, a compact array of counts indexed by field position with interned
+ field names. Pages, aggregate queries and samples each produce one and they are summed with merge(). The performance
+ summary gains the null values and percent null over all datasets.
+20261017: --plan estimates a run before it starts: a count(*) and a field names request per changed dataset give
+ the requests, bytes and minutes under the current page size, sampling and rate limit settings, printed and saved
+ as a per dataset table.
+20261017: Csv transport. With TRANSPORT_FORMAT "csv", pages are read from the csv export, field names come from its
+ header row and empty cells are counted a column at a time, without decoding a dictionary per record.
+20261017: Decode processes. Once a streamed dataset passes DECODE_PROCESS_MIN_RECORDS records, its pages are decoded,
+ counted and profiled by a pool of DECODE_PROCESS_COUNT processes, several pages at once, and the parent sums the small
+ per page results, so a single huge dataset uses every core. The processes start with the first such page. Whole
+ pages are decoded with the first json library of JSON_BACKEND_NAMES that imports, orjson or ujson when installed,
+ otherwise the standard library.
+20261017: Csv cells are profiled as unicode like json values. An empty string is a value, as it is to count(field) in
+ aggregate mode; only csv pages, whose cells can not tell an empty string from a null, count it as a null.
+"""
+
+# IMPORTS
+from collections import Counter
+from collections import deque
+from collections import namedtuple
+from collections import OrderedDict
+import argparse
+from array import array
+import base64
+import csv
+from datetime import date
+from functools import partial
+import hashlib
+import httplib
+import importlib
+from itertools import islice
+import json
+import math
+import os
+import random
+import re
+import socket
+import sqlite3
+import struct
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+from multiprocessing import cpu_count
+from multiprocessing import Pool
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from tempfile import SpooledTemporaryFile
+
+process_start_time = time.time()
+# Set in each decode process by initialize_decode_process()
+decode_process_json_loads = json.loads
+
+# VARIABLES (alphabetic)
+Variable = namedtuple("Variable", ["value"])
+AGGREGATE_FIELDS_PER_QUERY = Variable(50)
+DatasetInspectionResult = namedtuple("DatasetInspectionResult", ["dataset_name",
+                                                                 "dataset_name_with_spaces_but_no_illegal",
+                                                                 "dataset_api_id",
+                                                                 "field_null_counts",
+                                                                 "number_of_columns_in_dataset",
+                                                                 "total_record_count",
+                                                                 "is_problematic",
+                                                                 "problem_message",
+                                                                 "problem_resource",
+                                                                 "processing_time",
+                                                                 "is_deferred",
+                                                                 "last_modified",
+                                                                 "is_from_cache",
+                                                                 "stage_timings",
+                                                                 "sampling_result",
+                                                                 "field_profiles"])
+CachedDatasetResult = namedtuple("CachedDatasetResult", ["dataset_api_id",
+                                                         "last_modified",
+                                                         "number_of_columns_in_dataset",
+                                                         "total_record_count",
+                                                         "field_null_counts",
+                                                         "field_profiles"])
+ResultChange = namedtuple("ResultChange", ["dataset_api_id",
+                                           "dataset_name",
+                                           "change",
+                                           "field_name",
+                                           "earlier_value",
+                                           "later_value"])
+DatasetInventoryEntry = namedtuple("DatasetInventoryEntry", ["api_id",
+                                                             "dataset_name",
+                                                             "data_provider",
+                                                             "last_updated"])
+DatasetCostEstimate = namedtuple("DatasetCostEstimate", ["dataset_api_id",
+                                                         "dataset_name",
+                                                         "total_record_count",
+                                                         "number_of_columns_in_dataset",
+                                                         "inspection_mode",
+                                                         "request_count",
+                                                         "byte_count",
+                                                         "seconds",
+                                                         "problem_message"])
+DatasetSamplingResult = namedtuple("DatasetSamplingResult", ["sampled_record_count",
+                                                             "sampled_page_count",
+                                                             "confidence_z_score",
+                                                             "null_proportion_intervals"])
+DecodedPageCounts = namedtuple("DecodedPageCounts", ["field_names",
+                                                     "null_counts",
+                                                     "total_record_count",
+                                                     "field_profile_states",
+                                                     "decode_seconds",
+                                                     "null_count_seconds"])
+DatasetPage = namedtuple("DatasetPage", ["url", "offset", "limit", "response_info", "response_file", "body_bytes",
+                                         "download_seconds"])
+CHECKPOINT_FILE_NAME = Variable("_RUN_CHECKPOINT.json")
+CHECKPOINT_INTERVAL_SECONDS = Variable(60)
+CSV_COUNT_CHUNK_ROWS = Variable(1000)
+DATA_FRESHNESS_REPORT_API_ID = Variable("t8k3-edvn")
+DATASET_WORKER_COUNT = Variable(4)
+DECODE_PROCESS_COUNT = Variable(None)
+DECODE_PROCESS_MIN_RECORDS = Variable(200000)
+DEFERRED_DATASETS_FILE_NAME = Variable("_DEFERRED_DATASETS.json")
+FRESHNESS_REPORT_LAST_UPDATED_FIELD = Variable("last_updated")
+HISTORY_DIFF_FILE_NAME = Variable("_RESULTS_DIFF")
+HISTORY_DIFF_MIN_PERCENT_POINTS = Variable(0.01)
+HISTORY_STORE_FILE_NAME = Variable("_RESULT_HISTORY.sqlite")
+HTTP_MAX_RETRIES = Variable(4)
+HTTP_RETRY_BACKOFF_SECONDS = Variable(1.0)
+HTTP_RETRY_STATUS_CODES = Variable((429, 500, 502, 503, 504))
+HTTP_TIMEOUT_SECONDS = Variable(120)
+JSON_BACKEND_NAMES = Variable(("orjson", "ujson", "json"))
+JSON_STREAM_CHUNK_BYTES = Variable(64 * 1024)
+KEYSET_PAGING_API_IDS = Variable(())
+KEYSET_PAGING_BY_DEFAULT = Variable(False)
+MD_STATEWIDE_VEHICLE_CRASH_STARTSWITH = Variable("Maryland Statewide Vehicle Crashes")
+OVERVIEW_STATS_CSV_HEADERS = Variable(("DATASET NAME", "FILE NAME", "TOTAL COLUMN COUNT", "TOTAL RECORD COUNT",
+                                         "TOTAL NULL VALUE COUNT", "PERCENT NULL", "DATA PROVIDER", "SAMPLED"))
+OVERVIEW_STATS_FILE_NAME = Variable("_OVERVIEW_STATS")
+PAGES_IN_FLIGHT_PER_DATASET = Variable(3)
+PAGE_SIZE_INITIAL_RECORDS = Variable(20000)
+PAGE_SIZE_MAX_GROWTH_FACTOR = Variable(2.0)
+PAGE_SIZE_MAX_RECORDS = Variable(50000)
+PAGE_SIZE_MIN_RECORDS = Variable(500)
+PAGE_SIZE_TARGET_BYTES = Variable(16 * 1024 * 1024)
+PAGE_SIZE_TARGET_CELLS = Variable(400000)
+PAGE_SIZE_TARGET_SECONDS = Variable(15.0)
+PAGE_SPOOL_MAX_MEMORY_BYTES = Variable(8 * 1024 * 1024)
+PERFORMANCE_SUMMARY_FILE_NAME = Variable("__script_performance_summary")
+PLAN_BYTES_PER_CELL = Variable(16)
+PLAN_BYTES_PER_SECOND = Variable(2 * 1024 * 1024)
+PLAN_CSV_HEADERS = Variable(("DATASET NAME", "API ID", "TOTAL RECORD COUNT", "TOTAL COLUMN COUNT", "MODE", "REQUESTS",
+                             "UNCOMPRESSED MEGABYTES", "ESTIMATED SECONDS", "PROBLEM MESSAGE"))
+PLAN_FILE_NAME = Variable("_RUN_PLAN")
+PROFILE_DISTINCT_PRECISION_BITS = Variable(12)
+PROFILE_METRICS = Variable(())
+PROFILE_TOP_VALUE_CAPACITY = Variable(50)
+PROFILE_TOP_VALUE_COUNT = Variable(5)
+PROFILE_TOP_VALUE_MAX_LENGTH = Variable(100)
+PROBLEM_DATASETS_CSV_HEADERS = Variable(("DATASET NAME", "PROBLEM MESSAGE", "RESOURCE"))
+PROBLEM_DATASETS_FILE_NAME = Variable("_PROBLEM_DATASETS")
+RATE_LIMIT_BURST_SIZE = Variable(4)
+RATE_LIMIT_MAX_CONCURRENT_REQUESTS = Variable(8)
+RATE_LIMIT_MAX_REQUESTS_PER_SECOND = Variable(20.0)
+RATE_LIMIT_MIN_REQUESTS_PER_SECOND = Variable(0.5)
+RATE_LIMIT_REQUESTS_PER_SECOND = Variable(5.0)
+RATE_LIMIT_SLOW_DOWN_FACTOR = Variable(0.5)
+RATE_LIMIT_SLOW_DOWN_STATUS_CODES = Variable((429, 503))
+RATE_LIMIT_SPEED_UP_STEP = Variable(0.25)
+REAL_PROPERTY_HIDDEN_NAMES_API_ID = Variable("ed4q-f8tm")
+REPORT_WRITER_BUFFER_ROW_COUNT = Variable(100)
+REPORT_WRITER_FLUSH_INTERVAL_SECONDS = Variable(30)
+RESULT_CACHE_FILE_NAME = Variable("_RESULT_CACHE.sqlite")
+ROOT_PATH_FOR_CSV_OUTPUT = Variable(r"E:\DoIT_OpenDataInspection_Project\OUTPUT_CSVs")
+ROOT_URL_FOR_DATASET_ACCESS = Variable(r"https://data.maryland.gov/resource/")
+ROOT_URL_FOR_VIEW_METADATA = Variable(r"https://data.maryland.gov/api/views/")
+SAMPLING_API_IDS = Variable((REAL_PROPERTY_HIDDEN_NAMES_API_ID.value,))
+SAMPLING_CONFIDENCE_Z_SCORE = Variable(1.96)
+SAMPLING_PAGE_COUNT = Variable(40)
+SAMPLING_PAGE_SIZE_RECORDS = Variable(1000)
+SAMPLING_ROW_THRESHOLD = Variable(2000000)
+SCHEDULER_COUNT_UNKNOWN_DATASETS = Variable(True)
+SCHEDULER_DEFAULT_COLUMN_COUNT = Variable(20)
+SCHEDULER_SECONDS_PER_MILLION_CELLS = Variable(20.0)
+SCHEDULER_TIME_BUDGET_SECONDS = Variable(None)
+SCHEMA_CACHE_FOLDER_NAME = Variable("_SCHEMA_CACHE")
+SHARD_SUMMARY_FILE_NAME = Variable("__shard_summary")
+STAGE_TIMINGS_FILE_NAME = Variable("__stage_timings")
+TIMING_COUNTER_NAMES = Variable(("bytes_transferred", "records", "pages", "requests"))
+TIMING_STAGE_NAMES = Variable(("http_connect", "http_first_byte", "body_download", "decode", "null_count", "csv_write",
+                               "throttle_sleep", "retry_wait"))
+TRANSPORT_FORMAT = Variable("json")
+USE_AGGREGATE_NULL_COUNTING = Variable(True)
+
+
+# CLASSES (alphabetic)
+class AdaptiveRateLimiter(object):
+    """
+    Token bucket throttle shared by every request made to Socrata during a run
+
+    Tokens refill at the current requests per second, up to the burst size, and each request takes one, waiting
+    for it when the bucket is empty. At most max_concurrent_requests requests are in progress at once. The rate
+    creeps up by speed_up_step with each healthy response and is cut by slow_down_factor when the server answers
+    with a slow down status or a Retry-After header, which also pauses all requests for the time asked. Safe to
+    share between threads.
+    """
+
+    def __init__(self, requests_per_second, min_requests_per_second, max_requests_per_second, burst_size,
+                 max_concurrent_requests, speed_up_step, slow_down_factor, slow_down_status_codes):
+        """
+        :param requests_per_second: Starting rate
+        :param min_requests_per_second: Lowest rate slowing down can reach
+        :param max_requests_per_second: Highest rate speeding up can reach
+        :param burst_size: Most requests that can be made at once after an idle period
+        :param max_concurrent_requests: Most requests in progress at the same time
+        :param speed_up_step: Requests per second added after each healthy response
+        :param slow_down_factor: Multiplier applied to the rate after a slow down response
+        :param slow_down_status_codes: Http status codes that mean the server wants fewer requests
+        """
+        self.burst_size = burst_size
+        self.concurrency_semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        self.last_refill_time = time.time()
+        self.lock = threading.Lock()
+        self.max_requests_per_second = max_requests_per_second
+        self.min_requests_per_second = min_requests_per_second
+        self.paused_until_time = 0
+        self.requests_per_second = float(requests_per_second)
+        self.slow_down_factor = slow_down_factor
+        self.slow_down_status_codes = slow_down_status_codes
+        self.speed_up_step = speed_up_step
+        self.tokens = float(burst_size)
+
+    def acquire(self):
+        """
+        Wait for a free concurrency slot and a token. Every acquire must be followed by a release.
+
+        :return: Seconds spent waiting
+        """
+        wait_start_time = time.time()
+        self.concurrency_semaphore.acquire()
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst_size,
+                              self.tokens + (now - self.last_refill_time) * self.requests_per_second)
+            self.last_refill_time = now
+            # A negative balance reserves a place in line for a token that has not been refilled yet
+            self.tokens -= 1
+            token_wait_seconds = max(0.0, -self.tokens / self.requests_per_second, self.paused_until_time - now)
+        if token_wait_seconds > 0:
+            time.sleep(token_wait_seconds)
+        return calculate_time_taken(wait_start_time)
+
+    def release(self, status_code=None, retry_after_seconds=None):
+        """
+        Free the concurrency slot and adjust the rate to the server's response
+
+        :param status_code: Http status code of the response, None when no response was received
+        :param retry_after_seconds: Value of the Retry-After header, when the response had one
+        :return: None
+        """
+        with self.lock:
+            if status_code in self.slow_down_status_codes or retry_after_seconds is not None:
+                self.requests_per_second = max(self.min_requests_per_second,
+                                               self.requests_per_second * self.slow_down_factor)
+                if retry_after_seconds is not None:
+                    self.paused_until_time = max(self.paused_until_time, time.time() + retry_after_seconds)
+            elif status_code == 200:
+                self.requests_per_second = min(self.max_requests_per_second,
+                                               self.requests_per_second + self.speed_up_step)
+        self.concurrency_semaphore.release()
+        return
+
+
+class CsvReportWriter(object):
+    """
+    Report csv file that is opened once per run and written through the csv module with a row buffer
+
+    Rows are buffered and written to disk when REPORT_WRITER_BUFFER_ROW_COUNT rows are waiting, or at the latest every
+    flush interval by a background timer, and on close. The header row is only written when the file is new. Rows
+    may be written from any thread.
+    """
+
+    def __init__(self, file_path, header_row, buffer_row_count, flush_interval_seconds, existing_row_count=0):
+        """
+        :param file_path: Path to the csv file. Appended to when it already exists.
+        :param header_row: Sequence of column names written when the file is new
+        :param buffer_row_count: Number of buffered rows that triggers a write to disk
+        :param flush_interval_seconds: Longest time a buffered row waits before being written to disk
+        :param existing_row_count: Number of rows, not counting the header, already in the file when appending
+        """
+        is_new_file = not os.path.exists(file_path)
+        # Binary mode so the csv module controls the line endings on every platform
+        self.file_handler = open(file_path, "ab")
+        self.csv_writer = csv.writer(self.file_handler, lineterminator="\n")
+        self.buffer_row_count = buffer_row_count
+        self.buffered_rows = []
+        self.flush_error = None
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.row_count = existing_row_count
+        self.stop_event = threading.Event()
+        if is_new_file:
+            self.buffered_rows.append(header_row)
+        self.flush_thread = threading.Thread(target=self._flush_periodically, args=(flush_interval_seconds,))
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def close(self):
+        """
+        Write any buffered rows, stop the flush timer and close the file
+
+        :return: None
+        """
+        self.stop_event.set()
+        self.flush_thread.join()
+        self.flush()
+        self.file_handler.close()
+        return
+
+    def flush(self):
+        """
+        Write the buffered rows to disk
+
+        :return: None
+        :raises IOError: When the rows could not be written, including by an earlier timed flush
+        """
+        with self.lock:
+            self._write_buffered_rows()
+        return
+
+    def flush_to_disk(self):
+        """
+        Write the buffered rows and make sure they reach the disk, for a checkpoint
+
+        :return: Size of the file in bytes
+        :raises IOError: When the rows could not be written, including by an earlier timed flush
+        """
+        with self.lock:
+            self._write_buffered_rows()
+            os.fsync(self.file_handler.fileno())
+            return self.file_handler.tell()
+
+    def write_row(self, row):
+        """
+        Buffer a row for writing, writing the buffer to disk once it is full
+
+        :param row: Sequence of values for the row
+        :return: None
+        :raises IOError: When the rows could not be written, including by an earlier timed flush
+        """
+        with self.lock:
+            self.buffered_rows.append(row)
+            self.row_count += 1
+            if len(self.buffered_rows) >= self.buffer_row_count:
+                self._write_buffered_rows()
+        return
+
+    def _flush_periodically(self, flush_interval_seconds):
+        """
+        Background timer that writes the buffered rows to disk every flush interval until the writer is closed
+
+        :param flush_interval_seconds: Seconds between timed flushes
+        :return: None
+        """
+        while not self.stop_event.wait(flush_interval_seconds):
+            try:
+                self.flush()
+            except IOError:
+                # Kept by _write_buffered_rows and raised to the next caller
+                pass
+        return
+
+    def _write_buffered_rows(self):
+        """
+        Write the buffered rows to disk. Caller must hold the lock.
+
+        :return: None
+        :raises IOError: When the rows could not be written
+        """
+        if self.flush_error is not None:
+            raise self.flush_error
+        if not self.buffered_rows:
+            return
+        try:
+            self.csv_writer.writerows(self.buffered_rows)
+            self.file_handler.flush()
+        except IOError as io_err:
+            self.flush_error = io_err
+            raise
+        del self.buffered_rows[:]
+        return
+
+
+class DatasetProfiler(object):
+    """
+    Profile of the values of every field of a dataset, built in the same single pass over the records as the null count
+
+    Each field gets one instance of every FieldProfileMetric subclass named in the metric names. Every metric holds a
+    fixed amount of memory however many records are profiled. Not thread safe; the thread inspecting the dataset is
+    the only one that adds records.
+    """
+
+    def __init__(self, field_names, metric_names):
+        """
+        :param field_names: list of the field names in the dataset
+        :param metric_names: sequence of FieldProfileMetric.metric_name values, in csv column order
+        """
+        metric_classes = dict((metric_class.metric_name, metric_class)
+                              for metric_class in FieldProfileMetric.__subclasses__())
+        self.field_metrics = {}
+        # The add_value methods are bound once, as add_record calls them for every value
+        self.field_value_adders = {}
+        self.metric_classes = [metric_classes[metric_name] for metric_name in metric_names]
+        for field_name in field_names:
+            self.field_metrics[field_name] = [metric_class() for metric_class in self.metric_classes]
+            self.field_value_adders[field_name] = [metric.add_value for metric in self.field_metrics[field_name]]
+
+    def add_record(self, record):
+        """
+        Add the values of one record. Fields absent from the record are nulls and are left to the null count.
+
+        :param record: dictionary of field name to value, as decoded from socrata; text values are unicode
+        :return: None
+        """
+        field_value_adders = self.field_value_adders
+        for field_name, value in record.items():
+            value_adders = field_value_adders.get(field_name)
+            if value_adders is None:
+                continue
+            if not isinstance(value, basestring):
+                value = json.dumps(value, sort_keys=True)
+            for add_value in value_adders:
+                add_value(value)
+        return
+
+    def build_csv_headers(self):
+        """
+        Build the csv column names of the profile, in the order of get_field_profiles() values
+
+        :return: list of column names
+        """
+        return [csv_header for metric_class in self.metric_classes for csv_header in metric_class.csv_headers]
+
+    def get_field_profiles(self):
+        """
+        Get the profile of every field as csv cell values
+
+        :return: dictionary of field name to list of csv cell values
+        """
+        field_profiles = {}
+        for field_name, metrics in self.field_metrics.items():
+            field_profiles[field_name] = [csv_value for metric in metrics for csv_value in metric.get_csv_values()]
+        return field_profiles
+
+    def get_state(self):
+        """
+        Get the state of every metric of every field, for a checkpoint. The state is a copy.
+
+        :return: json serializable dictionary of field name to list of metric states
+        """
+        field_states = {}
+        for field_name, metrics in self.field_metrics.items():
+            field_states[field_name] = [metric.get_state() for metric in metrics]
+        return field_states
+
+    def merge_state(self, field_states):
+        """
+        Add in the profile of other records of the dataset, such as a page profiled by a decode process. Fields the
+        dataset does not have are ignored.
+
+        :param field_states: dictionary from get_state() of a DatasetProfiler with the same metric names
+        :return: None
+        """
+        for field_name, metric_states in field_states.items():
+            metrics = self.field_metrics.get(field_name)
+            if metrics is None:
+                continue
+            for metric, metric_state in zip(metrics, metric_states):
+                metric.merge_state(state=metric_state)
+        return
+
+    def restore_state(self, field_states):
+        """
+        Restore the state of every metric of every field from a checkpoint
+
+        :param field_states: dictionary from get_state(), as read back from json
+        :return: None
+        """
+        for field_name, metric_states in field_states.items():
+            for metric, metric_state in zip(self.field_metrics[field_name.encode("utf8")], metric_states):
+                metric.restore_state(state=metric_state)
+        return
+
+
+class DatasetResult(object):
+    """
+    Null counts of every field of a dataset, or of part of a dataset, out of a number of records
+
+    The counts are a compact array of unsigned integers indexed by field position, and the field names are interned,
+    so the results of every dataset of a run can be held in memory even when thousands of datasets share wide schemas.
+    Partial results, such as those of each page, aggregate query or worker, are summed with merge().
+    """
+    __slots__ = ("field_names", "null_counts", "total_record_count")
+
+    def __init__(self, field_names, null_counts=None, total_record_count=0):
+        """
+        :param field_names: sequence of the field names, in field order
+        :param null_counts: sequence of the null count of each field, in field order, or None for all zero
+        :param total_record_count: Number of records the null counts are out of
+        """
+        self.field_names = tuple(intern(field_name) if isinstance(field_name, str) else field_name
+                                 for field_name in field_names)
+        if null_counts is None:
+            self.null_counts = array("L", [0]) * len(self.field_names)
+        else:
+            self.null_counts = array("L", null_counts)
+        self.total_record_count = total_record_count
+
+    def get_total_null_count(self):
+        """
+        Get the number of null values over all fields
+
+        :return: integer
+        """
+        return sum(self.null_counts)
+
+    def items(self):
+        """
+        Get the null count of each field, in field order
+
+        :return: list of tuples of field name and null count
+        """
+        return list(zip(self.field_names, self.null_counts))
+
+    def merge(self, other_dataset_result):
+        """
+        Add the record count and null counts of another result to this one
+
+        Fields are matched by name. Fields only the other result has are added, with the null counts they have there.
+        :param other_dataset_result: DatasetResult for other records of the same dataset
+        :return: None
+        """
+        if other_dataset_result.field_names == self.field_names:
+            null_counts = self.null_counts
+            for field_position, null_count in enumerate(other_dataset_result.null_counts):
+                null_counts[field_position] += null_count
+        else:
+            field_positions = dict((field_name, field_position)
+                                   for field_position, field_name in enumerate(self.field_names))
+            added_field_names = []
+            for field_name, null_count in other_dataset_result.items():
+                if field_name in field_positions:
+                    self.null_counts[field_positions[field_name]] += null_count
+                else:
+                    added_field_names.append(field_name)
+                    self.null_counts.append(null_count)
+            self.field_names += tuple(added_field_names)
+        self.total_record_count += other_dataset_result.total_record_count
+        return
+
+
+class DatasetResultCache(object):
+    """
+    Local store of each dataset's last inspection results, keyed by api id, for incremental runs
+
+    Holds the last modified stamp the dataset had when it was inspected along with its per field null counts, column
+    count and record count. A dataset whose stamp has not changed since is written to the output csv files from the
+    cache instead of being downloaded again. Only the main thread uses the store; workers are handed the cached
+    results read at the start of the run.
+    """
+
+    def __init__(self, database_file_path):
+        """
+        :param database_file_path: Path to the sqlite file holding the cache. Created when it does not exist.
+        """
+        # Shard processes sharing an output folder share the store, and wait on each other's writes
+        self.connection = sqlite3.connect(database_file_path, timeout=60)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS dataset_result_cache (
+                                       api_id TEXT PRIMARY KEY,
+                                       last_modified TEXT NOT NULL,
+                                       number_of_columns INTEGER,
+                                       total_record_count INTEGER NOT NULL,
+                                       field_null_counts TEXT NOT NULL,
+                                       cached_date TEXT NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS dataset_profile_cache (
+                                       api_id TEXT PRIMARY KEY,
+                                       profile_csv_headers TEXT NOT NULL,
+                                       field_profiles TEXT NOT NULL)""")
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commit any stored results and close the store
+
+        :return: None
+        """
+        self.connection.commit()
+        self.connection.close()
+        return
+
+    def read_cached_results(self, profile_csv_headers):
+        """
+        Read every cached dataset result
+
+        :param profile_csv_headers: list of the profile csv column names of this run. Cached field profiles with other
+         columns are left out.
+        :return: dictionary of api id to CachedDatasetResult namedtuple
+        """
+        cached_results = {}
+        for row in self.connection.execute("""SELECT result.api_id, result.last_modified, result.number_of_columns,
+                                                     result.total_record_count, result.field_null_counts,
+                                                     profile.profile_csv_headers, profile.field_profiles
+                                              FROM dataset_result_cache AS result
+                                              LEFT JOIN dataset_profile_cache AS profile
+                                                  ON profile.api_id = result.api_id"""):
+            api_id, last_modified, number_of_columns, total_record_count, field_null_counts_json = row[:5]
+            cached_profile_csv_headers_json, field_profiles_json = row[5:]
+            field_null_counts_dict = json.loads(field_null_counts_json, object_pairs_hook=OrderedDict)
+            field_null_counts = DatasetResult(
+                field_names=[field_name.encode("utf8") for field_name in field_null_counts_dict],
+                null_counts=field_null_counts_dict.values(),
+                total_record_count=total_record_count)
+            field_profiles = None
+            if field_profiles_json is not None and json.loads(cached_profile_csv_headers_json) == profile_csv_headers:
+                field_profiles = {}
+                for field_name, csv_values in json.loads(field_profiles_json).items():
+                    field_profiles[field_name.encode("utf8")] = [
+                        csv_value.encode("utf8") if isinstance(csv_value, unicode) else csv_value
+                        for csv_value in csv_values]
+            cached_results[api_id.encode("utf8")] = CachedDatasetResult(
+                dataset_api_id=api_id.encode("utf8"),
+                last_modified=last_modified,
+                number_of_columns_in_dataset=number_of_columns,
+                total_record_count=total_record_count,
+                field_null_counts=field_null_counts,
+                field_profiles=field_profiles)
+        return cached_results
+
+    def store_result(self, dataset_result, profile_csv_headers):
+        """
+        Store, or replace, the results of a dataset inspection
+
+        :param dataset_result: DatasetInspectionResult namedtuple with a last modified stamp
+        :param profile_csv_headers: list of the profile csv column names of the dataset's field profiles
+        :return: None
+        """
+        self.connection.execute("""INSERT OR REPLACE INTO dataset_result_cache
+                                   (api_id, last_modified, number_of_columns, total_record_count, field_null_counts,
+                                    cached_date)
+                                   VALUES (?, ?, ?, ?, ?, ?)""",
+                                (dataset_result.dataset_api_id.decode("utf8"),
+                                 dataset_result.last_modified,
+                                 dataset_result.number_of_columns_in_dataset,
+                                 dataset_result.total_record_count,
+                                 json.dumps(OrderedDict(dataset_result.field_null_counts.items())),
+                                 build_today_date_string()))
+        if dataset_result.field_profiles is None:
+            self.connection.execute("DELETE FROM dataset_profile_cache WHERE api_id = ?",
+                                    (dataset_result.dataset_api_id.decode("utf8"),))
+        else:
+            self.connection.execute("""INSERT OR REPLACE INTO dataset_profile_cache
+                                       (api_id, profile_csv_headers, field_profiles)
+                                       VALUES (?, ?, ?)""",
+                                    (dataset_result.dataset_api_id.decode("utf8"),
+                                     json.dumps(profile_csv_headers),
+                                     json.dumps(dataset_result.field_profiles)))
+        self.connection.commit()
+        return
+
+
+class DatasetScheduler(object):
+    """
+    Decides, as each dataset is picked up by a worker, whether it can still finish within the time budget of the run
+
+    The expected seconds of a dataset are its expected cost, in cells, times the seconds per cell. That rate starts at
+    SCHEDULER_SECONDS_PER_MILLION_CELLS and is replaced by the rate measured over the datasets finished so far. Without
+    a time budget every dataset is started. Datasets with no expected cost, such as unchanged cached ones, are started
+    until the budget is used up.
+    """
+
+    def __init__(self, expected_costs, time_budget_seconds, start_time, seconds_per_million_cells):
+        """
+        :param expected_costs: dictionary of api id to expected cost in cells, or None when unknown
+        :param time_budget_seconds: Seconds from the start time in which datasets must finish, or None for no budget
+        :param start_time: Time the run started
+        :param seconds_per_million_cells: Rate used until datasets of the run have finished
+        """
+        self.expected_costs = expected_costs
+        self.finished_cost = 0
+        self.finished_seconds = 0.0
+        self.lock = threading.Lock()
+        self.seconds_per_million_cells = seconds_per_million_cells
+        self.start_time = start_time
+        self.time_budget_seconds = time_budget_seconds
+
+    def is_start_allowed(self, api_id):
+        """
+        Check whether a dataset is expected to finish within the time budget if started now
+
+        :param api_id: ID specific to dataset of interest
+        :return: True when the dataset should be inspected, False when it should be deferred to the next run
+        """
+        if self.time_budget_seconds is None:
+            return True
+        remaining_seconds = self.time_budget_seconds - (time.time() - self.start_time)
+        expected_cost = self.expected_costs.get(api_id)
+        if not expected_cost:
+            return remaining_seconds > 0
+        with self.lock:
+            seconds_per_million_cells = self.seconds_per_million_cells
+            if self.finished_cost > 0:
+                seconds_per_million_cells = self.finished_seconds * 1000000.0 / self.finished_cost
+        return expected_cost * seconds_per_million_cells / 1000000.0 <= remaining_seconds
+
+    def record_finished(self, api_id, processing_time):
+        """
+        Measure the rate from an inspected dataset
+
+        :param api_id: ID specific to dataset of interest
+        :param processing_time: Seconds the inspection took
+        :return: None
+        """
+        expected_cost = self.expected_costs.get(api_id)
+        if expected_cost:
+            with self.lock:
+                self.finished_cost += expected_cost
+                self.finished_seconds += processing_time
+        return
+
+
+class DecodeProcessPageCounter(object):
+    """
+    Count the pages of a dataset in the decode processes, several pages at once, and hand the counts back in page order
+
+    Pages are read whole from the page reader and sent to the processes until as many are decoding as there are
+    processes. A page under half the size of a full one is probably the last, so no more pages are fetched until the
+    pages up to it have been counted. Only used by the thread inspecting the dataset.
+    """
+
+    def __init__(self, page_reader, decode_process_pool, field_names, profile_metric_names, stage_timings):
+        """
+        :param page_reader: PrefetchingPageReader of the dataset, paging by offset
+        :param decode_process_pool: DecodeProcessPool shared by all datasets of the run
+        :param field_names: list of the field names in the dataset
+        :param profile_metric_names: PROFILE_METRICS of the run, empty for no profile
+        :param stage_timings: StageTimings of the dataset
+        """
+        self.current_url = None
+        self.decode_process_pool = decode_process_pool
+        self.field_names = field_names
+        self.is_last_page_pending = False
+        self.page_reader = page_reader
+        self.pending_page_counts = deque()
+        self.profile_metric_names = profile_metric_names
+        self.stage_timings = stage_timings
+
+    def next_page_counts(self):
+        """
+        Get the counts of the next page, first sending the following pages to the processes
+
+        :return: tuple of the DatasetPage, its response file already closed, its DatasetResult and its profile state,
+         None without a profile
+        :raises SocrataRequestError: When the request for a page failed. current_url of the page reader holds the url.
+        :raises ValueError: When the page could not be decoded. current_url holds its url.
+        """
+        while (not self.is_last_page_pending
+               and len(self.pending_page_counts) < self.decode_process_pool.process_count):
+            dataset_page = self.page_reader.next_page()
+            try:
+                page_body = dataset_page.response_file.read()
+            finally:
+                dataset_page.response_file.close()
+            self.pending_page_counts.append((dataset_page, self.decode_process_pool.apply_async(
+                count_null_values_in_page_body,
+                (self.field_names, page_body, self.page_reader.file_format, self.profile_metric_names))))
+            full_page_bytes_per_record = self.page_reader.full_page_bytes_per_record
+            self.is_last_page_pending = (
+                full_page_bytes_per_record is None
+                or dataset_page.body_bytes < dataset_page.limit * full_page_bytes_per_record / 2)
+        dataset_page, pending_page_count = self.pending_page_counts.popleft()
+        if not self.pending_page_counts:
+            self.is_last_page_pending = False
+        self.current_url = dataset_page.url
+        decoded_page_counts = pending_page_count.get()
+        # Process time, so with several pages decoding at once it can add up to more than the dataset's time
+        self.stage_timings.add_time(stage_name="decode", seconds=decoded_page_counts.decode_seconds)
+        self.stage_timings.add_time(stage_name="null_count", seconds=decoded_page_counts.null_count_seconds)
+        self.stage_timings.add_count(counter_name="pages", amount=1)
+        self.stage_timings.add_count(counter_name="records", amount=decoded_page_counts.total_record_count)
+        return (dataset_page,
+                DatasetResult(field_names=decoded_page_counts.field_names,
+                              null_counts=decoded_page_counts.null_counts,
+                              total_record_count=decoded_page_counts.total_record_count),
+                decoded_page_counts.field_profile_states)
+
+
+class DecodeProcessPool(object):
+    """
+    Pool of processes that decode and count the pages of large datasets, so one dataset can use every core
+
+    The processes are only started when the first page is sent to them, so runs where every dataset is small or
+    counted by aggregate queries never fork any. Safe to share between threads.
+    """
+
+    def __init__(self, process_count, json_backend_names):
+        """
+        :param process_count: Number of processes
+        :param json_backend_names: JSON_BACKEND_NAMES of the run, the json backend each process chooses from
+        """
+        self.json_backend_names = json_backend_names
+        self.lock = threading.Lock()
+        self.pool = None
+        self.process_count = process_count
+
+    def apply_async(self, func, args):
+        """
+        Have a process call a function, starting the processes the first time
+
+        :param func: module level function
+        :param args: tuple of the arguments, which are pickled
+        :return: multiprocessing AsyncResult
+        """
+        with self.lock:
+            if self.pool is None:
+                print("Pages of large datasets are decoded by {} processes with {}".format(
+                    self.process_count, select_json_backend(backend_names=self.json_backend_names)[0]))
+                self.pool = Pool(processes=self.process_count,
+                                 initializer=initialize_decode_process,
+                                 initargs=(self.json_backend_names,))
+        return self.pool.apply_async(func, args)
+
+    def close(self):
+        """
+        Stop the processes, if started. Pages still pending when their dataset ended are not waited for.
+
+        :return: None
+        """
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+        return
+
+
+class FieldProfileMetric(object):
+    """
+    One measure of the values of a field, kept in fixed memory as values stream past. Subclass to add a measure and
+     name it in PROFILE_METRICS.
+
+    Values are text; values that are not strings, such as locations, arrive as their json text.
+    """
+
+    csv_headers = ()
+    metric_name = None
+
+    def add_value(self, value):
+        """
+        Add one non-null value of the field
+
+        :param value: value text
+        :return: None
+        """
+        raise NotImplementedError
+
+    def get_csv_values(self):
+        """
+        Get the measure as csv cell values, one per csv header
+
+        :return: list of csv cell values
+        """
+        raise NotImplementedError
+
+    def get_state(self):
+        """
+        Get a json serializable copy of the state, for a checkpoint
+
+        :return: json serializable state
+        """
+        raise NotImplementedError
+
+    def merge_state(self, state):
+        """
+        Add in the state of the same metric over other values of the field, such as a page profiled by a decode process
+
+        :param state: state from get_state()
+        :return: None
+        """
+        raise NotImplementedError
+
+    def restore_state(self, state):
+        """
+        Replace the state with one from get_state(), as read back from json
+
+        :param state: state from get_state()
+        :return: None
+        """
+        raise NotImplementedError
+
+
+class DistinctCountMetric(FieldProfileMetric):
+    """
+    Approximate count of the distinct values of a field, by HyperLogLog
+
+    Values are hashed to 64 bits; the first PROFILE_DISTINCT_PRECISION_BITS bits pick a register and each register
+    keeps the longest run of leading zeros seen in the remaining bits. With 12 bits the 4096 one byte registers give a
+    typical error of 1.6%.
+    """
+
+    csv_headers = ("APPROXIMATE DISTINCT COUNT",)
+    metric_name = "distinct_count"
+
+    def __init__(self):
+        self.precision_bits = PROFILE_DISTINCT_PRECISION_BITS.value
+        self.registers = bytearray(1 << self.precision_bits)
+        self.remaining_bits = 64 - self.precision_bits
+        self.remaining_bits_mask = (1 << self.remaining_bits) - 1
+
+    def add_value(self, value):
+        if isinstance(value, unicode):
+            value = value.encode("utf8")
+        hashed_value = struct.unpack("<Q", hashlib.md5(value).digest()[:8])[0]
+        register_index = hashed_value >> self.remaining_bits
+        rank = self.remaining_bits - (hashed_value & self.remaining_bits_mask).bit_length() + 1
+        if rank > self.registers[register_index]:
+            self.registers[register_index] = rank
+        return
+
+    def get_csv_values(self):
+        register_count = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / register_count)
+        estimate = alpha * register_count ** 2 / sum(2.0 ** -register for register in self.registers)
+        empty_register_count = self.registers.count(b"\x00")
+        if estimate <= 2.5 * register_count and empty_register_count > 0:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = register_count * math.log(register_count / float(empty_register_count))
+        return [int(round(estimate))]
+
+    def get_state(self):
+        return base64.b64encode(bytes(self.registers))
+
+    def merge_state(self, state):
+        self.registers = bytearray(max(registers) for registers in zip(self.registers,
+                                                                       bytearray(base64.b64decode(state))))
+        return
+
+    def restore_state(self, state):
+        self.registers = bytearray(base64.b64decode(state))
+        return
+
+
+class EmptyValueMetric(FieldProfileMetric):
+    """
+    Count of the values of a field that are present but empty, or only whitespace, so add nothing over a null
+
+    A csv cell can not tell an empty string from a null, so in csv mode empty strings are nulls and the empty count is
+    always 0.
+    """
+
+    csv_headers = ("EMPTY COUNT", "WHITESPACE COUNT")
+    metric_name = "empty_values"
+
+    def __init__(self):
+        self.empty_count = 0
+        self.whitespace_count = 0
+
+    def add_value(self, value):
+        if value == "":
+            self.empty_count += 1
+        elif value.isspace():
+            self.whitespace_count += 1
+        return
+
+    def get_csv_values(self):
+        return [self.empty_count, self.whitespace_count]
+
+    def get_state(self):
+        return [self.empty_count, self.whitespace_count]
+
+    def merge_state(self, state):
+        self.empty_count += state[0]
+        self.whitespace_count += state[1]
+        return
+
+    def restore_state(self, state):
+        self.empty_count, self.whitespace_count = state
+        return
+
+
+class TopValuesMetric(FieldProfileMetric):
+    """
+    Approximate most frequent values of a field, by the space-saving algorithm
+
+    At most PROFILE_TOP_VALUE_CAPACITY values are counted. A value not yet counted when all counters are taken
+    replaces the value with the lowest count and inherits that count, so counts are upper bounds and any value more
+    frequent than one in PROFILE_TOP_VALUE_CAPACITY is always kept. Values are cut to PROFILE_TOP_VALUE_MAX_LENGTH
+    characters.
+    """
+
+    csv_headers = ("TOP VALUES",)
+    metric_name = "top_values"
+
+    def __init__(self):
+        self.capacity = PROFILE_TOP_VALUE_CAPACITY.value
+        self.max_length = PROFILE_TOP_VALUE_MAX_LENGTH.value
+        self.value_counts = {}
+        # Values by count, and the lowest count, so the value to replace is found without a scan
+        self.count_buckets = {}
+        self.min_count = 0
+
+    def add_value(self, value):
+        value = value[:self.max_length]
+        value_counts = self.value_counts
+        count_buckets = self.count_buckets
+        count = value_counts.get(value)
+        if count is not None:
+            count_bucket = count_buckets[count]
+            count_bucket.discard(value)
+            if not count_bucket:
+                del count_buckets[count]
+                if count == self.min_count:
+                    self.min_count = count + 1
+        elif len(value_counts) < self.capacity:
+            count = 0
+            self.min_count = 1
+        else:
+            count = self.min_count
+            count_bucket = count_buckets[count]
+            del value_counts[count_bucket.pop()]
+            if not count_bucket:
+                del count_buckets[count]
+                self.min_count = count + 1
+        value_counts[value] = count + 1
+        count_buckets.setdefault(count + 1, set()).add(value)
+        return
+
+    def get_csv_values(self):
+        top_values = sorted(self.value_counts.items(), key=lambda value_count: (-value_count[1], value_count[0]))
+        return [u" | ".join(u'"{}" ({})'.format(value, count)
+                            for value, count in top_values[:PROFILE_TOP_VALUE_COUNT.value]).encode("utf8")]
+
+    def get_state(self):
+        return dict(self.value_counts)
+
+    def merge_state(self, state):
+        # Counts of the same value are summed and the highest PROFILE_TOP_VALUE_CAPACITY are kept, still upper bounds
+        value_counts = dict(self.value_counts)
+        for value, count in state.items():
+            value_counts[value] = value_counts.get(value, 0) + count
+        if len(value_counts) > self.capacity:
+            value_counts = dict(sorted(value_counts.items(),
+                                       key=lambda value_count: (-value_count[1], value_count[0]))[:self.capacity])
+        self.restore_state(state=value_counts)
+        return
+
+    def restore_state(self, state):
+        self.value_counts = dict(state)
+        self.count_buckets = {}
+        for value, count in self.value_counts.items():
+            self.count_buckets.setdefault(count, set()).add(value)
+        self.min_count = min(self.count_buckets) if self.count_buckets else 0
+        return
+
+
+class ValueLengthMetric(FieldProfileMetric):
+    """
+    Shortest and longest length, in characters, of the values of a field
+    """
+
+    csv_headers = ("MIN LENGTH", "MAX LENGTH")
+    metric_name = "value_lengths"
+
+    def __init__(self):
+        self.max_length = None
+        self.min_length = None
+
+    def add_value(self, value):
+        value_length = len(value)
+        if self.min_length is None or value_length < self.min_length:
+            self.min_length = value_length
+        if self.max_length is None or value_length > self.max_length:
+            self.max_length = value_length
+        return
+
+    def get_csv_values(self):
+        return [self.min_length, self.max_length]
+
+    def get_state(self):
+        return [self.min_length, self.max_length]
+
+    def merge_state(self, state):
+        min_length, max_length = state
+        if min_length is not None and (self.min_length is None or min_length < self.min_length):
+            self.min_length = min_length
+        if max_length is not None and (self.max_length is None or max_length > self.max_length):
+            self.max_length = max_length
+        return
+
+    def restore_state(self, state):
+        self.min_length, self.max_length = state
+        return
+
+
+class PrefetchingPageReader(object):
+    """
+    Read the pages of a single dataset in order while the requests for the following pages are already in flight.
+
+    Page N is handed to the caller for counting while pages N+1, N+2, ... are downloading, so network time and
+    processing time overlap. Pages are always returned in offset order. The caller only asks for another page after
+    a full one, stops reading when a short page arrives, and then calls close(); any pages requested beyond the end
+    of the dataset are simply discarded.
+    The page size adapts as the dataset is read. After counting a page the caller passes what it saw to
+    observe_page() and pages requested from then on are sized with calculate_page_size(). Each DatasetPage carries
+    the limit it was requested with.
+    """
+
+    def __init__(self, http_client, url_root, api_id, limit_amount, pages_in_flight, stage_timings, start_offset=0, file_format="json"):
+        """
+        :param url_root: Root socrata url common to all datasets
+        :param api_id: ID specific to dataset of interest
+        :param limit_amount: Upper limit on number of records to be returned in the first page
+        :param pages_in_flight: Number of page requests allowed to be outstanding at once
+        :param http_client: SocrataHttpClient shared by all requests of the run
+        :param stage_timings: StageTimings of the dataset
+        :param start_offset: Offset of the first page, other than 0 when resuming a dataset
+        :param file_format: "json" for pages of records, or "csv" for pages of rows under a header row
+        """
+        self.api_id = api_id
+        self.current_url = None
+        self.file_format = file_format
+        # Body bytes per record of the latest full page observed, None until one was
+        self.full_page_bytes_per_record = None
+        self.http_client = http_client
+        self.limit_amount = limit_amount
+        self.next_offset = start_offset
+        self.pages_in_flight = max(1, pages_in_flight)
+        self.pending_pages = deque()
+        self.pool = ThreadPool(self.pages_in_flight)
+        self.stage_timings = stage_timings
+        self.url_root = url_root
+
+    def close(self):
+        """
+        Stop requesting pages and wait for any requests still in flight to finish
+
+        :return: None
+        """
+        self.pool.close()
+        self.pool.join()
+        self.pending_pages.clear()
+        return
+
+    def next_page(self):
+        """
+        Get the next page of the dataset, topping up the requests in flight first
+
+        :return: DatasetPage namedtuple
+        :raises SocrataRequestError: When the request for the page failed. current_url holds the failed url.
+        """
+        # Most datasets fit in one page so the pipeline is only filled once the first page came back full
+        pages_wanted = 1 if self.next_offset == 0 else self.pages_in_flight
+        while len(self.pending_pages) < pages_wanted:
+            self._request_next_page()
+        url, offset, limit_amount, async_result = self.pending_pages.popleft()
+        self.current_url = url
+        response_info, response_file, body_bytes, download_seconds = async_result.get()
+        return DatasetPage(url=url,
+                           offset=offset,
+                           limit=limit_amount,
+                           response_info=response_info,
+                           response_file=response_file,
+                           body_bytes=body_bytes,
+                           download_seconds=download_seconds)
+
+    def observe_page(self, dataset_page, record_count, column_count):
+        """
+        Size the pages requested from now on using what was observed for a page
+
+        :param dataset_page: DatasetPage that was counted
+        :param record_count: Number of records in the page
+        :param column_count: Number of fields in the dataset
+        :return: None
+        """
+        if record_count == 0:
+            return
+        self.full_page_bytes_per_record = dataset_page.body_bytes / float(record_count)
+        self.limit_amount = calculate_page_size(current_page_size=dataset_page.limit,
+                                                column_count=column_count,
+                                                bytes_per_record=dataset_page.body_bytes / float(record_count),
+                                                seconds_per_record=dataset_page.download_seconds / record_count)
+        return
+
+    def _fetch_page(self, url):
+        """
+        Fetch a page and measure its size and how long it took, less any time waiting on the rate limiter
+
+        :param url: url to which the request is made
+        :return: tuple of the response info, the response body file, the body size in bytes and the download seconds
+        """
+        fetch_start_time = time.time()
+        throttle_seconds_before_page = self.stage_timings.get_time(stage_name="throttle_sleep")
+        response_info, response_file = fetch_dataset_page(http_client=self.http_client,
+                                                          url=url,
+                                                          stage_timings=self.stage_timings)
+        # Other pages of the dataset may be throttled meanwhile, so this can over subtract; only a size estimate
+        download_seconds = max(0.0, calculate_time_taken(fetch_start_time) - (
+            self.stage_timings.get_time(stage_name="throttle_sleep") - throttle_seconds_before_page))
+        response_file.seek(0, os.SEEK_END)
+        body_bytes = response_file.tell()
+        response_file.seek(0)
+        return response_info, response_file, body_bytes, download_seconds
+
+    def _request_next_page(self):
+        """
+        Queue the request for the page at the next offset
+
+        :return: None
+        """
+        url = build_dataset_url(url_root=self.url_root,
+                                api_id=self.api_id,
+                                limit_amount=self.limit_amount,
+                                offset=self.next_offset,
+                                file_format=self.file_format)
+        async_result = self.pool.apply_async(self._fetch_page, (url,))
+        self.pending_pages.append((url, self.next_offset, self.limit_amount, async_result))
+        self.next_offset += self.limit_amount
+        return
+
+
+class KeysetPageReader(PrefetchingPageReader):
+    """
+    Read the pages of a single dataset ordered by the :id system field, each page asking for the ids after the last
+    one seen.
+
+    Unlike $offset paging, every page costs the server the same however deep into the dataset it is, and records
+    added or deleted during the crawl cannot shift later pages so no record is skipped or counted twice. The next
+    request depends on the last :id of the current page, so pages are read one at a time without prefetching. The
+    records of each page must be passed through track_row_ids() as they are counted.
+    """
+
+    def __init__(self, http_client, url_root, api_id, limit_amount, stage_timings, start_offset=0, start_row_id=None):
+        """
+        :param url_root: Root socrata url common to all datasets
+        :param api_id: ID specific to dataset of interest
+        :param limit_amount: Upper limit on number of records to be returned in the first page
+        :param http_client: SocrataHttpClient shared by all requests of the run
+        :param stage_timings: StageTimings of the dataset
+        :param start_offset: Number of records already read, when resuming a dataset
+        :param start_row_id: :id of the last record already read, when resuming a dataset
+        """
+        PrefetchingPageReader.__init__(self,
+                                       http_client=http_client,
+                                       url_root=url_root,
+                                       api_id=api_id,
+                                       limit_amount=limit_amount,
+                                       pages_in_flight=1,
+                                       stage_timings=stage_timings,
+                                       start_offset=start_offset)
+        self.last_row_id = start_row_id
+
+    def track_row_ids(self, records):
+        """
+        Pass records through, remembering the :id of the last one for the next page request
+
+        :param records: iterable of the data record dictionaries in the page, requested with the :id field
+        :return: generator of the same records
+        :raises ValueError: When a record has no :id field
+        """
+        for record in records:
+            try:
+                self.last_row_id = record[":id"]
+            except KeyError:
+                raise ValueError("Record without :id field, keyset paging not possible")
+            yield record
+
+    def _request_next_page(self):
+        """
+        Queue the request for the page after the last :id seen
+
+        :return: None
+        """
+        url = build_keyset_dataset_url(url_root=self.url_root,
+                                       api_id=self.api_id,
+                                       limit_amount=self.limit_amount,
+                                       last_row_id=self.last_row_id)
+        async_result = self.pool.apply_async(self._fetch_page, (url,))
+        self.pending_pages.append((url, self.next_offset, self.limit_amount, async_result))
+        self.next_offset += self.limit_amount
+        return
+
+
+class ResultHistoryStore(object):
+    """
+    Local store of the results of every run, keyed by run date, api id and field, for comparing runs
+
+    One row per dataset per run holds the record count, column count and status, and one row per field per run holds
+    the null count. Every dataset in the freshness report of a run is also listed, inspected or not, so datasets that
+    were deferred or belong to a shard that did not run are not taken for removed ones. Rows are keyed by run date
+    first so a run is read with one index range, and indexed by api id and field so the trend of a dataset or field
+    across hundreds of runs is one index range too. Storing a dataset again for the same run date replaces it, so
+    resumed and repeated runs do not duplicate rows. Only the main thread uses the store.
+    """
+
+    def __init__(self, database_file_path):
+        """
+        :param database_file_path: Path to the sqlite file holding the history. Created when it does not exist.
+        """
+        # Shard processes sharing an output folder share the store, and wait on each other's writes
+        self.connection = sqlite3.connect(database_file_path, timeout=60)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS dataset_result_history (
+                                       run_date TEXT NOT NULL,
+                                       api_id TEXT NOT NULL,
+                                       dataset_name TEXT NOT NULL,
+                                       number_of_columns INTEGER,
+                                       total_record_count INTEGER NOT NULL,
+                                       is_problematic INTEGER NOT NULL,
+                                       is_sampled INTEGER NOT NULL,
+                                       PRIMARY KEY (run_date, api_id))""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS field_result_history (
+                                       run_date TEXT NOT NULL,
+                                       api_id TEXT NOT NULL,
+                                       field_name TEXT NOT NULL,
+                                       null_count INTEGER NOT NULL,
+                                       PRIMARY KEY (run_date, api_id, field_name))""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS run_inventory_history (
+                                       run_date TEXT NOT NULL,
+                                       api_id TEXT NOT NULL,
+                                       PRIMARY KEY (run_date, api_id))""")
+        self.connection.execute("""CREATE INDEX IF NOT EXISTS dataset_result_history_by_api_id
+                                   ON dataset_result_history (api_id, run_date)""")
+        self.connection.execute("""CREATE INDEX IF NOT EXISTS field_result_history_by_field
+                                   ON field_result_history (api_id, field_name, run_date)""")
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commit any stored results and close the store
+
+        :return: None
+        """
+        self.connection.commit()
+        self.connection.close()
+        return
+
+    def read_dataset_trend(self, api_id):
+        """
+        Read a dataset's results in every run, oldest first
+
+        :param api_id: ID specific to dataset of interest
+        :return: list of tuples of run date, record count, column count, total null count and problematic flag
+        """
+        return self.connection.execute("""SELECT dataset.run_date, dataset.total_record_count,
+                                                 dataset.number_of_columns, TOTAL(field.null_count),
+                                                 dataset.is_problematic
+                                          FROM dataset_result_history AS dataset
+                                          LEFT JOIN field_result_history AS field
+                                              ON field.run_date = dataset.run_date AND field.api_id = dataset.api_id
+                                          WHERE dataset.api_id = ?
+                                          GROUP BY dataset.run_date
+                                          ORDER BY dataset.run_date""", (api_id,)).fetchall()
+
+    def read_field_trend(self, api_id, field_name):
+        """
+        Read a field's null count in every run, oldest first
+
+        :param api_id: ID specific to dataset of interest
+        :param field_name: Name of the field of interest
+        :return: list of tuples of run date, record count and null count
+        """
+        return self.connection.execute("""SELECT field.run_date, dataset.total_record_count, field.null_count
+                                          FROM field_result_history AS field
+                                          JOIN dataset_result_history AS dataset
+                                              ON dataset.run_date = field.run_date AND dataset.api_id = field.api_id
+                                          WHERE field.api_id = ? AND field.field_name = ?
+                                          ORDER BY field.run_date""", (api_id, field_name)).fetchall()
+
+    def read_latest_dataset_sizes(self):
+        """
+        Read the record and column counts of every dataset from the latest run it was inspected without problems
+
+        :return: dictionary of api id to a tuple of record count and column count
+        """
+        latest_dataset_sizes = {}
+        for api_id, total_record_count, number_of_columns in self.connection.execute(
+                """SELECT api_id, total_record_count, number_of_columns
+                   FROM dataset_result_history AS dataset
+                   WHERE is_problematic = 0
+                       AND run_date = (SELECT MAX(run_date) FROM dataset_result_history AS latest
+                                       WHERE latest.api_id = dataset.api_id AND latest.is_problematic = 0)"""):
+            latest_dataset_sizes[api_id] = (total_record_count, number_of_columns)
+        return latest_dataset_sizes
+
+    def read_run_dates(self):
+        """
+        Read the dates of every run in the store
+
+        :return: list of run date strings, oldest first
+        """
+        return [row[0].encode("utf8") for row in self.connection.execute(
+            "SELECT DISTINCT run_date FROM dataset_result_history ORDER BY run_date")]
+
+    def read_run_inventory(self, run_date_string):
+        """
+        Read the api ids of every dataset in the freshness report of a run, whether inspected in the run or not
+
+        :param run_date_string: Date string of the run
+        :return: set of api ids, or None for runs stored before the inventory was
+        """
+        inventory_api_ids = set(row[0].encode("utf8") for row in self.connection.execute(
+            "SELECT api_id FROM run_inventory_history WHERE run_date = ?", (run_date_string,)))
+        return inventory_api_ids or None
+
+    def read_run_results(self, run_date_string):
+        """
+        Read the results of every dataset in a run
+
+        :param run_date_string: Date string of the run
+        :return: tuple of a dictionary of api id to (dataset name, column count, record count, problematic flag), and
+         a dictionary of api id to a dictionary of field name to null count
+        """
+        dataset_rows = {}
+        for row in self.connection.execute("""SELECT api_id, dataset_name, number_of_columns, total_record_count,
+                                                     is_problematic
+                                              FROM dataset_result_history WHERE run_date = ?""", (run_date_string,)):
+            api_id, dataset_name, number_of_columns, total_record_count, is_problematic = row
+            dataset_rows[api_id.encode("utf8")] = (dataset_name.encode("utf8"), number_of_columns, total_record_count,
+                                                   bool(is_problematic))
+        field_null_counts = {}
+        for api_id, field_name, null_count in self.connection.execute(
+                "SELECT api_id, field_name, null_count FROM field_result_history WHERE run_date = ?",
+                (run_date_string,)):
+            field_null_counts.setdefault(api_id.encode("utf8"), {})[field_name.encode("utf8")] = null_count
+        return dataset_rows, field_null_counts
+
+    def store_result(self, run_date_string, dataset_result):
+        """
+        Store, or replace, the results of a dataset inspection for a run
+
+        :param run_date_string: Date string of the run
+        :param dataset_result: DatasetInspectionResult namedtuple
+        :return: None
+        """
+        api_id = dataset_result.dataset_api_id.decode("utf8")
+        with self.connection:
+            self.connection.execute("""INSERT OR REPLACE INTO dataset_result_history
+                                       (run_date, api_id, dataset_name, number_of_columns, total_record_count,
+                                        is_problematic, is_sampled)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                    (run_date_string,
+                                     api_id,
+                                     dataset_result.dataset_name_with_spaces_but_no_illegal.decode("utf8"),
+                                     dataset_result.number_of_columns_in_dataset,
+                                     dataset_result.total_record_count,
+                                     int(dataset_result.is_problematic),
+                                     int(dataset_result.sampling_result is not None)))
+            self.connection.execute("DELETE FROM field_result_history WHERE run_date = ? AND api_id = ?",
+                                    (run_date_string, api_id))
+            self.connection.executemany("""INSERT INTO field_result_history (run_date, api_id, field_name, null_count)
+                                           VALUES (?, ?, ?, ?)""",
+                                        [(run_date_string, api_id, field_name.decode("utf8"), null_count)
+                                         for field_name, null_count
+                                         in dataset_result.field_null_counts.items()])
+        return
+
+    def store_run_inventory(self, run_date_string, api_ids):
+        """
+        Store the api ids of every dataset in the freshness report of a run. Shards of a run add the same ids.
+
+        :param run_date_string: Date string of the run
+        :param api_ids: iterable of api ids
+        :return: None
+        """
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO run_inventory_history (run_date, api_id) VALUES (?, ?)",
+                                        [(run_date_string, api_id) for api_id in api_ids])
+        return
+
+
+class RunCheckpoint(object):
+    """
+    Durable record of the progress of a run, so that a run that died can be continued with --resume
+
+    Holds the api ids of the finished datasets and, for datasets part way through, the counts so far and where the
+    next page starts. Workers update the progress of their dataset after each page; only the main thread saves,
+    together with the report file sizes and counters, so the saved state always matches the report rows on disk.
+    The file is written to a temporary file first and renamed over the old one so it is never half written.
+    """
+
+    def __init__(self, file_path, resumed_state=None):
+        """
+        :param file_path: Path to the checkpoint json file
+        :param resumed_state: State read from the checkpoint file when resuming, None for a new run
+        """
+        self.datasets_in_progress = {}
+        self.file_path = file_path
+        self.finished_api_ids = set()
+        self.last_save_time = time.time()
+        self.lock = threading.Lock()
+        if resumed_state is not None:
+            self.datasets_in_progress.update(resumed_state["datasets_in_progress"])
+            self.finished_api_ids.update(resumed_state["finished_api_ids"])
+
+    def get_dataset_progress(self, api_id):
+        """
+        Get the progress saved for a dataset part way through
+
+        :param api_id: ID specific to dataset of interest
+        :return: progress dictionary, or None when the dataset was not in progress
+        """
+        with self.lock:
+            return self.datasets_in_progress.get(api_id)
+
+    def is_save_due(self, interval_seconds):
+        """
+        Check whether the last save is older than the interval
+
+        :param interval_seconds: Seconds between saves
+        :return: True when a save is due
+        """
+        return time.time() - self.last_save_time >= interval_seconds
+
+    def mark_dataset_finished(self, api_id):
+        """
+        Record that the results of a dataset have been written to the reports
+
+        :param api_id: ID specific to dataset of interest
+        :return: None
+        """
+        with self.lock:
+            self.datasets_in_progress.pop(api_id, None)
+            self.finished_api_ids.add(api_id)
+        return
+
+    def remove(self):
+        """
+        Delete the checkpoint file once the run has completed
+
+        :return: None
+        """
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        return
+
+    def save(self, run_state):
+        """
+        Write the checkpoint file
+
+        :param run_state: dictionary of the run date, counters and report file sizes, from build_run_checkpoint_state()
+        :return: None
+        """
+        with self.lock:
+            checkpoint_state = dict(run_state,
+                                    finished_api_ids=sorted(self.finished_api_ids),
+                                    datasets_in_progress=dict(self.datasets_in_progress))
+        write_json_file_atomically(file_path=self.file_path, json_object=checkpoint_state)
+        self.last_save_time = time.time()
+        return
+
+    def update_dataset_progress(self, api_id, dataset_progress):
+        """
+        Replace the progress of a dataset part way through. The dictionary must not be changed afterwards.
+
+        :param api_id: ID specific to dataset of interest
+        :param dataset_progress: dictionary of the counts so far and where the next page starts
+        :return: None
+        """
+        with self.lock:
+            self.datasets_in_progress[api_id] = dataset_progress
+        return
+
+
+class SchemaCache(object):
+    """
+    Field names of datasets whose X-SODA2-Fields header Socrata suppresses because they have too many fields
+
+    The column metadata is fetched once from the view metadata endpoint and its field names are stored on disk, one
+    json file per api id, together with the view's last modified time and the dataset's last modified stamp. Socrata
+    sends that stamp in the headers of every records response, which is already at hand when the field names are
+    needed, so no extra request checks whether the view changed. The freshness report stamp stands in when the
+    headers have none. A stored entry is used for as long as the stamp is unchanged. Each entry is parsed at most
+    once per run and then served from memory. Safe to share between threads.
+    """
+
+    def __init__(self, http_client, folder_path):
+        """
+        :param http_client: SocrataHttpClient shared by all requests of the run
+        :param folder_path: Folder holding the stored entries. Created when missing.
+        """
+        self.field_names_by_api_id = {}
+        self.folder_path = folder_path
+        self.http_client = http_client
+        self.lock = threading.Lock()
+        if not os.path.isdir(folder_path):
+            os.makedirs(folder_path)
+
+    def get_field_names(self, api_id, response_info, freshness_report_last_updated, stage_timings):
+        """
+        Get the visible field names of a dataset
+
+        :param api_id: ID specific to dataset of interest
+        :param response_info: response info (headers) of a request for records of the dataset, or None
+        :param freshness_report_last_updated: Last updated stamp of the dataset in the freshness report, or None
+        :param stage_timings: StageTimings of the dataset
+        :return: list of field names
+        :raises SocrataRequestError: When the view metadata could not be fetched
+        :raises ValueError: When the view metadata has no usable column list
+        """
+        with self.lock:
+            field_names = self.field_names_by_api_id.get(api_id)
+        if field_names is not None:
+            return field_names
+
+        dataset_last_modified = None
+        if response_info is not None:
+            dataset_last_modified = read_last_modified_from_response_info(response_info=response_info)
+        if dataset_last_modified is None:
+            dataset_last_modified = freshness_report_last_updated
+        schema_file_path = os.path.join(self.folder_path, "{}.json".format(api_id))
+        schema_entry = None
+        if dataset_last_modified is not None and os.path.exists(schema_file_path):
+            schema_entry = json.loads(read_json_file(file_path=schema_file_path))
+            # The stamp the entry was fetched under; an entry is only used while the dataset has not changed since
+            if schema_entry.get("dataset_last_modified") != dataset_last_modified:
+                schema_entry = None
+        if schema_entry is None:
+            url = build_view_metadata_url(url_root=ROOT_URL_FOR_VIEW_METADATA.value, api_id=api_id)
+            print(url)
+            response_info, response_file = self.http_client.get(url=url, stage_timings=stage_timings)
+            try:
+                view_metadata = json.load(response_file)
+            finally:
+                response_file.close()
+            field_names_dictionary = grab_field_names_for_mega_columned_datasets(socrata_json_object=view_metadata)
+            schema_entry = {"api_id": api_id,
+                            "view_last_modified": view_metadata.get("viewLastModified"),
+                            "dataset_last_modified": dataset_last_modified,
+                            "field_names": field_names_dictionary}
+            write_json_file_atomically(file_path=schema_file_path, json_object=schema_entry)
+
+        field_names = [field_name.encode("utf8") for field_name in schema_entry["field_names"]["visible"]]
+        with self.lock:
+            self.field_names_by_api_id[api_id] = field_names
+        return field_names
+
+
+class SocrataHttpClient(object):
+    """
+    Shared http client for every request made to Socrata during a run
+
+    Connections are kept alive and reused per host, responses are requested gzip compressed and decompressed as they
+    are read, and transient failures (connection resets, timeouts, 429 and 5xx responses) are retried with
+    exponential backoff. Only when the retries are used up is a SocrataRequestError raised. Every attempt waits on
+    the shared rate limiter first and reports the response back to it. Safe to share between threads; each request
+    holds its own connection until the response body has been read.
+    """
+
+    def __init__(self, timeout_seconds, max_retries, retry_backoff_seconds, retry_status_codes, rate_limiter):
+        """
+        :param timeout_seconds: Socket timeout for connecting and for each read
+        :param max_retries: Number of times a failed request is retried before giving up
+        :param retry_backoff_seconds: Wait before the first retry, doubled for each retry after that
+        :param retry_status_codes: Http status codes that are considered transient and retried
+        :param rate_limiter: AdaptiveRateLimiter shared by all requests of the run
+        """
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.retry_status_codes = retry_status_codes
+        self.timeout_seconds = timeout_seconds
+
+    def close(self):
+        """
+        Close all idle connections
+
+        :return: None
+        """
+        with self.lock:
+            for connections_list in self.idle_connections.values():
+                for connection in connections_list:
+                    connection.close()
+            self.idle_connections.clear()
+        return
+
+    def get(self, url, stage_timings=None):
+        """
+        Make a GET request and download the entire, decompressed, response body into a spooled temporary file
+
+        The body stays in memory up to PAGE_SPOOL_MAX_MEMORY_BYTES and rolls over to disk beyond that.
+        :param url: url to which the request is made
+        :param stage_timings: StageTimings that the throttle, connect, first byte, download and retry times are
+         added to
+        :return: tuple of the response info (headers) and the response body file, positioned at the start
+        :raises SocrataRequestError: When the request failed and could not be completed within the retries
+        """
+        if stage_timings is None:
+            stage_timings = StageTimings()
+        parsed_url = urlparse.urlsplit(url)
+        host_key = (parsed_url.scheme, parsed_url.netloc)
+        path_and_query = urlparse.urlunsplit(("", "", parsed_url.path or "/", parsed_url.query, ""))
+        attempt_number = 0
+        while True:
+            stage_timings.add_time(stage_name="throttle_sleep", seconds=self.rate_limiter.acquire())
+            connection = self._acquire_connection(host_key=host_key)
+            response_status = None
+            retry_after_seconds = None
+            try:
+                if connection.sock is None:
+                    stage_start_time = time.time()
+                    connection.connect()
+                    stage_timings.add_time(stage_name="http_connect", seconds=calculate_time_taken(stage_start_time))
+                stage_start_time = time.time()
+                connection.request("GET", path_and_query, headers={"Accept-Encoding": "gzip",
+                                                                   "Connection": "keep-alive"})
+                http_response = connection.getresponse()
+                stage_timings.add_time(stage_name="http_first_byte", seconds=calculate_time_taken(stage_start_time))
+                stage_timings.add_count(counter_name="requests", amount=1)
+                response_status = http_response.status
+                retry_after_header = http_response.getheader("Retry-After")
+                if retry_after_header is not None and retry_after_header.isdigit():
+                    retry_after_seconds = float(retry_after_header)
+                if http_response.status == 200:
+                    stage_start_time = time.time()
+                    response_file = self._read_body_to_file(http_response=http_response, stage_timings=stage_timings)
+                    stage_timings.add_time(stage_name="body_download", seconds=calculate_time_taken(stage_start_time))
+                    self._release_connection(host_key=host_key, connection=connection, http_response=http_response)
+                    return http_response.msg, response_file
+                http_response.read()
+                self._release_connection(host_key=host_key, connection=connection, http_response=http_response)
+                if http_response.status not in self.retry_status_codes or attempt_number >= self.max_retries:
+                    raise SocrataRequestError(url=url, code=http_response.status, reason=http_response.reason)
+                failure_description = "Error Code: {}".format(http_response.status)
+            except (httplib.HTTPException, socket.error, zlib.error) as connection_err:
+                connection.close()
+                if attempt_number >= self.max_retries:
+                    raise SocrataRequestError(url=url, reason=repr(connection_err))
+                failure_description = "Reason: {}".format(repr(connection_err))
+            finally:
+                self.rate_limiter.release(status_code=response_status, retry_after_seconds=retry_after_seconds)
+
+            wait_seconds = self.retry_backoff_seconds * (2 ** attempt_number)
+            if retry_after_seconds is not None:
+                wait_seconds = max(wait_seconds, retry_after_seconds)
+            attempt_number += 1
+            print("Retry {} of {} in {:4.2f}s. {} {}".format(attempt_number, self.max_retries, wait_seconds,
+                                                             failure_description, url))
+            time.sleep(wait_seconds)
+            stage_timings.add_time(stage_name="retry_wait", seconds=wait_seconds)
+
+    def _acquire_connection(self, host_key):
+        """
+        Get an idle connection to the host, or open a new one when none are idle
+
+        :param host_key: tuple of url scheme and network location
+        :return: httplib connection
+        """
+        with self.lock:
+            connections_list = self.idle_connections.get(host_key)
+            if connections_list:
+                return connections_list.pop()
+        scheme, netloc = host_key
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout_seconds)
+        else:
+            return httplib.HTTPConnection(netloc, timeout=self.timeout_seconds)
+
+    def _read_body_to_file(self, http_response, stage_timings):
+        """
+        Read the response body into a spooled temporary file, decompressing it when gzip encoded
+
+        :param http_response: httplib response whose body has not been read
+        :param stage_timings: StageTimings that the bytes transferred, before decompression, are added to
+        :return: spooled temporary file positioned at the start
+        """
+        decompressor = None
+        if (http_response.getheader("Content-Encoding") or "").lower() == "gzip":
+            # 16 + MAX_WBITS tells zlib to expect the gzip header and trailer
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        response_file = SpooledTemporaryFile(max_size=PAGE_SPOOL_MAX_MEMORY_BYTES.value)
+        while True:
+            chunk = http_response.read(JSON_STREAM_CHUNK_BYTES.value)
+            if not chunk:
+                break
+            stage_timings.add_count(counter_name="bytes_transferred", amount=len(chunk))
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            response_file.write(chunk)
+        if decompressor is not None:
+            response_file.write(decompressor.flush())
+        response_file.seek(0)
+        return response_file
+
+    def _release_connection(self, host_key, connection, http_response):
+        """
+        Return a connection to the idle pool for reuse, unless the server is closing it
+
+        :param host_key: tuple of url scheme and network location
+        :param connection: httplib connection whose response has been completely read
+        :param http_response: the response that was read on the connection
+        :return: None
+        """
+        if http_response.will_close:
+            connection.close()
+            return
+        with self.lock:
+            self.idle_connections.setdefault(host_key, []).append(connection)
+        return
+
+
+class SocrataRequestError(Exception):
+    """
+    Raised when a request to Socrata failed and could not be completed within the allowed retries
+    """
+
+    def __init__(self, url, code=None, reason=None):
+        """
+        :param url: url of the failed request
+        :param code: Http status code of the last response, when the server responded
+        :param reason: Reason given for the failure
+        """
+        Exception.__init__(self, url, code, reason)
+        self.code = code
+        self.reason = reason
+        self.url = url
+
+    def __str__(self):
+        if self.code is not None:
+            return "The server couldn't fulfill the request. Error Code: {}".format(self.code)
+        else:
+            return "Failed to reach a server. Reason: {}".format(self.reason)
+
+
+class StageTimings(object):
+    """
+    Time spent in each processing stage, and throughput counters, for one dataset or for a whole run
+
+    Stages are listed in TIMING_STAGE_NAMES and counters in TIMING_COUNTER_NAMES. Pages are fetched by several threads
+    at once, so the stage times of a dataset can add up to more than its processing time. Safe to share between
+    threads.
+    """
+
+    def __init__(self):
+        self.counters = dict((counter_name, 0) for counter_name in TIMING_COUNTER_NAMES.value)
+        self.lock = threading.Lock()
+        self.stage_seconds = dict((stage_name, 0.0) for stage_name in TIMING_STAGE_NAMES.value)
+
+    def add_count(self, counter_name, amount):
+        """
+        Add to a throughput counter
+
+        :param counter_name: Name of the counter, one of TIMING_COUNTER_NAMES
+        :param amount: Amount added to the counter
+        :return: None
+        """
+        with self.lock:
+            self.counters[counter_name] += amount
+        return
+
+    def add_time(self, stage_name, seconds):
+        """
+        Add time spent in a stage
+
+        :param stage_name: Name of the stage, one of TIMING_STAGE_NAMES
+        :param seconds: Seconds spent in the stage
+        :return: None
+        """
+        with self.lock:
+            self.stage_seconds[stage_name] += seconds
+        return
+
+    def get_time(self, stage_name):
+        """
+        Get the total time spent in a stage so far
+
+        :param stage_name: Name of the stage, one of TIMING_STAGE_NAMES
+        :return: Seconds spent in the stage
+        """
+        with self.lock:
+            return self.stage_seconds[stage_name]
+
+    def merge(self, other_stage_timings):
+        """
+        Add the times and counters of another StageTimings to these, as when totalling datasets for the run
+
+        :param other_stage_timings: StageTimings to add
+        :return: None
+        """
+        with other_stage_timings.lock:
+            other_stage_seconds = dict(other_stage_timings.stage_seconds)
+            other_counters = dict(other_stage_timings.counters)
+        with self.lock:
+            for stage_name, seconds in other_stage_seconds.items():
+                self.stage_seconds[stage_name] += seconds
+            for counter_name, amount in other_counters.items():
+                self.counters[counter_name] += amount
+        return
+
+
+# FUNCTIONS (alphabetic)
+def build_aggregate_query_url(url_root, api_id, field_names):
+    """
+    Build the url for a SoQL query that has socrata count the records, and the non-null values of each field given
+
+    Fields are aliased by position (c0, c1, ...) so that unusual field names can not clash with the result keys.
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param field_names: list of the field names to count
+    :return: String url
+    """
+    select_expressions = ["count(*) AS total_count"]
+    for field_index, field_name in enumerate(field_names):
+        select_expressions.append("count(`{}`) AS c{}".format(field_name, field_index))
+    select_clause = urllib.quote(", ".join(select_expressions), safe="*(),")
+    return "{}{}.json?$select={}".format(url_root, api_id, select_clause)
+
+def build_csv_file_name_with_date(today_date_string, filename):
+    """
+    Build a string, ending in .csv, that contains todays date and the input file name
+
+    :param today_date_string: Intended to be the date the file will be created
+    :param filename: Name of the file
+    :return: string that is 'date_filename.csv'
+    """
+    return "{}_{}.csv".format(today_date_string, filename)
+
+def build_dataset_url(url_root, api_id, limit_amount, offset, file_format="json"):
+    """
+    Build the url used for each request for data from socrata
+
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param limit_amount: Upper limit on number of records to be returned in response to request
+    :param offset: If more than one request, offset the range of records requested by this amount
+    :param file_format: "json" or "csv", the format socrata exports the records in
+    :return: String url
+    """
+    # Page sizes vary by dataset so any request past the first page must include the offset parameter
+    if offset > 0:
+        return "{}{}.{}?$limit={}&$offset={}".format(url_root, api_id, file_format, limit_amount, offset)
+    else:
+        return "{}{}.{}?$limit={}".format(url_root, api_id, file_format, limit_amount)
+
+def build_datasets_inventory(freshness_report_json_objects):
+    """
+    Process json response code for dataset names, api id's, providers and last updated stamps and build a dictionary
+     for use
+
+    Keyed by api id, as dataset names are not unique.
+    :param freshness_report_json_objects: json returned by socrata per our request
+    :return: Dictionary in format of ['dataset api id' : DatasetInventoryEntry namedtuple]
+    """
+    datasets_dictionary = {}
+    for record_obj in freshness_report_json_objects:
+        api_id = os.path.basename(record_obj["link"])
+        data_provider = handle_illegal_characters_in_string(
+            string_with_illegals=(record_obj["data_provided_by"]).encode("utf8"),
+            spaces_allowed=True)
+        datasets_dictionary[api_id] = DatasetInventoryEntry(
+            api_id=api_id,
+            dataset_name=record_obj["dataset_name"],
+            data_provider=os.path.basename(data_provider),
+            last_updated=record_obj.get(FRESHNESS_REPORT_LAST_UPDATED_FIELD.value))
+    return datasets_dictionary
+
+def build_decode_process_pool():
+    """
+    Build the pool of processes that decode and count the pages of large datasets, from the DECODE_PROCESS_ settings
+
+    :return: DecodeProcessPool, or None when DECODE_PROCESS_COUNT is 0
+    """
+    process_count = DECODE_PROCESS_COUNT.value
+    if process_count is None:
+        process_count = cpu_count()
+    if process_count < 1:
+        return None
+    return DecodeProcessPool(process_count=process_count, json_backend_names=JSON_BACKEND_NAMES.value)
+
+def build_http_client():
+    """
+    Build the http client of a run, with its rate limiter, from the HTTP_ and RATE_LIMIT_ settings
+
+    :return: SocrataHttpClient
+    """
+    rate_limiter = AdaptiveRateLimiter(requests_per_second=RATE_LIMIT_REQUESTS_PER_SECOND.value,
+                                       min_requests_per_second=RATE_LIMIT_MIN_REQUESTS_PER_SECOND.value,
+                                       max_requests_per_second=RATE_LIMIT_MAX_REQUESTS_PER_SECOND.value,
+                                       burst_size=RATE_LIMIT_BURST_SIZE.value,
+                                       max_concurrent_requests=RATE_LIMIT_MAX_CONCURRENT_REQUESTS.value,
+                                       speed_up_step=RATE_LIMIT_SPEED_UP_STEP.value,
+                                       slow_down_factor=RATE_LIMIT_SLOW_DOWN_FACTOR.value,
+                                       slow_down_status_codes=RATE_LIMIT_SLOW_DOWN_STATUS_CODES.value)
+    return SocrataHttpClient(timeout_seconds=HTTP_TIMEOUT_SECONDS.value,
+                             max_retries=HTTP_MAX_RETRIES.value,
+                             retry_backoff_seconds=HTTP_RETRY_BACKOFF_SECONDS.value,
+                             retry_status_codes=HTTP_RETRY_STATUS_CODES.value,
+                             rate_limiter=rate_limiter)
+
+def build_keyset_dataset_url(url_root, api_id, limit_amount, last_row_id):
+    """
+    Build the url for a page of records ordered by the :id system field, starting after the last :id seen
+
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param limit_amount: Upper limit on number of records to be returned in response to request
+    :param last_row_id: :id of the last record of the previous page, None for the first page
+    :return: String url
+    """
+    query_parts = ["$select=:id,*", "$order=:id", "$limit={}".format(limit_amount)]
+    if last_row_id is not None:
+        query_parts.append("$where=:id > '{}'".format(last_row_id.replace("'", "''")))
+    return "{}{}.json?{}".format(url_root, api_id, urllib.quote("&".join(query_parts), safe="$=&:,*'"))
+
+def build_page_reader(http_client, api_id, limit_amount, use_keyset_paging, stage_timings, start_offset=0, start_row_id=None):
+    """
+    Build the reader that pages through the records of a dataset
+
+    Offset paging reads pages in the TRANSPORT_FORMAT. Keyset paging always reads json, as it tracks the :id of
+     every record.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param api_id: ID specific to dataset of interest
+    :param limit_amount: Upper limit on number of records to be returned in the first page
+    :param use_keyset_paging: True for a KeysetPageReader, False for an offset paging PrefetchingPageReader
+    :param stage_timings: StageTimings of the dataset
+    :param start_offset: Number of records already read, when resuming a dataset
+    :param start_row_id: :id of the last record already read, when resuming a dataset with keyset paging
+    :return: KeysetPageReader or PrefetchingPageReader
+    """
+    if use_keyset_paging:
+        return KeysetPageReader(http_client=http_client,
+                                url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                api_id=api_id,
+                                limit_amount=limit_amount,
+                                stage_timings=stage_timings,
+                                start_offset=start_offset,
+                                start_row_id=start_row_id)
+    else:
+        return PrefetchingPageReader(http_client=http_client,
+                                     url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                     api_id=api_id,
+                                     limit_amount=limit_amount,
+                                     pages_in_flight=PAGES_IN_FLIGHT_PER_DATASET.value,
+                                     stage_timings=stage_timings,
+                                     start_offset=start_offset,
+                                     file_format=TRANSPORT_FORMAT.value)
+
+def build_run_checkpoint_state(run_date_string, dataset_counters, report_writers, run_stage_timings, deferred_api_ids):
+    """
+    Build the run wide part of a checkpoint, flushing the report files so their sizes match the rows written
+
+    :param run_date_string: Date string used in the report file names of the run
+    :param dataset_counters: dictionary of counter name to value for the performance summary
+    :param report_writers: dictionary of report name to CsvReportWriter
+    :param run_stage_timings: StageTimings totalled over the datasets finished so far
+    :param deferred_api_ids: list of the api ids deferred to the next run so far
+    :return: dictionary for RunCheckpoint.save()
+    """
+    report_files = {}
+    for report_name, report_writer in report_writers.items():
+        report_files[report_name] = {"byte_size": report_writer.flush_to_disk(),
+                                     "row_count": report_writer.row_count}
+    return {"run_date": run_date_string,
+            "dataset_counters": dataset_counters,
+            "report_files": report_files,
+            "stage_seconds": dict(run_stage_timings.stage_seconds),
+            "stage_counters": dict(run_stage_timings.counters),
+            "deferred_api_ids": list(deferred_api_ids)}
+
+def build_sample_page_url(url_root, api_id, limit_amount, offset, file_format="json"):
+    """
+    Build the url for a sampled page of records, ordered by :id so that an offset always means the same records
+
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param limit_amount: Number of records in the page
+    :param offset: Position of the first record of the page
+    :param file_format: "json" or "csv", the format socrata exports the records in
+    :return: String url
+    """
+    return "{}{}.{}?$order=:id&$limit={}&$offset={}".format(url_root, api_id, file_format, limit_amount, offset)
+
+def build_shard_file_name(filename, shard_index, shard_count):
+    """
+    Build the name of a shard's partial output file, or the usual name when the run is not sharded
+
+    :param filename: Name of the file, without extension
+    :param shard_index: Index of the shard, from 0
+    :param shard_count: Number of shards the datasets are split into
+    :return: string that is 'filename_SHARD_index_OF_count'
+    """
+    if shard_count == 1:
+        return filename
+    return "{}_SHARD_{}_OF_{}".format(filename, shard_index, shard_count)
+
+def build_stage_timings_csv_headers():
+    """
+    Build the header row of the stage timings csv from the stage and counter names
+
+    :return: list of column names
+    """
+    headers = ["DATASET NAME", "API ID", "PROCESSING TIME"]
+    for stage_name in TIMING_STAGE_NAMES.value:
+        headers.append("{} SECONDS".format(stage_name.upper()))
+    for counter_name in TIMING_COUNTER_NAMES.value:
+        headers.append(counter_name.upper())
+    headers.append("RECORDS PER SECOND")
+    return headers
+
+def build_today_date_string():
+    """
+    Build a string representing todays date
+
+    :return: string representing date formatted as Year Month Day
+    """
+    return "{:%Y%m%d}".format(date.today())
+
+def build_view_metadata_url(url_root, api_id):
+    """
+    Build the url of the metadata of a dataset's view, which lists its columns
+
+    :param url_root: Root socrata view metadata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :return: String url
+    """
+    return "{}{}.json".format(url_root, api_id)
+
+def calculate_dataset_shard_index(api_id, shard_count):
+    """
+    Assign a dataset to a shard by hashing its api id, so every node computes the same split without coordinating
+
+    :param api_id: ID specific to dataset of interest
+    :param shard_count: Number of shards the datasets are split into
+    :return: integer shard index, from 0
+    """
+    return int(int(hashlib.md5(api_id).hexdigest(), 16) % shard_count)
+
+def calculate_expected_dataset_cost(total_record_count, number_of_columns_in_dataset):
+    """
+    Calculate the expected cost of inspecting a dataset as the number of cells it holds
+
+    :param total_record_count: Number of records in the dataset
+    :param number_of_columns_in_dataset: Number of fields in the dataset, or None when unknown
+    :return: integer number of cells
+    """
+    return total_record_count * (number_of_columns_in_dataset or SCHEDULER_DEFAULT_COLUMN_COUNT.value)
+
+def calculate_null_confidence_interval(page_null_counts, page_record_counts, total_record_count, z_score):
+    """
+    Estimate the null proportion of a field from sampled pages, with a confidence interval
+
+    Records of a page are not independent, so the interval is a Wilson score interval on an effective sample size:
+     the sampled record count divided by the design effect (the variance between pages relative to that of a simple
+     random sample of records) and by the finite population correction.
+    :param page_null_counts: list of the null count of the field in each sampled page
+    :param page_record_counts: list of the record count of each sampled page, in the same order
+    :param total_record_count: Number of records in the whole dataset
+    :param z_score: Standard normal quantile of the confidence level, 1.96 for 95%
+    :return: tuple of the estimated null proportion and the lower and upper bounds of its interval, all from 0 to 1
+    """
+    sampled_record_count = float(sum(page_record_counts))
+    null_proportion = sum(page_null_counts) / sampled_record_count
+    page_count = len(page_record_counts)
+    design_effect = 1.0
+    if page_count > 1 and 0 < null_proportion < 1:
+        mean_page_record_count = sampled_record_count / page_count
+        residual_sum_of_squares = sum((null_count - null_proportion * record_count) ** 2
+                                      for null_count, record_count in zip(page_null_counts, page_record_counts))
+        page_variance = residual_sum_of_squares / ((page_count - 1) * page_count * mean_page_record_count ** 2)
+        simple_random_variance = null_proportion * (1 - null_proportion) / sampled_record_count
+        design_effect = max(1.0, page_variance / simple_random_variance)
+    finite_population_correction = 1 - sampled_record_count / total_record_count
+    if finite_population_correction <= 0:
+        return null_proportion, null_proportion, null_proportion
+    effective_sample_size = sampled_record_count / (design_effect * finite_population_correction)
+    z_squared = z_score ** 2
+    denominator = 1 + z_squared / effective_sample_size
+    center = (null_proportion + z_squared / (2 * effective_sample_size)) / denominator
+    half_width = z_score * math.sqrt(null_proportion * (1 - null_proportion) / effective_sample_size
+                                     + z_squared / (4 * effective_sample_size ** 2)) / denominator
+    return null_proportion, max(0.0, center - half_width), min(1.0, center + half_width)
+
+def calculate_page_size(current_page_size, column_count=None, bytes_per_record=None, seconds_per_record=None):
+    """
+    Calculate the number of records to request in the next page of a dataset
+
+    The page size aims at PAGE_SIZE_TARGET_CELLS values per page for the column count, and at PAGE_SIZE_TARGET_BYTES
+     and PAGE_SIZE_TARGET_SECONDS per response for what was observed on previous pages. It grows by at most
+     PAGE_SIZE_MAX_GROWTH_FACTOR per page, shrinks as far as needed, and stays within the min and max page sizes.
+    :param current_page_size: Records requested in the latest page
+    :param column_count: Number of fields in the dataset, when known
+    :param bytes_per_record: Observed response body bytes per record, when known
+    :param seconds_per_record: Observed download seconds per record, when known
+    :return: integer number of records
+    """
+    candidate_page_sizes = [current_page_size * PAGE_SIZE_MAX_GROWTH_FACTOR.value]
+    if column_count:
+        candidate_page_sizes.append(PAGE_SIZE_TARGET_CELLS.value / float(column_count))
+    if bytes_per_record:
+        candidate_page_sizes.append(PAGE_SIZE_TARGET_BYTES.value / bytes_per_record)
+    if seconds_per_record:
+        candidate_page_sizes.append(PAGE_SIZE_TARGET_SECONDS.value / seconds_per_record)
+    page_size = int(min(candidate_page_sizes))
+    return max(PAGE_SIZE_MIN_RECORDS.value, min(PAGE_SIZE_MAX_RECORDS.value, page_size))
+
+def calculate_percent_null_for_dataset(null_count_total, total_records_processed, number_of_fields_in_dataset):
+    """
+    Calculate the percent of all possible data values, not rows or columns, that are null
+
+    :param null_count_total: Total number of null values
+    :param total_records_processed: Total number or records processed
+    :param number_of_fields_in_dataset: Total number of columns in the dataset
+    :return: Percent value as a float
+    """
+    if number_of_fields_in_dataset is None:
+        return 0
+    else:
+        total_number_of_values_in_dataset = float(total_records_processed*number_of_fields_in_dataset)
+        if total_number_of_values_in_dataset == 0:
+            return 0
+        else:
+            return (float(null_count_total/total_number_of_values_in_dataset)*100)
+
+def calculate_percent_null_for_field(null_count, total_records_processed):
+    """
+    Calculate the percent of the records of a dataset that are null in a field, rounded as written to the csv files
+
+    :param null_count: Number of null values in the field
+    :param total_records_processed: Number of records in the dataset
+    :return: percent, from 0 to 100, to two decimal places
+    """
+    if not total_records_processed:
+        return 0.0
+    return round(null_count * 100.0 / total_records_processed, 2)
+
+def calculate_results_changes(earlier_dataset_rows, earlier_field_null_counts, later_dataset_rows, later_field_null_counts, min_percent_points, earlier_inventory_api_ids=None, later_inventory_api_ids=None):
+    """
+    Compare the results of two runs, as read by ResultHistoryStore.read_run_results(), dataset by dataset
+
+    Fields are only compared when the dataset was inspected without problems in both runs. A dataset without results
+    in one run is only added or removed when that run's freshness report did not list it either; otherwise it was
+    deferred, or in a shard that did not run, and there is nothing to compare.
+    :param earlier_dataset_rows: dictionary of api id to dataset row of the earlier run
+    :param earlier_field_null_counts: dictionary of api id to field null counts of the earlier run
+    :param later_dataset_rows: dictionary of api id to dataset row of the later run
+    :param later_field_null_counts: dictionary of api id to field null counts of the later run
+    :param min_percent_points: Smallest change in a field's null percent that is reported
+    :param earlier_inventory_api_ids: set of the api ids in the freshness report of the earlier run, or None
+    :param later_inventory_api_ids: set of the api ids in the freshness report of the later run, or None
+    :return: list of ResultChange namedtuples, by dataset name
+    """
+    results_changes = []
+    for api_id in sorted(set(earlier_dataset_rows) | set(later_dataset_rows),
+                         key=lambda api_id: (later_dataset_rows.get(api_id) or earlier_dataset_rows.get(api_id))[0]):
+        earlier_dataset_row = earlier_dataset_rows.get(api_id)
+        later_dataset_row = later_dataset_rows.get(api_id)
+        if earlier_dataset_row is None and earlier_inventory_api_ids is not None and api_id in earlier_inventory_api_ids:
+            continue
+        if later_dataset_row is None and later_inventory_api_ids is not None and api_id in later_inventory_api_ids:
+            continue
+        if earlier_dataset_row is None or later_dataset_row is None:
+            results_changes.append(ResultChange(
+                dataset_api_id=api_id,
+                dataset_name=(later_dataset_row or earlier_dataset_row)[0],
+                change="DATASET ADDED" if earlier_dataset_row is None else "DATASET REMOVED",
+                field_name=None,
+                earlier_value=earlier_dataset_row[2] if earlier_dataset_row is not None else None,
+                later_value=later_dataset_row[2] if later_dataset_row is not None else None))
+            continue
+        dataset_name, _, earlier_record_count, is_earlier_problematic = earlier_dataset_row
+        _, _, later_record_count, is_later_problematic = later_dataset_row
+        dataset_changes = []
+        if is_earlier_problematic != is_later_problematic:
+            dataset_changes.append(("PROBLEMATIC", None, is_earlier_problematic, is_later_problematic))
+        if not (is_earlier_problematic or is_later_problematic):
+            if earlier_record_count != later_record_count:
+                dataset_changes.append(("RECORD COUNT", None, earlier_record_count, later_record_count))
+            earlier_null_counts = earlier_field_null_counts.get(api_id, {})
+            later_null_counts = later_field_null_counts.get(api_id, {})
+            for field_name in sorted(set(earlier_null_counts) | set(later_null_counts)):
+                earlier_percent = None
+                later_percent = None
+                if field_name in earlier_null_counts:
+                    earlier_percent = calculate_percent_null_for_field(null_count=earlier_null_counts[field_name],
+                                                                       total_records_processed=earlier_record_count)
+                if field_name in later_null_counts:
+                    later_percent = calculate_percent_null_for_field(null_count=later_null_counts[field_name],
+                                                                     total_records_processed=later_record_count)
+                if earlier_percent is None:
+                    dataset_changes.append(("FIELD ADDED", field_name, earlier_percent, later_percent))
+                elif later_percent is None:
+                    dataset_changes.append(("FIELD REMOVED", field_name, earlier_percent, later_percent))
+                elif abs(later_percent - earlier_percent) >= min_percent_points:
+                    dataset_changes.append(("NULL PERCENT", field_name, earlier_percent, later_percent))
+        for change, field_name, earlier_value, later_value in dataset_changes:
+            results_changes.append(ResultChange(dataset_api_id=api_id,
+                                                dataset_name=dataset_name,
+                                                change=change,
+                                                field_name=field_name,
+                                                earlier_value=earlier_value,
+                                                later_value=later_value))
+    return results_changes
+
+def calculate_run_seconds(dataset_seconds, worker_count, request_count, requests_per_second):
+    """
+    Calculate the wall time of a run from the seconds of each dataset
+
+    The datasets are handed out longest first to whichever worker frees up first. Separately, the rate limiter allows
+     no more than requests_per_second, so the run takes at least request_count / requests_per_second.
+    :param dataset_seconds: list of the estimated seconds of each dataset
+    :param worker_count: Number of datasets inspected at once
+    :param request_count: Number of requests of the whole run
+    :param requests_per_second: Request rate of the rate limiter
+    :return: float seconds
+    """
+    worker_seconds = [0.0] * max(1, worker_count)
+    for seconds in sorted(dataset_seconds, reverse=True):
+        worker_seconds[worker_seconds.index(min(worker_seconds))] += seconds
+    return max(max(worker_seconds), request_count / float(requests_per_second))
+
+def calculate_time_taken(start_time):
+    """
+    Calculat the time difference between now and the value passed as the start time
+
+    :param start_time: Time value representing start of processing
+    :return: Difference value between start time and current time
+    """
+    return (time.time() - start_time)
+
+def calculate_total_number_of_empty_values_per_dataset(null_counts_list):
+    """
+    Calculate the total number of null values in a dataset
+
+    :param null_counts_list: List of numeric values representing null counts per column in dataset
+    :return: Integer value representing total
+    """
+    return sum(null_counts_list)
+
+def count_null_values_in_csv_rows(field_names, csv_rows, chunk_size, dataset_profiler=None, stage_timings=None):
+    """
+    Count the empty cells of each column across a whole page of socrata csv rows
+
+    A csv export has a cell for every field of every record, empty for a null value, so no record dictionaries are
+    built. Rows are parsed chunk_size at a time and each chunk is turned into columns, whose empty cells are counted
+    by tuple.count() rather than one cell at a time. Not thread safe and not meant to be; call once per page.
+    :param field_names: list of the field names in the header row of the page
+    :param csv_rows: iterator of the rows following the header row, such as a csv.reader
+    :param chunk_size: Number of rows parsed and counted at a time
+    :param dataset_profiler: DatasetProfiler that the non empty values of each row are also added to, decoded from
+     utf-8 like json values, or None
+    :param stage_timings: StageTimings the parsing is timed in as decode, or None
+    :return: DatasetResult of the page
+    :raises ValueError: When the csv could not be parsed, or a row does not have a cell for every field
+    """
+    page_null_counts = DatasetResult(field_names=field_names)
+    null_counts = page_null_counts.null_counts
+    column_count = len(page_null_counts.field_names)
+    while True:
+        stage_start_time = time.time()
+        try:
+            rows_chunk = list(islice(csv_rows, chunk_size))
+        except csv.Error as csv_err:
+            raise ValueError("Csv could not be parsed. {}".format(csv_err))
+        if stage_timings is not None:
+            stage_timings.add_time(stage_name="decode", seconds=calculate_time_taken(stage_start_time))
+        if not rows_chunk:
+            break
+        if any(len(row) != column_count for row in rows_chunk):
+            raise ValueError("Csv row does not have {} cells".format(column_count))
+        for field_position, column_values in enumerate(zip(*rows_chunk)):
+            null_counts[field_position] += column_values.count("")
+        page_null_counts.total_record_count += len(rows_chunk)
+        if dataset_profiler is not None:
+            for row in rows_chunk:
+                dataset_profiler.add_record(dict((field_name, value.decode("utf8")) for field_name, value
+                                                 in zip(page_null_counts.field_names, row) if value))
+    return page_null_counts
+
+def count_null_values_in_page_body(field_names, page_body, file_format, profile_metric_names):
+    """
+    Decode and count a whole page in a decode process, returning only the small per field results to the parent
+
+    Json pages are decoded whole with the backend chosen by initialize_decode_process(). Csv pages name their fields in
+    their own header row. Decoding errors are raised as ValueError, as when counting in the inspecting thread.
+    :param field_names: list of the field names in the dataset; unused for csv pages
+    :param page_body: bytes of the response body
+    :param file_format: "json" or "csv"
+    :param profile_metric_names: PROFILE_METRICS of the run, empty for no profile
+    :return: DecodedPageCounts namedtuple
+    """
+    stage_timings = StageTimings()
+    stage_start_time = time.time()
+    if file_format == "csv":
+        csv_rows = csv.reader(page_body.splitlines(True))
+        try:
+            field_names = next(csv_rows, [])
+        except csv.Error as csv_err:
+            raise ValueError("Csv header row could not be parsed. {}".format(csv_err))
+        dataset_profiler = DatasetProfiler(field_names=field_names,
+                                           metric_names=profile_metric_names) if profile_metric_names else None
+        page_null_counts = count_null_values_in_csv_rows(field_names=field_names,
+                                                         csv_rows=csv_rows,
+                                                         chunk_size=CSV_COUNT_CHUNK_ROWS.value,
+                                                         dataset_profiler=dataset_profiler,
+                                                         stage_timings=stage_timings)
+    else:
+        records = decode_process_json_loads(page_body)
+        if not isinstance(records, list):
+            raise ValueError("Response is not a json array of records")
+        stage_timings.add_time(stage_name="decode", seconds=calculate_time_taken(stage_start_time))
+        dataset_profiler = DatasetProfiler(field_names=field_names,
+                                           metric_names=profile_metric_names) if profile_metric_names else None
+        page_null_counts = count_null_values_in_records(field_names=field_names,
+                                                        records=records,
+                                                        dataset_profiler=dataset_profiler)
+    decode_seconds = stage_timings.get_time(stage_name="decode")
+    return DecodedPageCounts(field_names=page_null_counts.field_names,
+                             null_counts=page_null_counts.null_counts,
+                             total_record_count=page_null_counts.total_record_count,
+                             field_profile_states=dataset_profiler.get_state() if dataset_profiler else None,
+                             decode_seconds=decode_seconds,
+                             null_count_seconds=calculate_time_taken(stage_start_time) - decode_seconds)
+
+def count_null_values_with_aggregate_queries(http_client, url_root, api_id, fields_per_query, schema_cache, freshness_report_last_updated, stage_timings):
+    """
+    Have socrata count the null values of each field with SoQL aggregate queries instead of downloading every record
+
+    The field names come from the X-SODA2-Fields header of a single record request, or from the schema cache when
+    socrata suppresses the header. Fields are counted in batches of fields_per_query per query and the nulls of a
+    field are count(*) - count(field) of its batch.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param fields_per_query: Number of fields counted in each query
+    :param schema_cache: SchemaCache shared by all datasets of the run
+    :param freshness_report_last_updated: Last updated stamp of the dataset in the freshness report, or None
+    :param stage_timings: StageTimings of the dataset
+    :return: tuple of a DatasetResult of the whole dataset and the last modified stamp from the response headers
+    :raises SocrataRequestError: When a request failed
+    :raises ValueError: When the field names or the counts are not available, or the dataset has no records
+    """
+    field_headers, last_modified, record_body_bytes = fetch_dataset_field_names(http_client=http_client,
+                                                                                url_root=url_root,
+                                                                                api_id=api_id,
+                                                                                schema_cache=schema_cache,
+                                                                                freshness_report_last_updated=freshness_report_last_updated,
+                                                                                stage_timings=stage_timings)
+
+    field_null_counts = DatasetResult(field_names=field_headers)
+    total_record_count = None
+    for batch_start in range(0, len(field_headers), fields_per_query):
+        field_names_batch = field_headers[batch_start:batch_start + fields_per_query]
+        url = build_aggregate_query_url(url_root=url_root, api_id=api_id, field_names=field_names_batch)
+        print(url)
+        response_info, response_file = http_client.get(url=url, stage_timings=stage_timings)
+        stage_start_time = time.time()
+        try:
+            aggregate_rows = json.load(response_file)
+        finally:
+            response_file.close()
+        stage_timings.add_time(stage_name="decode", seconds=calculate_time_taken(stage_start_time))
+        stage_timings.add_count(counter_name="pages", amount=1)
+        try:
+            aggregate_row = aggregate_rows[0]
+            batch_record_count = int(aggregate_row["total_count"])
+            for field_index, field_name in enumerate(field_names_batch):
+                field_value_count = int(aggregate_row.get("c{}".format(field_index), 0))
+                field_null_counts.null_counts[batch_start + field_index] = batch_record_count - field_value_count
+        except (IndexError, KeyError, TypeError) as response_err:
+            raise ValueError("Unexpected aggregate response. {}".format(repr(response_err)))
+        total_record_count = batch_record_count
+    if not total_record_count:
+        raise ValueError("Aggregate query counted no records")
+    field_null_counts.total_record_count = total_record_count
+    return field_null_counts, last_modified
+
+def count_null_values_in_records(field_names, records, dataset_profiler=None):
+    """
+    Count the null values for each field across a whole page of socrata records in a single pass
+
+    In the response from a request to Socrata, only the fields with non-null/empty values appear to be included, so
+    absence of a key is presumed to indicate an empty/null value. Key presence is tallied for the page and subtracted
+    from the page size. An empty string is a value, as it is to count(field) in aggregate mode. Not thread safe and not
+    meant to be; call once per page from the thread owning the counts.
+    :param field_names: list of the field names in the dataset
+    :param records: iterable of the data record dictionaries in the page. May be a generator, in which case each
+     record is counted as soon as it is decoded and only one record needs to be in memory at a time.
+    :param dataset_profiler: DatasetProfiler that each record is also added to, or None
+    :return: DatasetResult of the page
+    """
+    field_presence_counter = Counter()
+    page_record_count = 0
+    for record in records:
+        page_record_count += 1
+        field_presence_counter.update(iter(record))
+        if dataset_profiler is not None:
+            dataset_profiler.add_record(record)
+    return DatasetResult(field_names=field_names,
+                         null_counts=[page_record_count - field_presence_counter[field_name] for field_name in field_names],
+                         total_record_count=page_record_count)
+
+def estimate_dataset_costs(http_client, api_ids, cached_results, dataset_last_modified_stamps, latest_dataset_sizes, stage_timings):
+    """
+    Estimate the cost, in cells, of inspecting each dataset, for ordering the datasets and keeping to a time budget
+
+    Unchanged datasets with cached results cost nothing. Otherwise the record and column counts come from the result
+     cache or, failing that, the latest run in the result history. Datasets never inspected before get a count(*)
+     query, with SCHEDULER_DEFAULT_COLUMN_COUNT columns assumed, when SCHEDULER_COUNT_UNKNOWN_DATASETS is set.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param api_ids: list of the api ids of the datasets to inspect
+    :param cached_results: dictionary of api id to CachedDatasetResult
+    :param dataset_last_modified_stamps: dictionary of api id to last updated stamp from the freshness report
+    :param latest_dataset_sizes: dictionary of api id to record and column counts, from ResultHistoryStore
+    :param stage_timings: StageTimings the count requests are timed in
+    :return: tuple of a dictionary of api id to expected cost, None when it could not be estimated, and a dictionary
+     of api id to the record count requested, for the datasets whose count was requested
+    """
+    expected_costs = {}
+    fetched_record_counts = {}
+    unknown_api_ids = []
+    for api_id in api_ids:
+        cached_result = cached_results.get(api_id)
+        if (cached_result is not None and dataset_last_modified_stamps.get(api_id) is not None
+                and cached_result.last_modified == dataset_last_modified_stamps.get(api_id)):
+            expected_costs[api_id] = 0
+        elif cached_result is not None:
+            expected_costs[api_id] = calculate_expected_dataset_cost(
+                total_record_count=cached_result.total_record_count,
+                number_of_columns_in_dataset=cached_result.number_of_columns_in_dataset)
+        elif api_id in latest_dataset_sizes:
+            total_record_count, number_of_columns_in_dataset = latest_dataset_sizes[api_id]
+            expected_costs[api_id] = calculate_expected_dataset_cost(
+                total_record_count=total_record_count,
+                number_of_columns_in_dataset=number_of_columns_in_dataset)
+        else:
+            expected_costs[api_id] = None
+            unknown_api_ids.append(api_id)
+
+    def fetch_record_count(api_id):
+        try:
+            return api_id, fetch_dataset_record_count(http_client=http_client,
+                                                      url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                                      api_id=api_id.encode("utf8"),
+                                                      stage_timings=stage_timings)
+        except (SocrataRequestError, ValueError):
+            return api_id, None
+
+    if SCHEDULER_COUNT_UNKNOWN_DATASETS.value and unknown_api_ids:
+        pool = ThreadPool(DATASET_WORKER_COUNT.value)
+        try:
+            for api_id, total_record_count in pool.imap_unordered(fetch_record_count, unknown_api_ids):
+                if total_record_count is not None:
+                    expected_costs[api_id] = calculate_expected_dataset_cost(
+                        total_record_count=total_record_count,
+                        number_of_columns_in_dataset=None)
+                    fetched_record_counts[api_id.encode("utf8")] = total_record_count
+        finally:
+            pool.close()
+            pool.join()
+    return expected_costs, fetched_record_counts
+
+def estimate_dataset_inspection_cost(api_id, total_record_count, number_of_columns_in_dataset, bytes_per_record, seconds_per_request):
+    """
+    Estimate the requests, bytes and seconds inspecting a dataset takes under the current settings
+
+    Follows the mode inspect_dataset would pick: aggregate queries, sampling, or streaming every record in pages sized
+     by calculate_page_size(), including the pages requested in flight beyond the end. Bytes are uncompressed json,
+     read at PLAN_BYTES_PER_SECOND, with PAGES_IN_FLIGHT_PER_DATASET requests overlapping. Fallbacks, such as from failed
+     aggregate queries, are not foreseen.
+    :param api_id: ID specific to dataset of interest
+    :param total_record_count: Number of records in the dataset
+    :param number_of_columns_in_dataset: Number of fields in the dataset
+    :param bytes_per_record: Response body bytes per record, or None for PLAN_BYTES_PER_CELL per field
+    :param seconds_per_request: Seconds a request takes before its body downloads
+    :return: tuple of the inspection mode, the request count, the byte count and the seconds
+    """
+    if not bytes_per_record:
+        bytes_per_record = max(1, number_of_columns_in_dataset * PLAN_BYTES_PER_CELL.value)
+    if USE_AGGREGATE_NULL_COUNTING.value and not PROFILE_METRICS.value:
+        request_count = 1 + int(math.ceil(number_of_columns_in_dataset / float(AGGREGATE_FIELDS_PER_QUERY.value)))
+        return "aggregate", request_count, 0, request_count * seconds_per_request
+
+    sampled_record_count = SAMPLING_PAGE_COUNT.value * SAMPLING_PAGE_SIZE_RECORDS.value
+    if total_record_count > sampled_record_count and (
+            api_id in SAMPLING_API_IDS.value
+            or (SAMPLING_ROW_THRESHOLD.value is not None and total_record_count >= SAMPLING_ROW_THRESHOLD.value)):
+        request_count = 1 + SAMPLING_PAGE_COUNT.value
+        byte_count = int(sampled_record_count * bytes_per_record)
+        seconds = (request_count * seconds_per_request / PAGES_IN_FLIGHT_PER_DATASET.value
+                   + byte_count / float(PLAN_BYTES_PER_SECOND.value))
+        return "sample", request_count, byte_count, seconds
+
+    # A short page ends the dataset, so a dataset of whole pages takes one more, empty, page. Once the first page
+    #   came back full, the pages in flight run past the end.
+    page_size = PAGE_SIZE_INITIAL_RECORDS.value
+    records_left = total_record_count
+    request_count = 1
+    while records_left >= page_size:
+        records_left -= page_size
+        request_count += 1
+        page_size = calculate_page_size(current_page_size=page_size,
+                                        column_count=number_of_columns_in_dataset,
+                                        bytes_per_record=bytes_per_record)
+    if request_count > 1:
+        request_count += PAGES_IN_FLIGHT_PER_DATASET.value - 1
+    # With a sampling threshold, the records are counted first to decide against sampling
+    if SAMPLING_ROW_THRESHOLD.value is not None:
+        request_count += 1
+    byte_count = int(total_record_count * bytes_per_record)
+    seconds = (request_count * seconds_per_request / PAGES_IN_FLIGHT_PER_DATASET.value
+               + byte_count / float(PLAN_BYTES_PER_SECOND.value))
+    return "stream", request_count, byte_count, seconds
+
+def estimate_null_values_by_sampling(http_client, url_root, api_id, total_record_count, page_count, page_size, schema_cache, freshness_report_last_updated, stage_timings):
+    """
+    Estimate the null values of each field of a huge dataset from a stratified random sample of pages
+
+    The records are split into page_count strata of consecutive records and one page of page_size records is read
+     from a random position in each, so the sample spans the whole dataset at a small and fixed cost. The positions are
+     seeded by the api id so repeated runs sample the same records.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param total_record_count: Number of records in the dataset
+    :param page_count: Number of pages sampled
+    :param page_size: Number of records in each sampled page
+    :param schema_cache: SchemaCache shared by all datasets of the run
+    :param freshness_report_last_updated: Last updated stamp of the dataset in the freshness report, or None
+    :param stage_timings: StageTimings of the dataset
+    :return: tuple of a DatasetResult of estimated null counts out of the total record count, and a
+     DatasetSamplingResult namedtuple
+    :raises SocrataRequestError: When a request failed
+    :raises ValueError: When a page could not be decoded, or the sample held no records
+    """
+    random_generator = random.Random(api_id)
+    stratum_size = total_record_count / float(page_count)
+    sample_urls = []
+    for stratum_index in range(page_count):
+        stratum_start = int(stratum_index * stratum_size)
+        stratum_end = int((stratum_index + 1) * stratum_size)
+        sample_urls.append(build_sample_page_url(
+            url_root=url_root,
+            api_id=api_id,
+            limit_amount=page_size,
+            offset=random_generator.randint(stratum_start, max(stratum_start, stratum_end - page_size)),
+            file_format=TRANSPORT_FORMAT.value))
+
+    field_headers = None
+    page_null_counts_list = []
+    pool = ThreadPool(PAGES_IN_FLIGHT_PER_DATASET.value)
+    try:
+        for response_info, response_file in pool.imap(partial(fetch_dataset_page, http_client, stage_timings=stage_timings),
+                                                      sample_urls):
+            try:
+                if TRANSPORT_FORMAT.value == "csv":
+                    # Every csv page names its fields in a header row
+                    csv_rows = csv.reader(response_file)
+                    if field_headers is None:
+                        field_headers = next(csv_rows, [])
+                    else:
+                        next(csv_rows, None)
+                    page_null_counts = count_null_values_in_csv_rows(field_names=field_headers,
+                                                                     csv_rows=csv_rows,
+                                                                     chunk_size=CSV_COUNT_CHUNK_ROWS.value,
+                                                                     stage_timings=stage_timings)
+                else:
+                    if field_headers is None and response_info.getheader("X-SODA2-Fields") is None:
+                        field_headers = schema_cache.get_field_names(
+                            api_id=api_id,
+                            response_info=response_info,
+                            freshness_report_last_updated=freshness_report_last_updated,
+                            stage_timings=stage_timings)
+                    elif field_headers is None:
+                        field_headers = read_field_names_from_soda_fields_header(
+                            dataset_fields_string=response_info.getheader("X-SODA2-Fields"))
+                    json_records_generator = generate_records_from_json_stream(file_handler=response_file,
+                                                                               chunk_size=JSON_STREAM_CHUNK_BYTES.value,
+                                                                               stage_timings=stage_timings)
+                    page_null_counts = count_null_values_in_records(field_names=field_headers,
+                                                                    records=json_records_generator)
+            finally:
+                response_file.close()
+            page_null_counts_list.append(page_null_counts)
+            stage_timings.add_count(counter_name="pages", amount=1)
+            stage_timings.add_count(counter_name="records", amount=page_null_counts.total_record_count)
+    finally:
+        pool.close()
+        pool.join()
+    page_record_counts = [page_null_counts.total_record_count for page_null_counts in page_null_counts_list]
+    if sum(page_record_counts) == 0:
+        raise ValueError("Sampled pages held no records")
+
+    estimated_null_counts = DatasetResult(field_names=field_headers, total_record_count=total_record_count)
+    null_proportion_intervals = {}
+    for field_position, field_name in enumerate(estimated_null_counts.field_names):
+        null_proportion, lower_bound, upper_bound = calculate_null_confidence_interval(
+            page_null_counts=[page_null_counts.null_counts[field_position]
+                              for page_null_counts in page_null_counts_list],
+            page_record_counts=page_record_counts,
+            total_record_count=total_record_count,
+            z_score=SAMPLING_CONFIDENCE_Z_SCORE.value)
+        estimated_null_counts.null_counts[field_position] = int(round(null_proportion * total_record_count))
+        null_proportion_intervals[field_name] = (lower_bound, upper_bound)
+    sampling_result = DatasetSamplingResult(sampled_record_count=sum(page_record_counts),
+                                            sampled_page_count=len(page_record_counts),
+                                            confidence_z_score=SAMPLING_CONFIDENCE_Z_SCORE.value,
+                                            null_proportion_intervals=null_proportion_intervals)
+    return estimated_null_counts, sampling_result
+
+def fetch_dataset_page(http_client, url, stage_timings):
+    """
+    Request a page of records from socrata and download the entire response body into a spooled temporary file
+
+    The body stays in memory up to PAGE_SPOOL_MAX_MEMORY_BYTES and rolls over to disk beyond that, so prefetched pages
+    of wide datasets do not each hold a full response string in memory.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param url: url to which the request is made
+    :param stage_timings: StageTimings of the dataset
+    :return: tuple of the response info (headers) and the response body file, positioned at the start
+    :raises SocrataRequestError: When the server could not be reached or could not fulfill the request
+    """
+    print(url)
+    return http_client.get(url=url, stage_timings=stage_timings)
+
+def fetch_dataset_field_names(http_client, url_root, api_id, schema_cache, freshness_report_last_updated, stage_timings):
+    """
+    Get the field names of a dataset from the X-SODA2-Fields header of a single record request, or from the schema
+     cache when socrata suppresses the header
+
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param schema_cache: SchemaCache shared by all datasets of the run
+    :param freshness_report_last_updated: Last updated stamp of the dataset in the freshness report, or None
+    :param stage_timings: StageTimings of the dataset
+    :return: tuple of the field names list, the last modified stamp from the response headers, and the size in bytes
+     of the response body holding the one record
+    :raises SocrataRequestError: When a request failed
+    :raises ValueError: When the field names are not available
+    """
+    url = build_dataset_url(url_root=url_root, api_id=api_id, limit_amount=1, offset=0)
+    response_info, response_file = http_client.get(url=url, stage_timings=stage_timings)
+    response_file.seek(0, os.SEEK_END)
+    body_bytes = response_file.tell()
+    response_file.close()
+    dataset_fields_string = response_info.getheader("X-SODA2-Fields")
+    if dataset_fields_string is None:
+        field_headers = schema_cache.get_field_names(api_id=api_id,
+                                                     response_info=response_info,
+                                                     freshness_report_last_updated=freshness_report_last_updated,
+                                                     stage_timings=stage_timings)
+    else:
+        field_headers = read_field_names_from_soda_fields_header(dataset_fields_string=dataset_fields_string)
+    return field_headers, read_last_modified_from_response_info(response_info=response_info), body_bytes
+
+def fetch_dataset_last_modified(http_client, url_root, api_id, stage_timings):
+    """
+    Request a single record of a dataset only to read when the dataset was last modified from the response headers
+
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param stage_timings: StageTimings of the dataset
+    :return: last modified stamp string, or None when socrata did not provide one
+    :raises SocrataRequestError: When the server could not be reached or could not fulfill the request
+    """
+    url = build_dataset_url(url_root=url_root, api_id=api_id, limit_amount=1, offset=0)
+    response_info, response_file = http_client.get(url=url, stage_timings=stage_timings)
+    response_file.close()
+    return read_last_modified_from_response_info(response_info=response_info)
+
+def fetch_dataset_record_count(http_client, url_root, api_id, stage_timings):
+    """
+    Have socrata count the records of a dataset with a SoQL count(*) query
+
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param url_root: Root socrata url common to all datasets
+    :param api_id: ID specific to dataset of interest
+    :param stage_timings: StageTimings of the dataset
+    :return: integer record count
+    :raises SocrataRequestError: When the server could not be reached or could not fulfill the request
+    :raises ValueError: When the response held no count
+    """
+    url = build_aggregate_query_url(url_root=url_root, api_id=api_id, field_names=[])
+    response_info, response_file = http_client.get(url=url, stage_timings=stage_timings)
+    try:
+        aggregate_rows = json.load(response_file)
+    finally:
+        response_file.close()
+    try:
+        return int(aggregate_rows[0]["total_count"])
+    except (IndexError, KeyError, TypeError) as response_err:
+        raise ValueError("Unexpected count response. {}".format(repr(response_err)))
+
+def generate_freshness_report_json_objects(http_client, dataset_url, stage_timings):
+    """
+    Makes request to socrata url for dataset and processes response into json objects
+
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param dataset_url: url to which the request is made
+    :param stage_timings: StageTimings of the run
+    :return: json objects in dictionary form
+    :raises SocrataRequestError: When the report could not be retrieved within the allowed retries
+    """
+    response_info, response_file = http_client.get(url=dataset_url, stage_timings=stage_timings)
+    try:
+        json_objects = json.load(response_file)
+    finally:
+        response_file.close()
+    return json_objects
+
+def generate_records_from_json_stream(file_handler, chunk_size, stage_timings=None):
+    """
+    Decode the records of a json array one at a time while reading the array text from a file like object
+
+    Only the current chunk of text and the record being decoded are held in memory, rather than the whole response
+    string plus a list of every record in the page.
+    :param file_handler: file like object positioned at the start of a json array of objects
+    :param chunk_size: Number of bytes to read from the file at a time
+    :param stage_timings: StageTimings that the decoding time is added to once the generator finishes
+    :return: generator of the decoded records
+    :raises ValueError: When the text is not a json array or a record can not be decoded
+    """
+    decoder = json.JSONDecoder()
+    buffer_string = ""
+    decode_seconds = 0.0
+    is_array_started = False
+    is_end_of_file = False
+    position = 0
+    segment_start_time = time.time()
+    try:
+        while True:
+            # Skip the whitespace and separators between records
+            while position < len(buffer_string) and buffer_string[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer_string):
+                if is_end_of_file:
+                    raise ValueError("Json array ended unexpectedly")
+                chunk = file_handler.read(chunk_size)
+                is_end_of_file = not chunk
+                buffer_string = buffer_string[position:] + chunk
+                position = 0
+                continue
+            if not is_array_started:
+                if buffer_string[position] != "[":
+                    raise ValueError("Response was not a json array of records")
+                is_array_started = True
+                position += 1
+                continue
+            if buffer_string[position] == "]":
+                return
+            try:
+                record, position_after_record = decoder.raw_decode(buffer_string, position)
+            except ValueError:
+                # Most likely the record continues past the end of the current chunk
+                if is_end_of_file:
+                    raise
+                chunk = file_handler.read(chunk_size)
+                is_end_of_file = not chunk
+                buffer_string = buffer_string[position:] + chunk
+                position = 0
+                continue
+            position = position_after_record
+            # Only the time spent in here is decoding; the time between yields belongs to the consumer
+            decode_seconds += time.time() - segment_start_time
+            segment_start_time = None
+            yield record
+            segment_start_time = time.time()
+    finally:
+        if segment_start_time is not None:
+            decode_seconds += time.time() - segment_start_time
+        if stage_timings is not None:
+            stage_timings.add_time(stage_name="decode", seconds=decode_seconds)
+
+def grab_field_names_for_mega_columned_datasets(socrata_json_object):
+    """
+    Generate a dictionary of column names. Specific to very large datasets where field names are suppressed by socrata.
+
+    System fields, whose names start with ':', are left out.
+    :param socrata_json_object: view metadata json from socrata, or a json export with the view under 'meta'
+    :return: dictionary of hidden and visible field names in dataset
+    :raises ValueError: When the json has no column list
+    """
+    column_list = None
+    field_names_list_visible = []
+    field_names_list_hidden = []
+    try:
+        if 'meta' in socrata_json_object:
+            view = socrata_json_object['meta']['view']
+        else:
+            view = socrata_json_object
+        column_list = view['columns']
+    except (KeyError, TypeError) as ke:
+        raise ValueError("Problem accessing column metadata in view json. Key not found = {}".format(ke))
+    for dictionary in column_list:
+        temp_field_list = dictionary.keys()
+        if dictionary['fieldName'].startswith(':'):
+            continue
+        elif 'flags' in temp_field_list:
+            field_names_list_hidden.append(dictionary['fieldName'])
+        else:
+            field_names_list_visible.append(dictionary['fieldName'])
+    fields_dict = {"visible":field_names_list_visible, "hidden":field_names_list_hidden}
+    return fields_dict
+
+def handle_illegal_characters_in_string(string_with_illegals, spaces_allowed=False):
+    """
+    Process string, only allowing alpha and numeric. Spaces can be allowed.
+
+    :param string_with_illegals: Input string to be processed
+    :param spaces_allowed: If True, spaces will be allowed
+    :return: String with illegal characters removed.
+    """
+    if spaces_allowed:
+        re_string = "[a-zA-Z0-9 ]"
+    else:
+        re_string = "[a-zA-Z0-9]"
+    strings_list = re.findall(re_string,string_with_illegals)
+    return "".join(strings_list)
+
+def initialize_decode_process(json_backend_names):
+    """
+    Choose the json backend of a decode process as it starts
+
+    :param json_backend_names: JSON_BACKEND_NAMES of the run
+    :return: None
+    """
+    global decode_process_json_loads
+    decode_process_json_loads = select_json_backend(backend_names=json_backend_names)[1]
+    return
+
+def inspect_dataset(http_client, cached_results, dataset_last_modified_stamps, dataset_scheduler, decode_process_pool, run_checkpoint, schema_cache, scheduler_record_counts, dataset_name_and_api_id):
+    """
+    Inspect a single dataset for null values. Self contained so that many datasets can be inspected concurrently.
+
+    All state is local to the call and returned in the result so that worker threads never share counts. When the
+    dataset has not been modified since the cached results were stored, the cached results are returned instead.
+    After each page the counts so far are handed to the run checkpoint, and a dataset that was part way through when
+    a resumed run died carries on from its last checkpointed page.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param cached_results: dictionary of api id to CachedDatasetResult, read only
+    :param dataset_last_modified_stamps: dictionary of api id to last updated stamp from the freshness report
+    :param dataset_scheduler: DatasetScheduler that decides whether the dataset is deferred to the next run
+    :param decode_process_pool: DecodeProcessPool that decodes and counts the pages of large datasets, or None
+    :param run_checkpoint: RunCheckpoint of the run
+    :param schema_cache: SchemaCache of the field names of datasets with too many fields for the response header
+    :param scheduler_record_counts: dictionary of api id to the record count requested by the scheduler this run, read
+     only
+    :param dataset_name_and_api_id: tuple of the dataset name, as it appears in the freshness report, and its api id
+    :return: DatasetInspectionResult namedtuple
+    """
+    dataset_name, dataset_api_id = dataset_name_and_api_id
+    dataset_start_time = time.time()
+    stage_timings = StageTimings()
+    # Handle occasional error when writing unicode to string using format. sometimes "-" was problematic
+    dataset_name_with_spaces_but_no_illegal = handle_illegal_characters_in_string(
+        string_with_illegals=dataset_name.encode("utf8"),
+        spaces_allowed=True)
+    dataset_api_id = dataset_api_id.encode("utf8")
+
+    if not dataset_scheduler.is_start_allowed(api_id=dataset_api_id):
+        print("DEFERRED (time budget): {} ............. {}".format(dataset_name_with_spaces_but_no_illegal.upper(),
+                                                                   dataset_api_id))
+        return DatasetInspectionResult(dataset_name=dataset_name,
+                                       dataset_name_with_spaces_but_no_illegal=dataset_name_with_spaces_but_no_illegal,
+                                       dataset_api_id=dataset_api_id,
+                                       field_null_counts=DatasetResult(field_names=()),
+                                       number_of_columns_in_dataset=None,
+                                       total_record_count=0,
+                                       is_problematic=False,
+                                       problem_message=None,
+                                       problem_resource=None,
+                                       processing_time=calculate_time_taken(dataset_start_time),
+                                       is_deferred=True,
+                                       last_modified=None,
+                                       is_from_cache=False,
+                                       stage_timings=stage_timings,
+                                       sampling_result=None,
+                                       field_profiles=None)
+
+    # Incremental run; when the freshness report does not carry a last updated stamp, and there is a cached result to
+    #   compare against, ask socrata for the stamp with a single record request
+    cached_result = cached_results.get(dataset_api_id)
+    dataset_last_modified = dataset_last_modified_stamps.get(dataset_api_id)
+    if dataset_last_modified is None and cached_result is not None:
+        try:
+            dataset_last_modified = fetch_dataset_last_modified(http_client=http_client,
+                                                                url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                                                api_id=dataset_api_id,
+                                                                stage_timings=stage_timings)
+        except SocrataRequestError:
+            # The full inspection below will make the same request and report the problem
+            dataset_last_modified = None
+    if cached_result is not None and dataset_last_modified is not None and cached_result.last_modified == dataset_last_modified:
+        print("UNCHANGED (cached): {} ............. {}".format(dataset_name_with_spaces_but_no_illegal.upper(),
+                                                               dataset_api_id))
+        return DatasetInspectionResult(dataset_name=dataset_name,
+                                       dataset_name_with_spaces_but_no_illegal=dataset_name_with_spaces_but_no_illegal,
+                                       dataset_api_id=dataset_api_id,
+                                       field_null_counts=cached_result.field_null_counts,
+                                       number_of_columns_in_dataset=cached_result.number_of_columns_in_dataset,
+                                       total_record_count=cached_result.total_record_count,
+                                       is_problematic=False,
+                                       problem_message=None,
+                                       problem_resource=None,
+                                       processing_time=calculate_time_taken(dataset_start_time),
+                                       is_deferred=False,
+                                       last_modified=dataset_last_modified,
+                                       is_from_cache=True,
+                                       stage_timings=stage_timings,
+                                       sampling_result=None,
+                                       field_profiles=cached_result.field_profiles)
+
+    print("STARTED: {} ............. {}".format(dataset_name_with_spaces_but_no_illegal.upper(), dataset_api_id))
+
+    # Variables for next lower scope (alphabetic)
+    dataset_fields_string = None
+    dataset_profiler = None
+    decode_page_counter = None
+    field_headers = None
+    field_null_counts = DatasetResult(field_names=())
+    is_problematic = False
+    is_sampling_check_pending = False
+    is_special_too_many_headers_dataset = False
+    more_records_exist_than_response_limit_allows = True
+    number_of_columns_in_dataset = None
+    page_reader = None
+    problem_message = None
+    problem_resource = None
+    sampling_result = None
+    socrata_response_info_key_list = None
+    total_record_count = 0
+    use_keyset_paging = KEYSET_PAGING_BY_DEFAULT.value or dataset_api_id in KEYSET_PAGING_API_IDS.value
+
+    # Resumed run; progress is only reused when the dataset has not been updated since it was saved
+    dataset_progress = run_checkpoint.get_dataset_progress(api_id=dataset_api_id)
+    if dataset_progress is not None and dataset_progress["freshness_report_last_updated"] != dataset_last_modified_stamps.get(dataset_api_id):
+        dataset_progress = None
+
+    # Maryland Statewide Vehicle Crashes are excel files, not Socrata records,
+    #   but they will return empty json objects endlessly
+    if dataset_name.startswith(MD_STATEWIDE_VEHICLE_CRASH_STARTSWITH.value):
+        problem_message = "Intentionally skipped. Dataset was an excel file as of 20180409. Call to Socrata endlessly returns empty json objects."
+        is_problematic = True
+        more_records_exist_than_response_limit_allows = False
+    elif USE_AGGREGATE_NULL_COUNTING.value and not PROFILE_METRICS.value and dataset_progress is None:
+        # Aggregate mode; socrata does the counting. Any failure falls back to streaming every record. Profiles need
+        #   every value, so naming PROFILE_METRICS streams instead.
+        try:
+            field_null_counts, aggregate_last_modified = \
+                count_null_values_with_aggregate_queries(http_client=http_client,
+                                                         url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                                         api_id=dataset_api_id,
+                                                         fields_per_query=AGGREGATE_FIELDS_PER_QUERY.value,
+                                                         schema_cache=schema_cache,
+                                                         freshness_report_last_updated=dataset_last_modified_stamps.get(dataset_api_id),
+                                                         stage_timings=stage_timings)
+            field_headers = field_null_counts.field_names
+            number_of_columns_in_dataset = len(field_headers)
+            total_record_count = field_null_counts.total_record_count
+            more_records_exist_than_response_limit_allows = False
+            stage_timings.add_count(counter_name="records", amount=total_record_count)
+            if dataset_last_modified is None:
+                dataset_last_modified = aggregate_last_modified
+        except (SocrataRequestError, ValueError) as aggregate_err:
+            print("Aggregate counting failed, streaming records instead. {}: {}".format(dataset_api_id, aggregate_err))
+            field_headers = None
+            field_null_counts = DatasetResult(field_names=())
+            total_record_count = 0
+
+    # Sampling mode; huge datasets are estimated from a sample of pages instead of being read in full. A record count
+    #   from the scheduler or the cache decides before any page is read. Without one the first page decides: a short
+    #   one holds the whole dataset, so only a full one is followed by a count(*) request.
+    if more_records_exist_than_response_limit_allows and dataset_progress is None and (
+            dataset_api_id in SAMPLING_API_IDS.value or SAMPLING_ROW_THRESHOLD.value is not None):
+        if dataset_api_id in scheduler_record_counts:
+            known_record_count = scheduler_record_counts[dataset_api_id]
+        elif cached_result is not None:
+            known_record_count = cached_result.total_record_count
+        else:
+            known_record_count = None
+        if known_record_count is None and dataset_api_id not in SAMPLING_API_IDS.value:
+            is_sampling_check_pending = True
+        else:
+            try:
+                sampled_dataset = sample_dataset_when_large(
+                    http_client=http_client,
+                    api_id=dataset_api_id,
+                    dataset_display_name=dataset_name_with_spaces_but_no_illegal.upper(),
+                    record_count=known_record_count,
+                    is_record_count_fresh=dataset_api_id in scheduler_record_counts,
+                    schema_cache=schema_cache,
+                    freshness_report_last_updated=dataset_last_modified_stamps.get(dataset_api_id),
+                    stage_timings=stage_timings)
+                if sampled_dataset is not None:
+                    field_null_counts, sampling_result, total_record_count = sampled_dataset
+                    field_headers = field_null_counts.field_names
+                    number_of_columns_in_dataset = len(field_headers)
+                    more_records_exist_than_response_limit_allows = False
+            except (SocrataRequestError, ValueError) as sampling_err:
+                problem_message = "Sampling failed. {}".format(sampling_err)
+                is_problematic = True
+                more_records_exist_than_response_limit_allows = False
+
+    if more_records_exist_than_response_limit_allows:
+        # A cached column count sizes the first page; otherwise pages are sized once the field headers are known
+        if dataset_progress is not None:
+            print("RESUMED at record {}: {} ............. {}".format(dataset_progress["next_offset"],
+                                                                     dataset_name_with_spaces_but_no_illegal.upper(),
+                                                                     dataset_api_id))
+            field_null_counts = DatasetResult(
+                field_names=[field_name.encode("utf8") for field_name in dataset_progress["field_headers"]],
+                null_counts=[dataset_progress["null_count_for_each_field_dict"][field_name]
+                             for field_name in dataset_progress["field_headers"]],
+                total_record_count=dataset_progress["total_record_count"])
+            field_headers = field_null_counts.field_names
+            number_of_columns_in_dataset = len(field_headers)
+            total_record_count = dataset_progress["total_record_count"]
+            use_keyset_paging = dataset_progress["is_keyset_paging"]
+            first_page_size = dataset_progress["page_size"]
+            # Progress saved without a profile can not be profiled for the rest of the dataset only
+            if PROFILE_METRICS.value and dataset_progress.get("field_profile_states") is not None:
+                dataset_profiler = DatasetProfiler(field_names=field_headers, metric_names=PROFILE_METRICS.value)
+                dataset_profiler.restore_state(field_states=dataset_progress["field_profile_states"])
+        elif cached_result is not None and cached_result.number_of_columns_in_dataset:
+            first_page_size = calculate_page_size(current_page_size=PAGE_SIZE_INITIAL_RECORDS.value,
+                                                  column_count=cached_result.number_of_columns_in_dataset)
+        else:
+            first_page_size = PAGE_SIZE_INITIAL_RECORDS.value
+        page_reader = build_page_reader(http_client=http_client,
+                                        api_id=dataset_api_id,
+                                        limit_amount=first_page_size,
+                                        use_keyset_paging=use_keyset_paging,
+                                        stage_timings=stage_timings,
+                                        start_offset=total_record_count,
+                                        start_row_id=dataset_progress["last_row_id"] if dataset_progress else None)
+
+    # Some datasets will have more records than are returned in a single response; varies with the limit_max value
+    while more_records_exist_than_response_limit_allows:
+
+        cycle_record_count = 0
+
+        # Once the dataset is known to be large its pages go whole to the decode processes. Keyset paging needs the
+        #   row ids of a page before the next is requested, so those pages are always counted here.
+        if (decode_page_counter is None
+                and decode_process_pool is not None
+                and not use_keyset_paging
+                and number_of_columns_in_dataset is not None
+                and total_record_count >= DECODE_PROCESS_MIN_RECORDS.value):
+            decode_page_counter = DecodeProcessPageCounter(
+                page_reader=page_reader,
+                decode_process_pool=decode_process_pool,
+                field_names=field_headers,
+                profile_metric_names=PROFILE_METRICS.value if dataset_profiler is not None else (),
+                stage_timings=stage_timings)
+
+        if decode_page_counter is not None:
+            try:
+                dataset_page, page_null_counts, field_profile_states = decode_page_counter.next_page_counts()
+            except SocrataRequestError as request_err:
+                problem_resource = page_reader.current_url
+                problem_message = str(request_err)
+                is_problematic = True
+                break
+            except ValueError as value_err:
+                problem_message = "Response could not be decoded. {}".format(value_err)
+                problem_resource = decode_page_counter.current_url
+                is_problematic = True
+                break
+            url = dataset_page.url
+            record_count_increase = page_null_counts.total_record_count
+            if dataset_profiler is not None:
+                dataset_profiler.merge_state(field_states=field_profile_states)
+        else:
+            try:
+                dataset_page = page_reader.next_page()
+            except SocrataRequestError as request_err:
+                if use_keyset_paging and total_record_count == 0:
+                    # Keyset paging is not supported for every dataset; start over paging by offset
+                    print("Keyset paging failed, paging by offset instead. {}: {}".format(dataset_api_id, request_err))
+                    page_reader.close()
+                    use_keyset_paging = False
+                    page_reader = build_page_reader(http_client=http_client,
+                                                    api_id=dataset_api_id,
+                                                    limit_amount=page_reader.limit_amount,
+                                                    use_keyset_paging=use_keyset_paging,
+                                                    stage_timings=stage_timings)
+                    continue
+                problem_resource = page_reader.current_url
+                problem_message = str(request_err)
+                is_problematic = True
+                break
+            url = dataset_page.url
+
+            if dataset_last_modified is None:
+                dataset_last_modified = read_last_modified_from_response_info(response_info=dataset_page.response_info)
+
+            # For datasets with a lot of fields it looks like Socrata doesn't return the
+            #   field headers in the response.info() so the X-SODA2-Fields key DNE.
+            # Only need to get the list of socrata response keys the first time through
+            if socrata_response_info_key_list == None:
+                socrata_response_info_key_list = []
+                for key in dataset_page.response_info.keys():
+                    socrata_response_info_key_list.append(key.lower())
+            else:
+                pass
+
+            # Only need to get the field headers the first time through
+            if dataset_fields_string == None and "x-soda2-fields" in socrata_response_info_key_list:
+                dataset_fields_string = dataset_page.response_info["X-SODA2-Fields"]
+            elif dataset_fields_string == None and "x-soda2-fields" not in socrata_response_info_key_list:
+                is_special_too_many_headers_dataset = True
+            else:
+                pass
+
+            # Csv pages name their fields in a header row, so a suppressed X-SODA2-Fields header does not matter
+            csv_rows = None
+            if page_reader.file_format == "csv":
+                csv_rows = csv.reader(dataset_page.response_file)
+                try:
+                    page_field_names = next(csv_rows, [])
+                except csv.Error as csv_err:
+                    dataset_page.response_file.close()
+                    problem_message = "Csv header row could not be parsed. {}".format(csv_err)
+                    problem_resource = url
+                    is_problematic = True
+                    break
+                if field_headers == None:
+                    field_headers = page_field_names
+
+            # If Socrata didn't send the headers the dataset is too big; get the field names from its view metadata
+            if field_headers == None and is_special_too_many_headers_dataset:
+                try:
+                    field_headers = schema_cache.get_field_names(
+                        api_id=dataset_api_id,
+                        response_info=dataset_page.response_info,
+                        freshness_report_last_updated=dataset_last_modified_stamps.get(dataset_api_id),
+                        stage_timings=stage_timings)
+                except (SocrataRequestError, ValueError) as schema_err:
+                    problem_message = "Too many fields. Socrata suppressed X-SODA2-FIELDS value in response and the view metadata could not be used. {}".format(schema_err)
+                    problem_resource = url
+                    is_problematic = True
+                    break
+            elif field_headers == None:
+                field_headers = read_field_names_from_soda_fields_header(dataset_fields_string=dataset_fields_string)
+            else:
+                pass
+
+            # The null counts of each page are merged into the dataset's. Only initialized the first time through so the
+            #   counts accumulate across pages.
+            if number_of_columns_in_dataset == None:
+                field_null_counts = DatasetResult(field_names=field_headers)
+                field_headers = field_null_counts.field_names
+                number_of_columns_in_dataset = len(field_headers)
+                if PROFILE_METRICS.value:
+                    dataset_profiler = DatasetProfiler(field_names=field_headers, metric_names=PROFILE_METRICS.value)
 
-PENDING FUNCTIONALITY:
-Only processes datasets that have been processed more recently than the last run. Reads the last date processed
- information from the api metadata for the dataset.
-Compare previous results against current to see change in the datasets.
-Multiprocessing use for speed. Note: No null records are "seen" and no csv files for datasets are written when
- multiprocessor approach is used. I think multiprocessing makes copies of this script for use in each processor
- so they are not sharing the same variables. I think this may be the issue.
-"""
+            # Records are decoded from the response stream and counted one at a time, csv rows a chunk at a time. The
+            #   decoding is timed as it happens, the rest of the loop is counting.
+            if csv_rows is None:
+                json_records_generator = generate_records_from_json_stream(file_handler=dataset_page.response_file,
+                                                                           chunk_size=JSON_STREAM_CHUNK_BYTES.value,
+                                                                           stage_timings=stage_timings)
+                if use_keyset_paging:
+                    json_records_generator = page_reader.track_row_ids(records=json_records_generator)
+            decode_seconds_before_page = stage_timings.get_time(stage_name="decode")
+            stage_start_time = time.time()
+            try:
+                if csv_rows is None:
+                    page_null_counts = count_null_values_in_records(field_names=field_headers,
+                                                                    records=json_records_generator,
+                                                                    dataset_profiler=dataset_profiler)
+                else:
+                    page_null_counts = count_null_values_in_csv_rows(field_names=page_field_names,
+                                                                     csv_rows=csv_rows,
+                                                                     chunk_size=CSV_COUNT_CHUNK_ROWS.value,
+                                                                     dataset_profiler=dataset_profiler,
+                                                                     stage_timings=stage_timings)
+                record_count_increase = page_null_counts.total_record_count
+                decode_seconds_for_page = stage_timings.get_time(stage_name="decode") - decode_seconds_before_page
+                stage_timings.add_time(stage_name="null_count",
+                                       seconds=calculate_time_taken(stage_start_time) - decode_seconds_for_page)
+                stage_timings.add_count(counter_name="pages", amount=1)
+                stage_timings.add_count(counter_name="records", amount=record_count_increase)
+            except ValueError as value_err:
+                if use_keyset_paging and total_record_count == 0:
+                    print("Keyset paging failed, paging by offset instead. {}: {}".format(dataset_api_id, value_err))
+                    page_reader.close()
+                    use_keyset_paging = False
+                    # The records of the failed page were partly profiled
+                    if dataset_profiler is not None:
+                        dataset_profiler = DatasetProfiler(field_names=field_headers,
+                                                           metric_names=PROFILE_METRICS.value)
+                    page_reader = build_page_reader(http_client=http_client,
+                                                    api_id=dataset_api_id,
+                                                    limit_amount=page_reader.limit_amount,
+                                                    use_keyset_paging=use_keyset_paging,
+                                                    stage_timings=stage_timings)
+                    continue
+                problem_message = "Response could not be decoded. {}".format(value_err)
+                problem_resource = url
+                is_problematic = True
+                break
+            finally:
+                dataset_page.response_file.close()
 
-# IMPORTS
-from collections import namedtuple
-from datetime import date
-import json
-import os
-import re
-import time
-import urllib2
-from functools import partial
-from multiprocessing import Pool
-from multiprocessing.pool import ThreadPool
+        # Some datasets are html or other type but socrata returns an empty object rather than a json object with
+        #   reason or code. These datasets are then not recognized as problematic and throw off the tracking counts.
+        #   An empty page after full pages only means the record count was an exact multiple of the limit.
+        if record_count_increase == 0 and total_record_count == 0:
+            problem_message = "Response json object was empty"
+            problem_resource = url
+            is_problematic = True
+            break
 
-process_start_time = time.time()
+        field_null_counts.merge(other_dataset_result=page_null_counts)
+        cycle_record_count += record_count_increase
+        total_record_count += record_count_increase
 
-# VARIABLES (alphabetic)
-Variable = namedtuple("Variable", ["value"])
-CORRECTIONAL_ENTERPRISES_EMPLOYEES_API_ID = Variable("mux9-y6mb")
-CORRECTIONAL_ENTERPRISES_EMPLOYEES_JSON_FILE = Variable("MarylandCorrectionalEnterprises_JSON.json")
-DATA_FRESHNESS_REPORT_API_ID = Variable("t8k3-edvn")
-LIMIT_MAX_AND_OFFSET = Variable(20000)
-MD_STATEWIDE_VEHICLE_CRASH_STARTSWITH = Variable("Maryland Statewide Vehicle Crashes")
-OVERVIEW_STATS_FILE_NAME = Variable("_OVERVIEW_STATS")
-PERFORMANCE_SUMMARY_FILE_NAME = Variable("__script_performance_summary")
-PROBLEM_DATASETS_FILE_NAME = Variable("_PROBLEM_DATASETS")
-REAL_PROPERTY_HIDDEN_NAMES_API_ID = Variable("ed4q-f8tm")
-REAL_PROPERTY_HIDDEN_NAMES_JSON_FILE = Variable("RealPropertyHiddenOwner_JSON.json")
-ROOT_PATH_FOR_CSV_OUTPUT = Variable(r"E:\DoIT_OpenDataInspection_Project\OUTPUT_CSVs")
-ROOT_URL_FOR_DATASET_ACCESS = Variable(r"https://data.maryland.gov/resource/")
-THREAD_COUNT = Variable(8)
+        # Any cycle_record_count that equals the page's limit indicates another page is needed. The reader already
+        #   has the following pages in flight; a short page ends the dataset and any extra requests are discarded.
+        if cycle_record_count < dataset_page.limit:
+            more_records_exist_than_response_limit_allows = False
+        else:
+            if is_sampling_check_pending:
+                # The first page was full, so the dataset may be large enough to sample; its counts are then dropped
+                is_sampling_check_pending = False
+                try:
+                    sampled_dataset = sample_dataset_when_large(
+                        http_client=http_client,
+                        api_id=dataset_api_id,
+                        dataset_display_name=dataset_name_with_spaces_but_no_illegal.upper(),
+                        record_count=None,
+                        is_record_count_fresh=False,
+                        schema_cache=schema_cache,
+                        freshness_report_last_updated=dataset_last_modified_stamps.get(dataset_api_id),
+                        stage_timings=stage_timings)
+                except (SocrataRequestError, ValueError) as sampling_err:
+                    problem_message = "Sampling failed. {}".format(sampling_err)
+                    is_problematic = True
+                    break
+                if sampled_dataset is not None:
+                    field_null_counts, sampling_result, total_record_count = sampled_dataset
+                    field_headers = field_null_counts.field_names
+                    number_of_columns_in_dataset = len(field_headers)
+                    dataset_profiler = None
+                    more_records_exist_than_response_limit_allows = False
+                    continue
+            page_reader.observe_page(dataset_page=dataset_page,
+                                     record_count=cycle_record_count,
+                                     column_count=number_of_columns_in_dataset)
+            run_checkpoint.update_dataset_progress(
+                api_id=dataset_api_id,
+                dataset_progress={"freshness_report_last_updated": dataset_last_modified_stamps.get(dataset_api_id),
+                                  "field_headers": field_headers,
+                                  "null_count_for_each_field_dict": dict(field_null_counts.items()),
+                                  "total_record_count": total_record_count,
+                                  "next_offset": total_record_count,
+                                  "last_row_id": page_reader.last_row_id if use_keyset_paging else None,
+                                  "is_keyset_paging": use_keyset_paging,
+                                  "page_size": page_reader.limit_amount,
+                                  "field_profile_states": dataset_profiler.get_state() if dataset_profiler else None})
 
-assert os.path.exists(REAL_PROPERTY_HIDDEN_NAMES_JSON_FILE.value)
-assert os.path.exists(CORRECTIONAL_ENTERPRISES_EMPLOYEES_JSON_FILE.value)
+    if page_reader is not None:
+        page_reader.close()
 
+    return DatasetInspectionResult(dataset_name=dataset_name,
+                                   dataset_name_with_spaces_but_no_illegal=dataset_name_with_spaces_but_no_illegal,
+                                   dataset_api_id=dataset_api_id,
+                                   field_null_counts=field_null_counts,
+                                   number_of_columns_in_dataset=number_of_columns_in_dataset,
+                                   total_record_count=total_record_count,
+                                   is_problematic=is_problematic,
+                                   problem_message=problem_message,
+                                   problem_resource=problem_resource,
+                                   processing_time=calculate_time_taken(dataset_start_time),
+                                   is_deferred=False,
+                                   last_modified=dataset_last_modified,
+                                   is_from_cache=False,
+                                   stage_timings=stage_timings,
+                                   sampling_result=sampling_result,
+                                   field_profiles=dataset_profiler.get_field_profiles() if dataset_profiler else None)
 
-# FUNCTIONS (alphabetic)
-def build_csv_file_name_with_date(today_date_string, filename):
+def merge_shard_outputs(root_file_destination_location, run_date_string, shard_count):
     """
-    Build a string, ending in .csv, that contains todays date and the input file name
+    Combine the partial output files of every shard of a run into the usual overview, problem, stage timings and
+     performance summary files
 
-    :param today_date_string: Intended to be the date the file will be created
-    :param filename: Name of the file
-    :return: string that is 'date_filename.csv'
+    Shards write their summary json file last, so a missing one means that shard has not completed and nothing is
+     merged. The merged files are written anew each time, so a merge can be repeated.
+    :param root_file_destination_location: Folder holding the output files of all shards
+    :param run_date_string: Date string used in the file names of the run
+    :param shard_count: Number of shards the run was split into
+    :return: True when the outputs were merged, False when a shard summary was missing
     """
-    return "{}_{}.csv".format(today_date_string, filename)
+    shard_summaries = []
+    for shard_index in range(shard_count):
+        shard_summary_file_path = os.path.join(root_file_destination_location, "{}_{}.json".format(
+            run_date_string, build_shard_file_name(filename=SHARD_SUMMARY_FILE_NAME.value,
+                                                   shard_index=shard_index,
+                                                   shard_count=shard_count)))
+        if not os.path.exists(shard_summary_file_path):
+            print("Shard {} of {} has not completed, {} is missing. Nothing merged.".format(
+                shard_index, shard_count, shard_summary_file_path))
+            return False
+        shard_summaries.append(json.loads(read_json_file(file_path=shard_summary_file_path)))
+
+    report_header_rows = {PROBLEM_DATASETS_FILE_NAME.value: PROBLEM_DATASETS_CSV_HEADERS.value,
+                          OVERVIEW_STATS_FILE_NAME.value: OVERVIEW_STATS_CSV_HEADERS.value,
+                          STAGE_TIMINGS_FILE_NAME.value: build_stage_timings_csv_headers()}
+    try:
+        for report_file_name, header_row in report_header_rows.items():
+            merged_file_path = os.path.join(root_file_destination_location, build_csv_file_name_with_date(
+                today_date_string=run_date_string, filename=report_file_name))
+            if os.path.exists(merged_file_path):
+                os.remove(merged_file_path)
+            merged_report_writer = CsvReportWriter(file_path=merged_file_path,
+                                                   header_row=header_row,
+                                                   buffer_row_count=REPORT_WRITER_BUFFER_ROW_COUNT.value,
+                                                   flush_interval_seconds=REPORT_WRITER_FLUSH_INTERVAL_SECONDS.value)
+            for shard_index in range(shard_count):
+                shard_file_path = os.path.join(root_file_destination_location, build_csv_file_name_with_date(
+                    today_date_string=run_date_string,
+                    filename=build_shard_file_name(filename=report_file_name,
+                                                   shard_index=shard_index,
+                                                   shard_count=shard_count)))
+                with open(shard_file_path, "rb") as file_handler:
+                    csv_reader = csv.reader(file_handler)
+                    next(csv_reader, None)
+                    for row in csv_reader:
+                        merged_report_writer.write_row(row)
+            merged_report_writer.close()
+    except IOError as io_err:
+        print(io_err)
+        exit()
+
+    dataset_counters = Counter()
+    merged_stage_timings = StageTimings()
+    for shard_summary in shard_summaries:
+        dataset_counters.update(shard_summary["dataset_counters"])
+        for stage_name, seconds in shard_summary["stage_seconds"].items():
+            merged_stage_timings.add_time(stage_name=stage_name, seconds=seconds)
+        for counter_name, amount in shard_summary["stage_counters"].items():
+            merged_stage_timings.add_count(counter_name=counter_name, amount=amount)
+    performance_summary_filename = build_csv_file_name_with_date(today_date_string=run_date_string,
+                                                                 filename=PERFORMANCE_SUMMARY_FILE_NAME.value)
+    write_script_performance_summary(
+        root_file_destination_location=root_file_destination_location,
+        filename=performance_summary_filename,
+        start_time=min(shard_summary["start_time"] for shard_summary in shard_summaries),
+        number_of_datasets_in_data_freshness_report=max(shard_summary["number_of_datasets_in_data_freshness_report"]
+                                                        for shard_summary in shard_summaries),
+        dataset_counter=dataset_counters["dataset_counter"],
+        valid_nulls_dataset_counter=dataset_counters["valid_nulls_dataset_counter"],
+        valid_no_null_dataset_counter=dataset_counters["valid_no_null_dataset_counter"],
+        problem_dataset_counter=dataset_counters["problem_dataset_counter"],
+        cached_dataset_counter=dataset_counters["cached_dataset_counter"],
+        deferred_dataset_counter=dataset_counters["deferred_dataset_counter"],
+        null_value_counter=dataset_counters["null_value_counter"],
+        cell_counter=dataset_counters["cell_counter"],
+        run_stage_timings=merged_stage_timings,
+        final_requests_per_second=sum(shard_summary["final_requests_per_second"] for shard_summary in shard_summaries),
+        end_time=max(shard_summary["end_time"] for shard_summary in shard_summaries))
+    print("Merged the outputs of {} shards".format(shard_count))
+    return True
 
-def build_dataset_url(url_root, api_id, limit_amount, offset, total_count):
+def order_datasets_for_inspection(api_ids, expected_costs, deferred_api_ids):
     """
-    Build the url used for each request for data from socrata
+    Order datasets so the run finishes as early as possible: longest processing time first
 
-    :param url_root: Root socrata url common to all datasets
-    :param api_id: ID specific to dataset of interest
-    :param limit_amount: Upper limit on number of records to be returned in response to request
-    :param offset: If more than one request, offset the range of records requested by this amount
-    :param total_count: Current total number of records evaluated during processing of each individual dataset
-    :return: String url
+    Datasets deferred by the previous run go first, so a time budget can not keep deferring the same datasets. Then
+     datasets of unknown cost, which may be the largest, and the rest from the highest expected cost to the lowest.
+    :param api_ids: list of the api ids of the datasets to inspect
+    :param expected_costs: dictionary of api id to expected cost, None when unknown
+    :param deferred_api_ids: collection of the api ids deferred by the previous run
+    :return: list of api ids in the order to inspect them
     """
-    # if the record count exceeds the initial limit then the url must include offset parameter
-    if total_count >= LIMIT_MAX_AND_OFFSET.value:
-        return "{}{}.json?$limit={}&$offset={}".format(url_root, api_id, limit_amount, offset)
-    else:
-        return "{}{}.json?$limit={}".format(url_root, api_id, limit_amount)
+    return sorted(api_ids, key=lambda api_id: (api_id not in deferred_api_ids,
+                                               expected_costs.get(api_id) is not None,
+                                               -(expected_costs.get(api_id) or 0),
+                                               api_id))
 
-def build_datasets_inventory(freshness_report_json_objects):
+def parse_command_line_arguments():
     """
-    Process json response code for dataset names and api id's and build a dictionary for use
+    Parse the options of a run
 
-    :param freshness_report_json_objects: json returned by socrata per our request
-    :return: Dictionary in format of ['dataset name' : 'dataset api id']
+    :return: argparse namespace
     """
-    datasets_dictionary = {}
-    for record_obj in freshness_report_json_objects:
-        dataset_name = record_obj["dataset_name"]
-        api_id = record_obj["link"]
-        datasets_dictionary[dataset_name] = os.path.basename(api_id)
-    return datasets_dictionary
+    parser = argparse.ArgumentParser(description="Inspect all datasets on the Socrata open data portal for nulls")
+    parser.add_argument("--plan", action="store_true",
+                        help="Estimate the requests, bytes and time of a run from cheap count requests, without "
+                             "downloading records")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint instead of starting over")
+    parser.add_argument("--time-budget-minutes", type=float, default=None,
+                        help="Defer datasets not expected to finish within this many minutes to the next run")
+    parser.add_argument("--shard-index", type=int, default=0,
+                        help="Inspect only the datasets of this shard, from 0, writing partial output files")
+    parser.add_argument("--shard-count", type=int, default=1,
+                        help="Number of shards the datasets are split into, by a hash of the api id")
+    parser.add_argument("--merge", action="store_true",
+                        help="Combine the partial output files of all --shard-count shards instead of inspecting")
+    parser.add_argument("--run-date", default=None,
+                        help="Date string in the file names of the shard outputs to merge. Default: today")
+    parser.add_argument("--diff", nargs="+", metavar="RUN_DATE",
+                        help="Report what changed since the run of this date, to the latest run or a second date")
+    parser.add_argument("--trend", nargs="+", metavar=("API_ID", "FIELD_NAME"),
+                        help="List the results of a dataset, or of one of its fields, in every run")
+    command_line_arguments = parser.parse_args()
+    if command_line_arguments.shard_count < 1:
+        parser.error("--shard-count must be at least 1")
+    if not 0 <= command_line_arguments.shard_index < command_line_arguments.shard_count:
+        parser.error("--shard-index must be from 0 to --shard-count minus 1")
+    if command_line_arguments.merge and command_line_arguments.shard_count < 2:
+        parser.error("--merge needs the --shard-count of the sharded run")
+    if command_line_arguments.diff is not None and len(command_line_arguments.diff) > 2:
+        parser.error("--diff takes one or two run dates")
+    if command_line_arguments.trend is not None and len(command_line_arguments.trend) > 2:
+        parser.error("--trend takes an api id and optionally a field name")
+    return command_line_arguments
 
-def build_today_date_string():
+def plan_run(root_file_destination_location, shard_index=0, shard_count=1):
     """
-    Build a string representing todays date
+    Estimate the cost of a run without downloading any records, and print and save it as a per dataset table
 
-    :return: string representing date formatted as Year Month Day
+    The inventory comes from the freshness report, as in a run. Each dataset then gets two cheap requests, a count(*)
+     query and a single record request for its field names and record size, unless it is unchanged since its cached
+     result. Requests, bytes and seconds follow from the current page size, sampling, aggregate, scheduler and rate
+     limit settings, with the seconds per request measured on the planning requests themselves.
+    :param root_file_destination_location: Folder the plan csv is written to, holding the result and schema caches
+    :param shard_index: Index of the shard to plan, from 0
+    :param shard_count: Number of shards the run is split into
+    :return: list of DatasetCostEstimate namedtuples, most expensive first, or None when the inventory failed
     """
-    return "{:%Y%m%d}".format(date.today())
+    plan_stage_timings = StageTimings()
+    http_client = build_http_client()
+    data_freshness_url = build_dataset_url(url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                           api_id=DATA_FRESHNESS_REPORT_API_ID.value,
+                                           limit_amount=PAGE_SIZE_MAX_RECORDS.value,
+                                           offset=0)
+    try:
+        freshness_report_json_objects = generate_freshness_report_json_objects(http_client=http_client,
+                                                                               dataset_url=data_freshness_url,
+                                                                               stage_timings=plan_stage_timings)
+    except SocrataRequestError as request_err:
+        print("generate_freshness_report_json_objects(): {}".format(request_err))
+        http_client.close()
+        return None
+    datasets_inventory = build_datasets_inventory(freshness_report_json_objects=freshness_report_json_objects)
+    api_ids_to_plan = [api_id for api_id in datasets_inventory
+                       if calculate_dataset_shard_index(api_id=api_id.encode("utf8"),
+                                                        shard_count=shard_count) == shard_index]
 
-def calculate_percent_null_for_dataset(null_count_total, total_records_processed, number_of_fields_in_dataset):
+    # Unchanged datasets are written from the result cache and cost nothing. The scheduler of the run counts the
+    #   records of datasets in neither the cache nor the history. Planning creates neither store.
+    cached_results = {}
+    latest_dataset_sizes = {}
+    result_cache_file_path = os.path.join(root_file_destination_location, RESULT_CACHE_FILE_NAME.value)
+    if os.path.exists(result_cache_file_path):
+        result_cache = DatasetResultCache(database_file_path=result_cache_file_path)
+        cached_results = result_cache.read_cached_results(profile_csv_headers=[])
+        result_cache.close()
+    history_store_file_path = os.path.join(root_file_destination_location, HISTORY_STORE_FILE_NAME.value)
+    if os.path.exists(history_store_file_path):
+        history_store = ResultHistoryStore(database_file_path=history_store_file_path)
+        latest_dataset_sizes = history_store.read_latest_dataset_sizes()
+        history_store.close()
+    schema_cache = SchemaCache(http_client=http_client,
+                               folder_path=os.path.join(root_file_destination_location, SCHEMA_CACHE_FOLDER_NAME.value))
+
+    def fetch_dataset_size(api_id):
+        freshness_report_last_updated = datasets_inventory[api_id].last_updated
+        cached_result = cached_results.get(api_id)
+        if (cached_result is not None and freshness_report_last_updated is not None
+                and cached_result.last_modified == freshness_report_last_updated):
+            return api_id, cached_result.total_record_count, cached_result.number_of_columns_in_dataset, None, True, None
+        try:
+            total_record_count = fetch_dataset_record_count(http_client=http_client,
+                                                            url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                                            api_id=api_id.encode("utf8"),
+                                                            stage_timings=plan_stage_timings)
+            field_headers, last_modified, record_body_bytes = fetch_dataset_field_names(
+                http_client=http_client,
+                url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                api_id=api_id.encode("utf8"),
+                schema_cache=schema_cache,
+                freshness_report_last_updated=freshness_report_last_updated,
+                stage_timings=plan_stage_timings)
+        except (SocrataRequestError, ValueError) as size_err:
+            return api_id, None, None, None, False, str(size_err)
+        # The body of a single record request is the record and the enclosing json array
+        bytes_per_record = None
+        if total_record_count > 0:
+            bytes_per_record = max(1, record_body_bytes - 2)
+        return api_id, total_record_count, len(field_headers), bytes_per_record, False, None
+
+    pool = ThreadPool(DATASET_WORKER_COUNT.value)
+    try:
+        dataset_sizes = list(pool.imap_unordered(fetch_dataset_size, api_ids_to_plan))
+    finally:
+        pool.close()
+        pool.join()
+        http_client.close()
+
+    # The planning requests are small, so their time is almost all latency
+    seconds_per_request = 0.0
+    if plan_stage_timings.counters["requests"] > 0:
+        seconds_per_request = sum(plan_stage_timings.get_time(stage_name=stage_name) for stage_name
+                                  in ("http_connect", "http_first_byte", "body_download")) / plan_stage_timings.counters["requests"]
+
+    dataset_cost_estimates = []
+    for dataset_size in dataset_sizes:
+        api_id, total_record_count, number_of_columns_in_dataset, bytes_per_record, is_unchanged, problem_message = \
+            dataset_size
+        inspection_mode, request_count, byte_count, seconds = "unknown", 0, 0, 0.0
+        if is_unchanged:
+            inspection_mode = "cached"
+        elif problem_message is None:
+            inspection_mode, request_count, byte_count, seconds = estimate_dataset_inspection_cost(
+                api_id=api_id,
+                total_record_count=total_record_count,
+                number_of_columns_in_dataset=number_of_columns_in_dataset,
+                bytes_per_record=bytes_per_record,
+                seconds_per_request=seconds_per_request)
+            if (SCHEDULER_COUNT_UNKNOWN_DATASETS.value and api_id not in cached_results
+                    and api_id not in latest_dataset_sizes):
+                request_count += 1
+                seconds += seconds_per_request
+        dataset_cost_estimates.append(DatasetCostEstimate(dataset_api_id=api_id,
+                                                          dataset_name=datasets_inventory[api_id].dataset_name,
+                                                          total_record_count=total_record_count,
+                                                          number_of_columns_in_dataset=number_of_columns_in_dataset,
+                                                          inspection_mode=inspection_mode,
+                                                          request_count=request_count,
+                                                          byte_count=byte_count,
+                                                          seconds=seconds,
+                                                          problem_message=problem_message))
+    dataset_cost_estimates.sort(key=lambda cost_estimate: (-cost_estimate.seconds, cost_estimate.dataset_api_id))
+    total_request_count = sum(cost_estimate.request_count for cost_estimate in dataset_cost_estimates)
+    total_byte_count = sum(cost_estimate.byte_count for cost_estimate in dataset_cost_estimates)
+    run_seconds = calculate_run_seconds(dataset_seconds=[cost_estimate.seconds
+                                                         for cost_estimate in dataset_cost_estimates],
+                                        worker_count=DATASET_WORKER_COUNT.value,
+                                        request_count=total_request_count,
+                                        requests_per_second=RATE_LIMIT_REQUESTS_PER_SECOND.value)
+
+    plan_file_path = os.path.join(root_file_destination_location, build_csv_file_name_with_date(
+        today_date_string=build_today_date_string(),
+        filename=build_shard_file_name(filename=PLAN_FILE_NAME.value, shard_index=shard_index,
+                                       shard_count=shard_count)))
+    print("SECONDS, UNCOMPRESSED MEGABYTES, REQUESTS, MODE, RECORDS, COLUMNS, API ID, DATASET NAME")
+    try:
+        with open(plan_file_path, "wb") as file_handler:
+            csv_writer = csv.writer(file_handler, lineterminator="\n")
+            csv_writer.writerow(PLAN_CSV_HEADERS.value)
+            for cost_estimate in dataset_cost_estimates:
+                dataset_name = handle_illegal_characters_in_string(
+                    string_with_illegals=cost_estimate.dataset_name.encode("utf8"), spaces_allowed=True)
+                csv_writer.writerow([dataset_name, cost_estimate.dataset_api_id, cost_estimate.total_record_count,
+                                     cost_estimate.number_of_columns_in_dataset, cost_estimate.inspection_mode,
+                                     cost_estimate.request_count, "{:.2f}".format(cost_estimate.byte_count / 1048576.0),
+                                     "{:.1f}".format(cost_estimate.seconds), cost_estimate.problem_message])
+                print("{:8.1f}, {:9.2f}, {:6}, {}, {}, {}, {}, {}".format(
+                    cost_estimate.seconds, cost_estimate.byte_count / 1048576.0, cost_estimate.request_count,
+                    cost_estimate.inspection_mode, cost_estimate.total_record_count,
+                    cost_estimate.number_of_columns_in_dataset, cost_estimate.dataset_api_id, dataset_name))
+            csv_writer.writerow(["TOTAL", None, None, None, None, total_request_count,
+                                 "{:.2f}".format(total_byte_count / 1048576.0), "{:.1f}".format(run_seconds), None])
+    except IOError as io_err:
+        print(io_err)
+        exit()
+    print("{} datasets, {} requests, {:.1f} MB, about {:.1f} minutes with {} workers. Plan written to {}".format(
+        len(dataset_cost_estimates), total_request_count, total_byte_count / 1048576.0, run_seconds / 60.0,
+        DATASET_WORKER_COUNT.value, plan_file_path))
+    return dataset_cost_estimates
+
+def read_field_names_from_soda_fields_header(dataset_fields_string):
     """
-    Calculate the percent of all possible data values, not rows or columns, that are null
+    Read the dataset field names from the X-SODA2-Fields response header, leaving out system fields such as :id
 
-    :param null_count_total: Total number of null values
-    :param total_records_processed: Total number or records processed
-    :param number_of_fields_in_dataset: Total number of columns in the dataset
-    :return: Percent value as a float
+    :param dataset_fields_string: value of the X-SODA2-Fields header, a json array of field names
+    :return: list of field names
     """
-    if number_of_fields_in_dataset is None:
-        return 0
-    else:
-        total_number_of_values_in_dataset = float(total_records_processed*number_of_fields_in_dataset)
-        if total_number_of_values_in_dataset == 0:
-            return 0
-        else:
-            return (float(null_count_total/total_number_of_values_in_dataset)*100)
+    try:
+        field_names = json.loads(dataset_fields_string)
+    except ValueError:
+        field_names = re.findall("[:a-zA-Z0-9_]+", dataset_fields_string)
+    return [field_name.encode("utf8") for field_name in field_names if not field_name.startswith(":")]
 
-def calculate_time_taken(start_time):
+def read_json_file(file_path):
     """
-    Calculat the time difference between now and the value passed as the start time
+    Read a .json file and grab all contents.
 
-    :param start_time: Time value representing start of processing
-    :return: Difference value between start time and current time
+    :param file_path: Path to the .json file
+    :return: the contents of the .json file
     """
-    return (time.time() - start_time)
+    with open(file_path, 'r') as file_handler:
+        filecontents = file_handler.read()
+    return filecontents
 
-def calculate_total_number_of_empty_values_per_dataset(null_counts_list):
+def read_last_modified_from_response_info(response_info):
     """
-    Calculate the total number of null values in a dataset
+    Read when the dataset was last modified from the headers of a socrata response
 
-    :param null_counts_list: List of numeric values representing null counts per column in dataset
-    :return: Integer value representing total
+    :param response_info: response info (headers) of a request for dataset records
+    :return: last modified stamp string, or None when socrata did not provide one
     """
-    return sum(null_counts_list)
+    for header_name in ("X-SODA2-Truth-Last-Modified", "Last-Modified"):
+        header_value = response_info.getheader(header_name)
+        if header_value:
+            return header_value
+    return None
 
-def generate_freshness_report_json_objects(dataset_url):
+def read_run_checkpoint_state(file_path):
     """
-    Makes request to socrata url for dataset and processes response into json objects
+    Read the state saved by RunCheckpoint
 
-    :param dataset_url: url to which the request is made
-    :return: json objects in dictionary form
+    When the file is missing but the temporary file is present, a save was interrupted between removing the old file
+    and renaming the new one (only possible on Windows) and the temporary file is complete.
+    :param file_path: Path to the checkpoint json file
+    :return: state dictionary, or None when there is no checkpoint
     """
-    json_objects = None
-    url = dataset_url
-    req = urllib2.Request(url)
-    try:
-        response = urllib2.urlopen(req)
-    except urllib2.URLError as e:
-        if hasattr(e, "reason"):
-            print("build_datasets_inventory(): Failed to reach a server. Reason: {}".format(e.reason))
-        elif hasattr(e, "code"):
-            print("build_datasets_inventory(): The server couldn't fulfill the request. Error Code: {}".format(e.code))
-        exit()
-    else:
-        html = response.read()
-        json_objects = json.loads(html)
-    return json_objects
+    temporary_file_path = file_path + ".tmp"
+    if not os.path.exists(file_path) and os.path.exists(temporary_file_path):
+        file_path = temporary_file_path
+    if not os.path.exists(file_path):
+        return None
+    return json.loads(read_json_file(file_path=file_path))
 
-def grab_field_names_for_mega_columned_datasets(socrata_json_object):
+def report_results_diff(root_file_destination_location, earlier_run_date_string, later_run_date_string=None):
     """
-    Generate a dictionary of column names. Specific to very large datasets where field names are suppressed by socrata.
+    Print, and write to a csv file, what changed in the results between two runs in the result history
 
-    :param socrata_json_object: response.info() json content from socrata
-    :return: dictionary of hidden and visible field names in dataset
+    :param root_file_destination_location: Folder holding the result history store
+    :param earlier_run_date_string: Date string of the run to compare against
+    :param later_run_date_string: Date string of the later run. Default: the latest run in the store
+    :return: None
     """
-    column_list = None
-    field_names_list_visible = []
-    field_names_list_hidden = []
+    history_store = ResultHistoryStore(database_file_path=os.path.join(root_file_destination_location,
+                                                                       HISTORY_STORE_FILE_NAME.value))
     try:
-        meta = socrata_json_object['meta']
-        view = meta['view']
-        column_list = view['columns']
-    except KeyError as ke:
-        print("Problem accessing json dictionary in Mega Column Dataset File. Key not found = {}".format(ke))
+        run_dates = history_store.read_run_dates()
+        if later_run_date_string is None and run_dates:
+            later_run_date_string = run_dates[-1]
+        for run_date_string in (earlier_run_date_string, later_run_date_string):
+            if run_date_string not in run_dates:
+                print("No run of {} in the result history. Runs stored: {}".format(run_date_string,
+                                                                                   ", ".join(run_dates)))
+                return
+        earlier_dataset_rows, earlier_field_null_counts = history_store.read_run_results(
+            run_date_string=earlier_run_date_string)
+        later_dataset_rows, later_field_null_counts = history_store.read_run_results(
+            run_date_string=later_run_date_string)
+        earlier_inventory_api_ids = history_store.read_run_inventory(run_date_string=earlier_run_date_string)
+        later_inventory_api_ids = history_store.read_run_inventory(run_date_string=later_run_date_string)
+    finally:
+        history_store.close()
+    results_changes = calculate_results_changes(earlier_dataset_rows=earlier_dataset_rows,
+                                                earlier_field_null_counts=earlier_field_null_counts,
+                                                later_dataset_rows=later_dataset_rows,
+                                                later_field_null_counts=later_field_null_counts,
+                                                min_percent_points=HISTORY_DIFF_MIN_PERCENT_POINTS.value,
+                                                earlier_inventory_api_ids=earlier_inventory_api_ids,
+                                                later_inventory_api_ids=later_inventory_api_ids)
+    diff_file_path = os.path.join(root_file_destination_location, build_csv_file_name_with_date(
+        today_date_string=later_run_date_string,
+        filename="{}_SINCE_{}".format(HISTORY_DIFF_FILE_NAME.value, earlier_run_date_string)))
+    try:
+        with open(diff_file_path, "wb") as file_handler:
+            csv_writer = csv.writer(file_handler, lineterminator="\n")
+            csv_writer.writerow(["DATASET NAME", "API ID", "CHANGE", "FIELD NAME", earlier_run_date_string,
+                                 later_run_date_string])
+            for result_change in results_changes:
+                csv_writer.writerow([result_change.dataset_name, result_change.dataset_api_id, result_change.change,
+                                     result_change.field_name, result_change.earlier_value,
+                                     result_change.later_value])
+    except IOError as io_err:
+        print(io_err)
         exit()
-    for dictionary in column_list:
-        temp_field_list = dictionary.keys()
-        if 'flags' in temp_field_list:
-            field_names_list_hidden.append(dictionary['fieldName'])
-        else:
-            field_names_list_visible.append(dictionary['fieldName'])
-    fields_dict = {"visible":field_names_list_visible, "hidden":field_names_list_hidden}
-    return fields_dict
+    for result_change in results_changes:
+        print("{} ({}): {} {} {} -> {}".format(result_change.dataset_name, result_change.dataset_api_id,
+                                              result_change.change, result_change.field_name or "",
+                                              result_change.earlier_value, result_change.later_value))
+    print("{} changes from {} to {}, written to {}".format(len(results_changes), earlier_run_date_string,
+                                                           later_run_date_string, diff_file_path))
+    return
 
-def handle_illegal_characters_in_string(string_with_illegals, spaces_allowed=False):
+def report_results_trend(root_file_destination_location, api_id, field_name=None):
     """
-    Process string, only allowing alpha and numeric. Spaces can be allowed.
+    Print the results of a dataset, or of one of its fields, in every run in the result history
 
-    :param string_with_illegals: Input string to be processed
-    :param spaces_allowed: If True, spaces will be allowed
-    :return: String with illegal characters removed.
+    :param root_file_destination_location: Folder holding the result history store
+    :param api_id: ID specific to dataset of interest
+    :param field_name: Name of the field of interest, or None for the whole dataset
+    :return: None
     """
-    if spaces_allowed:
-        re_string = "[a-zA-Z0-9 ]"
-    else:
-        re_string = "[a-zA-Z0-9]"
-    strings_list = re.findall(re_string,string_with_illegals)
-    return "".join(strings_list)
+    history_store = ResultHistoryStore(database_file_path=os.path.join(root_file_destination_location,
+                                                                       HISTORY_STORE_FILE_NAME.value))
+    try:
+        if field_name is None:
+            print("RUN DATE, TOTAL RECORD COUNT, TOTAL COLUMN COUNT, TOTAL NULL VALUE COUNT, PERCENT NULL")
+            for run_date, total_record_count, number_of_columns, null_count_total, is_problematic in \
+                    history_store.read_dataset_trend(api_id=api_id):
+                if is_problematic:
+                    print("{}, PROBLEMATIC".format(run_date))
+                    continue
+                print("{}, {}, {}, {}, {:6.2f}".format(run_date, total_record_count, number_of_columns,
+                                                       int(null_count_total),
+                                                       calculate_percent_null_for_dataset(
+                                                           null_count_total=int(null_count_total),
+                                                           total_records_processed=total_record_count,
+                                                           number_of_fields_in_dataset=number_of_columns)))
+        else:
+            print("RUN DATE, TOTAL RECORD COUNT, NULL COUNT, PERCENT NULL")
+            for run_date, total_record_count, null_count in history_store.read_field_trend(api_id=api_id,
+                                                                                           field_name=field_name):
+                percent = 0
+                if total_record_count > 0:
+                    percent = (null_count / float(total_record_count))*100
+                print("{}, {}, {}, {:6.2f}".format(run_date, total_record_count, null_count, percent))
+    finally:
+        history_store.close()
+    return
 
-def inspect_record_for_null_values(field_null_count_dict, record_dictionary):
+def sample_dataset_when_large(http_client, api_id, dataset_display_name, record_count, is_record_count_fresh, schema_cache, freshness_report_last_updated, stage_timings):
     """
-    Inspect the socrata record for the number of null values
+    Estimate the null values of a dataset from a sample of pages, when it is large enough or listed in SAMPLING_API_IDS
 
-    :param field_null_count_dict: dictionary that counts the nulls for each field in the dataset
-    :param record_dictionary: the data record to be evaluated
-    :return: nothing
+    A record count that is not fresh, such as a cached one, is enough to decide, but the estimate is scaled by a fresh
+     count. Without a record count one is requested. A failed count request means the dataset is read in full.
+    :param http_client: SocrataHttpClient shared by all requests of the run
+    :param api_id: ID specific to dataset of interest
+    :param dataset_display_name: Name of the dataset as printed
+    :param record_count: Number of records in the dataset, or None when not known
+    :param is_record_count_fresh: True when the record count was requested during the run
+    :param schema_cache: SchemaCache shared by all datasets of the run
+    :param freshness_report_last_updated: Last updated stamp of the dataset in the freshness report, or None
+    :param stage_timings: StageTimings of the dataset
+    :return: tuple of the estimated DatasetResult, the DatasetSamplingResult and the record count, or None when the
+     dataset is to be read in full
+    :raises SocrataRequestError: When a sampled page could not be requested
+    :raises ValueError: When the sampled pages could not be used
     """
-    # In the response from a request to Socrata, only the fields with non-null/empty values appear to be included
-    record_dictionary_fields = record_dictionary.keys()
-    for field_name in field_null_count_dict.keys():
-        # It appears Socrata does not send empty fields so absence will be presumed to indicate empty/null values
-        if field_name not in record_dictionary_fields:
-            field_null_count_dict[field_name] += 1
-    return
+    try:
+        if record_count is None:
+            record_count = fetch_dataset_record_count(http_client=http_client,
+                                                      url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                                      api_id=api_id,
+                                                      stage_timings=stage_timings)
+            is_record_count_fresh = True
+        is_sampling_wanted = (record_count > SAMPLING_PAGE_COUNT.value * SAMPLING_PAGE_SIZE_RECORDS.value
+                              and (api_id in SAMPLING_API_IDS.value
+                                   or (SAMPLING_ROW_THRESHOLD.value is not None
+                                       and record_count >= SAMPLING_ROW_THRESHOLD.value)))
+        if is_sampling_wanted and not is_record_count_fresh:
+            record_count = fetch_dataset_record_count(http_client=http_client,
+                                                      url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+                                                      api_id=api_id,
+                                                      stage_timings=stage_timings)
+    except (SocrataRequestError, ValueError) as count_err:
+        print("Record count failed, not sampling. {}: {}".format(api_id, count_err))
+        return None
+    if not is_sampling_wanted:
+        return None
+    print("SAMPLING {} of {} records: {} ............. {}".format(
+        SAMPLING_PAGE_COUNT.value * SAMPLING_PAGE_SIZE_RECORDS.value, record_count, dataset_display_name, api_id))
+    field_null_counts, sampling_result = estimate_null_values_by_sampling(
+        http_client=http_client,
+        url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
+        api_id=api_id,
+        total_record_count=record_count,
+        page_count=SAMPLING_PAGE_COUNT.value,
+        page_size=SAMPLING_PAGE_SIZE_RECORDS.value,
+        schema_cache=schema_cache,
+        freshness_report_last_updated=freshness_report_last_updated,
+        stage_timings=stage_timings)
+    return field_null_counts, sampling_result, record_count
 
-def load_json(json_file_contents):
+def select_json_backend(backend_names):
     """
-    Load .json file contents
+    Choose the first json library that imports, so a faster decoder is used when one is installed
 
-    :param json_file_contents: contents of a json file
-    :return: the json file contents as a python dictionary
+    :param backend_names: module names in order of preference, each with a loads function, such as orjson or ujson
+    :return: tuple of the backend name and its loads function; the standard library json when none imports
     """
-    return json.loads(json_file_contents)
+    for backend_name in backend_names:
+        try:
+            backend_module = importlib.import_module(backend_name)
+        except ImportError:
+            continue
+        return backend_name, backend_module.loads
+    return "json", json.loads
 
-def read_json_file(file_path):
+def truncate_report_file(file_path, byte_size):
     """
-    Read a .json file and grab all contents.
+    Cut a report file back to its size at the last checkpoint, dropping rows written after it
 
-    :param file_path: Path to the .json file
-    :return: the contents of the .json file
+    :param file_path: Path to the report csv file
+    :param byte_size: Size of the file at the last checkpoint
+    :return: None
     """
-    with open(file_path, 'r') as file_handler:
-        filecontents = file_handler.read()
-    return filecontents
+    if os.path.exists(file_path) and os.path.getsize(file_path) > byte_size:
+        with open(file_path, "r+b") as file_handler:
+            file_handler.truncate(byte_size)
+    return
 
-def write_dataset_results_to_csv(dataset_name, root_file_destination_location, filename, dataset_inspection_results, total_records, processing_time):
+def write_dataset_results_to_csv(dataset_name, root_file_destination_location, filename, dataset_inspection_results, total_records, processing_time, sampling_result=None, field_profiles=None, profile_csv_headers=None):
     """
     Write a csv file containing the analysis results specific to a single dataset
 
+    Results estimated from a sample are marked as sampled, with the sample size and a confidence interval for the
+     null percent of each field.
     :param dataset_name: Name of the dataset of interest
     :param root_file_destination_location: Path to the location where the file directory where the file will be created
     :param filename: Name of the file, specific to each dataset
     :param dataset_inspection_results: Results of the data set inspection for null values
     :param total_records: Total number of records in the dataset
     :param processing_time: Time it took to process the dataset
+    :param sampling_result: DatasetSamplingResult when the results were estimated from a sample, otherwise None
+    :param field_profiles: dictionary of field name to profile csv cell values, or None when not profiled
+    :param profile_csv_headers: list of the profile csv column names
     :return: None
     """
     file_path = os.path.join(root_file_destination_location, filename)
     try:
-        with open(file_path, 'w') as file_handler:
-            file_handler.write("{}\n".format(dataset_name))
-            file_handler.write("RECORD COUNT TOTAL,{}\n".format(total_records))
-            file_handler.write("PROCESSING TIME,{}\n".format(processing_time))
-            file_handler.write("FIELD NAME,NULL COUNT,PERCENT\n")
+        with open(file_path, 'wb') as file_handler:
+            csv_writer = csv.writer(file_handler, lineterminator="\n")
+            csv_writer.writerow([dataset_name])
+            csv_writer.writerow(["RECORD COUNT TOTAL", total_records])
+            csv_writer.writerow(["PROCESSING TIME", processing_time])
+            if sampling_result is not None:
+                csv_writer.writerow(["SAMPLED", "TRUE"])
+                csv_writer.writerow(["SAMPLED RECORD COUNT", sampling_result.sampled_record_count])
+                csv_writer.writerow(["SAMPLED PAGE COUNT", sampling_result.sampled_page_count])
+                csv_writer.writerow(["CONFIDENCE Z SCORE", sampling_result.confidence_z_score])
+                csv_writer.writerow(["FIELD NAME", "ESTIMATED NULL COUNT", "PERCENT", "PERCENT LOWER BOUND",
+                                     "PERCENT UPPER BOUND"])
+            elif field_profiles is not None:
+                csv_writer.writerow(["FIELD NAME", "NULL COUNT", "PERCENT"] + list(profile_csv_headers))
+            else:
+                csv_writer.writerow(["FIELD NAME", "NULL COUNT", "PERCENT"])
             for key, value in dataset_inspection_results.items():
                 percent = 0
                 if total_records > 0:
                     percent = (value / float(total_records))*100
-                file_handler.write("{},{},{:6.2f}\n".format(key, value, percent))
+                if sampling_result is not None:
+                    lower_bound, upper_bound = sampling_result.null_proportion_intervals[key]
+                    csv_writer.writerow([key, value, "{:6.2f}".format(percent), "{:6.2f}".format(lower_bound * 100),
+                                         "{:6.2f}".format(upper_bound * 100)])
+                elif field_profiles is not None:
+                    csv_writer.writerow([key, value, "{:6.2f}".format(percent)] + list(field_profiles.get(key, [])))
+                else:
+                    csv_writer.writerow([key, value, "{:6.2f}".format(percent)])
+    except IOError as io_err:
+        print(io_err)
+        exit()
+    return
+
+def write_dataset_stage_timings_to_csv(stage_timings_report_writer, dataset_name, dataset_api_id, processing_time, stage_timings):
+    """
+    Write the time spent in each processing stage, and the throughput counters, for a dataset to .csv
+
+    :param stage_timings_report_writer: CsvReportWriter for the stage timings file
+    :param dataset_name: Name of the dataset of interest
+    :param dataset_api_id: ID specific to dataset of interest
+    :param processing_time: Time it took to process the dataset
+    :param stage_timings: StageTimings of the dataset
+    :return: None
+    """
+    row = [dataset_name, dataset_api_id, "{:.3f}".format(processing_time)]
+    for stage_name in TIMING_STAGE_NAMES.value:
+        row.append("{:.3f}".format(stage_timings.get_time(stage_name=stage_name)))
+    for counter_name in TIMING_COUNTER_NAMES.value:
+        row.append(stage_timings.counters[counter_name])
+    records_per_second = 0
+    if processing_time > 0:
+        records_per_second = stage_timings.counters["records"] / processing_time
+    row.append("{:.1f}".format(records_per_second))
+    try:
+        stage_timings_report_writer.write_row(row)
     except IOError as io_err:
         print(io_err)
         exit()
     return
 
-def write_overview_stats_to_csv(root_file_destination_location, filename, dataset_name, dataset_csv_file_name, total_number_of_dataset_columns, total_number_of_dataset_records, data_provider, total_number_of_null_fields=0, percent_null=0):
+def write_json_file_atomically(file_path, json_object):
+    """
+    Write a json file so that it is either completely old or completely new, never partly written
+
+    :param file_path: Path to the json file
+    :param json_object: Object to serialize
+    :return: None
+    """
+    temporary_file_path = file_path + ".tmp"
+    try:
+        with open(temporary_file_path, "w") as file_handler:
+            json.dump(json_object, file_handler)
+            file_handler.flush()
+            os.fsync(file_handler.fileno())
+        try:
+            os.rename(temporary_file_path, file_path)
+        except OSError:
+            # Windows does not rename over an existing file
+            os.remove(file_path)
+            os.rename(temporary_file_path, file_path)
+    except IOError as io_err:
+        print(io_err)
+        exit()
+    return
+
+def write_overview_stats_to_csv(overview_report_writer, dataset_name, dataset_csv_file_name, total_number_of_dataset_columns, total_number_of_dataset_records, data_provider, total_number_of_null_fields=0, percent_null=0, is_sampled=False):
     """
     Write analysis results for entire process, as an overview of all datasets, to .csv
-    :param root_file_destination_location: Path to the location where the file directory where the file will be created
-    :param filename: Name of the overview analysis file
+    :param overview_report_writer: CsvReportWriter for the overview analysis file
     :param dataset_name: Name of the dataset of interest
     :param dataset_csv_file_name: Filename of the dataset of interest
     :param total_number_of_dataset_columns: Total number of columns in dataset of interest
@@ -282,52 +4072,40 @@ def write_overview_stats_to_csv(root_file_destination_location, filename, datase
     :param data_provider: Data provider for dataset of interest
     :param total_number_of_null_fields: Total number of null fields for dataset of interest
     :param percent_null: The percent null for the dataset of interest
+    :param is_sampled: True when the null counts are estimated from a sample
     :return: None
     """
-    file_path = os.path.join(root_file_destination_location, filename)
     try:
-        if not os.path.exists(file_path):
-            with open(file_path, "w") as file_handler:
-                file_handler.write("DATASET NAME,FILE NAME,TOTAL COLUMN COUNT,TOTAL RECORD COUNT,TOTAL NULL VALUE COUNT,PERCENT NULL,DATA PROVIDER\n")
-        if os.path.exists(file_path):
-            with open(file_path, 'a') as file_handler:
-                file_handler.write("{},{},{},{},{},{:6.2f},{}\n".format(dataset_name,
-                                                                     dataset_csv_file_name,
-                                                                     total_number_of_dataset_columns,
-                                                                     total_number_of_dataset_records,
-                                                                     total_number_of_null_fields,
-                                                                     percent_null,
-                                                                     data_provider)
-                                   )
+        overview_report_writer.write_row([dataset_name,
+                                          dataset_csv_file_name,
+                                          total_number_of_dataset_columns,
+                                          total_number_of_dataset_records,
+                                          total_number_of_null_fields,
+                                          "{:6.2f}".format(percent_null),
+                                          data_provider,
+                                          "TRUE" if is_sampled else "FALSE"])
     except IOError as io_err:
         print(io_err)
         exit()
     return
 
-def write_problematic_datasets_to_csv(root_file_destination_location, filename, dataset_name, message, resource=None):
+def write_problematic_datasets_to_csv(problem_report_writer, dataset_name, message, resource=None):
     """
     Write to .csv any datasets that encountered problems during processing.
-    :param root_file_destination_location:  Path to the location where the file directory where the file will be created
-    :param filename: Name of the problem datasets file
+    :param problem_report_writer: CsvReportWriter for the problem datasets file
     :param dataset_name: Name of the dataset of interest
     :param message: Message related to reason was problematic
     :param resource: The url resource that was being processed when problem occurred
     :return: None
     """
-    file_path = os.path.join(root_file_destination_location, filename)
     try:
-        if not os.path.exists(file_path):
-            with open(file_path, "w") as file_handler:
-                file_handler.write("DATASET NAME,PROBLEM MESSAGE,RESOURCE\n")
-        if os.path.exists(file_path):
-            with open(file_path, 'a') as file_handler:
-                file_handler.write("{},{},{}\n".format(dataset_name, message, resource))
+        problem_report_writer.write_row([dataset_name, message, resource])
     except IOError as io_err:
         print(io_err)
         exit()
     return
 
-def write_script_performance_summary(root_file_destination_location, filename, start_time, number_of_datasets_in_data_freshness_report, dataset_counter, valid_nulls_dataset_counter, valid_no_null_dataset_counter, problem_dataset_counter):
+def write_script_performance_summary(root_file_destination_location, filename, start_time, number_of_datasets_in_data_freshness_report, dataset_counter, valid_nulls_dataset_counter, valid_no_null_dataset_counter, problem_dataset_counter, cached_dataset_counter=0, run_stage_timings=None, final_requests_per_second=None, end_time=None, deferred_dataset_counter=0, null_value_counter=0, cell_counter=0):
     """
     Write a summary file that details the performance of this script during processing
 
@@ -339,6 +4117,13 @@ def write_script_performance_summary(root_file_destination_location, filename, s
     :param valid_nulls_dataset_counter: Number of datasets with at least on valid null
     :param valid_no_null_dataset_counter: Number of datasets with zero detected null values
     :param problem_dataset_counter: Number of datasets with problems
+    :param cached_dataset_counter: Number of unchanged datasets whose results came from the result cache
+    :param run_stage_timings: StageTimings totalled over all datasets of the run
+    :param final_requests_per_second: Rate the rate limiter had reached by the end of the run
+    :param end_time: Time the process ended, when not now
+    :param deferred_dataset_counter: Number of datasets deferred to the next run by the time budget
+    :param null_value_counter: Number of null values over all valid datasets
+    :param cell_counter: Number of cells, records times fields, over all valid datasets
     :return: None
     """
     file_path = os.path.join(root_file_destination_location, filename)
@@ -350,252 +4135,355 @@ def write_script_performance_summary(root_file_destination_location, filename, s
             scriptperformancesummaryhandler.write("Valid datasets with nulls count (csv generated),{}\n".format(valid_nulls_dataset_counter))
             scriptperformancesummaryhandler.write("Valid datasets without nulls count (no csv),{}\n".format(valid_no_null_dataset_counter))
             scriptperformancesummaryhandler.write("Problematic datasets count,{}\n".format(problem_dataset_counter))
-            time_took = time.time() - start_time
+            scriptperformancesummaryhandler.write("Unchanged datasets from result cache count,{}\n".format(cached_dataset_counter))
+            scriptperformancesummaryhandler.write("Deferred datasets count (time budget),{}\n".format(deferred_dataset_counter))
+            scriptperformancesummaryhandler.write("Null values count (all datasets),{}\n".format(null_value_counter))
+            percent_null = 0
+            if cell_counter > 0:
+                percent_null = null_value_counter * 100.0 / cell_counter
+            scriptperformancesummaryhandler.write("Percent null (all datasets),{:.2f}\n".format(percent_null))
+            time_took = (end_time or time.time()) - start_time
             scriptperformancesummaryhandler.write("Process time (minutes),{:6.2f}\n".format(time_took/60.0))
+            if run_stage_timings is not None:
+                for stage_name in TIMING_STAGE_NAMES.value:
+                    scriptperformancesummaryhandler.write("Stage time {} (seconds),{:.2f}\n".format(
+                        stage_name, run_stage_timings.get_time(stage_name=stage_name)))
+                for counter_name in TIMING_COUNTER_NAMES.value:
+                    scriptperformancesummaryhandler.write("Total {},{}\n".format(
+                        counter_name, run_stage_timings.counters[counter_name]))
+                records_per_second = 0
+                if time_took > 0:
+                    records_per_second = run_stage_timings.counters["records"] / time_took
+                scriptperformancesummaryhandler.write("Records per second,{:.1f}\n".format(records_per_second))
+            if final_requests_per_second is not None:
+                scriptperformancesummaryhandler.write("Rate limit at end (requests per second),{:.2f}\n".format(
+                    final_requests_per_second))
     except IOError as io_err:
         print(io_err)
         exit()
     return
 
 # FUNCTIONALITY
-def main():
+def main(is_resume_requested=False, shard_index=0, shard_count=1, time_budget_seconds=None):
+
+    # A resumed run carries on with the report files, counters and datasets of the interrupted run. Each shard of a
+    #   sharded run has its own checkpoint and partial report files.
+    checkpoint_file_name, checkpoint_file_extension = os.path.splitext(CHECKPOINT_FILE_NAME.value)
+    checkpoint_file_path = os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value, build_shard_file_name(
+        filename=checkpoint_file_name, shard_index=shard_index, shard_count=shard_count) + checkpoint_file_extension)
+    resumed_state = None
+    if is_resume_requested:
+        resumed_state = read_run_checkpoint_state(file_path=checkpoint_file_path)
+        if resumed_state is None:
+            print("No checkpoint found at {}. Starting a new run.".format(checkpoint_file_path))
+    if resumed_state is not None:
+        run_date_string = resumed_state["run_date"].encode("utf8")
+        print("Resuming the run of {}; {} datasets already finished".format(run_date_string,
+                                                                           len(resumed_state["finished_api_ids"])))
+    else:
+        run_date_string = build_today_date_string()
+    run_checkpoint = RunCheckpoint(file_path=checkpoint_file_path, resumed_state=resumed_state)
 
     # Initiate csv report files
-    problem_datasets_csv_filename = build_csv_file_name_with_date(
-        today_date_string=build_today_date_string(),
-        filename=PROBLEM_DATASETS_FILE_NAME.value)
-    overview_csv_filename = build_csv_file_name_with_date(today_date_string=build_today_date_string(),
-                                                          filename=OVERVIEW_STATS_FILE_NAME.value)
+    report_file_names = {}
+    for report_name, report_file_name in (("problem", PROBLEM_DATASETS_FILE_NAME.value),
+                                          ("overview", OVERVIEW_STATS_FILE_NAME.value),
+                                          ("stage_timings", STAGE_TIMINGS_FILE_NAME.value)):
+        report_file_names[report_name] = build_csv_file_name_with_date(
+            today_date_string=run_date_string,
+            filename=build_shard_file_name(filename=report_file_name, shard_index=shard_index, shard_count=shard_count))
+    report_header_rows = {"problem": PROBLEM_DATASETS_CSV_HEADERS.value,
+                          "overview": OVERVIEW_STATS_CSV_HEADERS.value,
+                          "stage_timings": build_stage_timings_csv_headers()}
+    report_writers = {}
+    try:
+        for report_name, report_file_name in report_file_names.items():
+            report_file_path = os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value, report_file_name)
+            existing_row_count = 0
+            if resumed_state is not None:
+                # Rows written after the checkpoint belong to datasets that will be inspected again
+                report_file_state = resumed_state["report_files"][report_name]
+                truncate_report_file(file_path=report_file_path, byte_size=report_file_state["byte_size"])
+                existing_row_count = report_file_state["row_count"]
+            report_writers[report_name] = CsvReportWriter(
+                file_path=report_file_path,
+                header_row=report_header_rows[report_name],
+                buffer_row_count=REPORT_WRITER_BUFFER_ROW_COUNT.value,
+                flush_interval_seconds=REPORT_WRITER_FLUSH_INTERVAL_SECONDS.value,
+                existing_row_count=existing_row_count)
+    except IOError as io_err:
+        print(io_err)
+        exit()
+    problem_report_writer = report_writers["problem"]
+    overview_report_writer = report_writers["overview"]
+    stage_timings_report_writer = report_writers["stage_timings"]
+    run_stage_timings = StageTimings()
+    if resumed_state is not None:
+        for stage_name, seconds in resumed_state["stage_seconds"].items():
+            run_stage_timings.add_time(stage_name=stage_name, seconds=seconds)
+        for counter_name, amount in resumed_state["stage_counters"].items():
+            run_stage_timings.add_count(counter_name=counter_name, amount=amount)
+    else:
+        # A new run is checkpointed before any report row is written, so a run that dies before the first timed save
+        #   is still resumed rather than started again, appending its rows a second time to the dated report files
+        run_checkpoint.save(run_state=build_run_checkpoint_state(
+            run_date_string=run_date_string,
+            dataset_counters={"cached_dataset_counter": 0,
+                              "cell_counter": 0,
+                              "dataset_counter": 0,
+                              "deferred_dataset_counter": 0,
+                              "null_value_counter": 0,
+                              "problem_dataset_counter": 0,
+                              "valid_no_null_dataset_counter": 0,
+                              "valid_nulls_dataset_counter": 0},
+            report_writers=report_writers,
+            run_stage_timings=run_stage_timings,
+            deferred_api_ids=[]))
 
     # Need an inventory of all Maryland Socrata datasets; will gather from the data freshness report.
     data_freshness_url = build_dataset_url(url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
                                            api_id=DATA_FRESHNESS_REPORT_API_ID.value,
-                                           limit_amount=LIMIT_MAX_AND_OFFSET.value,
-                                           offset=0,
-                                           total_count=0)
-    freshness_report_json_objects = generate_freshness_report_json_objects(dataset_url=data_freshness_url)
-    dict_of_socrata_dataset_IDs = build_datasets_inventory(freshness_report_json_objects=freshness_report_json_objects)
-    number_of_datasets_in_data_freshness_report = len(dict_of_socrata_dataset_IDs)
-    dict_of_socrata_dataset_providers = {}
-    for record_obj in freshness_report_json_objects:
-        data_freshness_dataset_name = (record_obj["dataset_name"]).encode("utf8")
-        data_freshness_report_dataset_name_noillegal = handle_illegal_characters_in_string(string_with_illegals=data_freshness_dataset_name,
-                                                           spaces_allowed=True)
-        data_freshness_data_provider = (record_obj["data_provided_by"]).encode("utf8")
-        provider_name_noillegal = handle_illegal_characters_in_string(string_with_illegals=data_freshness_data_provider,
-                                                            spaces_allowed=True)
-        dict_of_socrata_dataset_providers[data_freshness_report_dataset_name_noillegal] = os.path.basename(provider_name_noillegal)
+                                           limit_amount=PAGE_SIZE_MAX_RECORDS.value,
+                                           offset=0)
+    http_client = build_http_client()
+    try:
+        freshness_report_json_objects = generate_freshness_report_json_objects(http_client=http_client,
+                                                                               dataset_url=data_freshness_url,
+                                                                               stage_timings=run_stage_timings)
+    except SocrataRequestError as request_err:
+        # Without the inventory there is nothing to inspect, but the failure is still reported like any other
+        print("generate_freshness_report_json_objects(): {}".format(request_err))
+        write_problematic_datasets_to_csv(problem_report_writer=problem_report_writer,
+                                          dataset_name="Data Freshness Report",
+                                          message=str(request_err),
+                                          resource=data_freshness_url)
+        http_client.close()
+        problem_report_writer.close()
+        overview_report_writer.close()
+        stage_timings_report_writer.close()
+        return
+    datasets_inventory = build_datasets_inventory(freshness_report_json_objects=freshness_report_json_objects)
+    number_of_datasets_in_data_freshness_report = len(datasets_inventory)
+    dict_of_socrata_dataset_last_modified = {}
+    for api_id, inventory_entry in datasets_inventory.items():
+        dict_of_socrata_dataset_last_modified[api_id.encode("utf8")] = inventory_entry.last_updated
+    # Datasets sharing a name get the api id in their csv file name so they do not overwrite each other
+    dataset_name_counts = Counter(inventory_entry.dataset_name for inventory_entry in datasets_inventory.values())
+
+    # Results of previous runs are reused for datasets that have not been modified since
+    result_cache = DatasetResultCache(database_file_path=os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value,
+                                                                      RESULT_CACHE_FILE_NAME.value))
+    profile_csv_headers = DatasetProfiler(field_names=[], metric_names=PROFILE_METRICS.value).build_csv_headers()
+    cached_results = result_cache.read_cached_results(profile_csv_headers=profile_csv_headers)
+    history_store = ResultHistoryStore(database_file_path=os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value,
+                                                                       HISTORY_STORE_FILE_NAME.value))
+    history_store.store_run_inventory(run_date_string=run_date_string, api_ids=datasets_inventory.keys())
+    schema_cache = SchemaCache(http_client=http_client,
+                               folder_path=os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value, SCHEMA_CACHE_FOLDER_NAME.value))
 
     # Variables for next lower scope (alphabetic)
+    cached_dataset_counter = 0
+    cell_counter = 0
     dataset_counter = 0
+    deferred_api_ids = []
+    deferred_dataset_counter = 0
+    null_value_counter = 0
     problem_dataset_counter = 0
     valid_no_null_dataset_counter = 0
     valid_nulls_dataset_counter = 0
+    if resumed_state is not None:
+        cached_dataset_counter = resumed_state["dataset_counters"]["cached_dataset_counter"]
+        cell_counter = resumed_state["dataset_counters"].get("cell_counter", 0)
+        dataset_counter = resumed_state["dataset_counters"]["dataset_counter"]
+        deferred_api_ids = list(resumed_state.get("deferred_api_ids", []))
+        deferred_dataset_counter = resumed_state["dataset_counters"].get("deferred_dataset_counter", 0)
+        null_value_counter = resumed_state["dataset_counters"].get("null_value_counter", 0)
+        problem_dataset_counter = resumed_state["dataset_counters"]["problem_dataset_counter"]
+        valid_no_null_dataset_counter = resumed_state["dataset_counters"]["valid_no_null_dataset_counter"]
+        valid_nulls_dataset_counter = resumed_state["dataset_counters"]["valid_nulls_dataset_counter"]
+    api_ids_to_inspect = [api_id for api_id in datasets_inventory
+                          if api_id not in run_checkpoint.finished_api_ids
+                          and calculate_dataset_shard_index(api_id=api_id.encode("utf8"),
+                                                            shard_count=shard_count) == shard_index]
 
-    # Need to inventory field names of every dataset and tally null/empty values
-    for dataset_name, dataset_api_id in dict_of_socrata_dataset_IDs.items():
-        dataset_start_time = time.time()
-        # Handle occasional error when writing unicode to string using format. sometimes "-" was problematic
-        dataset_name_with_spaces_but_no_illegal = handle_illegal_characters_in_string(
-            string_with_illegals=dataset_name.encode("utf8"),
-            spaces_allowed=True)
-        dataset_api_id = dataset_api_id.encode("utf8")
-#____________________________________________________________________________________________________________
-        # FOR TESTING - avoid huge datasets on test runs
-        huge_datasets_api_s = (REAL_PROPERTY_HIDDEN_NAMES_API_ID.value,)
-        if dataset_api_id in huge_datasets_api_s:
-            print("Dataset Skipped Intentionally (TESTING): {}".format(dataset_name_with_spaces_but_no_illegal))
+    # Most expensive datasets first, so one large dataset does not start late and stretch the run. With a time
+    #   budget, datasets not expected to finish in time are deferred to the next run, which starts with them.
+    deferred_datasets_file_name, deferred_datasets_file_extension = os.path.splitext(DEFERRED_DATASETS_FILE_NAME.value)
+    deferred_datasets_file_path = os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value, build_shard_file_name(
+        filename=deferred_datasets_file_name, shard_index=shard_index,
+        shard_count=shard_count) + deferred_datasets_file_extension)
+    previously_deferred_api_ids = set()
+    if os.path.exists(deferred_datasets_file_path):
+        previously_deferred_api_ids.update(
+            json.loads(read_json_file(file_path=deferred_datasets_file_path))["deferred_api_ids"])
+    expected_costs, scheduler_record_counts = estimate_dataset_costs(
+        http_client=http_client,
+        api_ids=api_ids_to_inspect,
+        cached_results=cached_results,
+        dataset_last_modified_stamps=dict_of_socrata_dataset_last_modified,
+        latest_dataset_sizes=history_store.read_latest_dataset_sizes(),
+        stage_timings=run_stage_timings)
+    datasets_to_inspect = [(datasets_inventory[api_id].dataset_name, api_id)
+                           for api_id in order_datasets_for_inspection(api_ids=api_ids_to_inspect,
+                                                                       expected_costs=expected_costs,
+                                                                       deferred_api_ids=previously_deferred_api_ids)]
+    if time_budget_seconds is None:
+        time_budget_seconds = SCHEDULER_TIME_BUDGET_SECONDS.value
+    dataset_scheduler = DatasetScheduler(expected_costs=expected_costs,
+                                         time_budget_seconds=time_budget_seconds,
+                                         start_time=process_start_time,
+                                         seconds_per_million_cells=SCHEDULER_SECONDS_PER_MILLION_CELLS.value)
+
+    # Need to inventory field names of every dataset and tally null/empty values. Each dataset is an independent job;
+    #   results are handed back to this thread which is the only one that writes the report csv files, and the only
+    #   one that saves the checkpoint. Waiting for a result times out at the checkpoint interval so slow datasets
+    #   still get checkpointed.
+    decode_process_pool = build_decode_process_pool()
+    pool = ThreadPool(DATASET_WORKER_COUNT.value)
+    dataset_results_iterator = pool.imap_unordered(partial(inspect_dataset,
+                                                           http_client,
+                                                           cached_results,
+                                                           dict_of_socrata_dataset_last_modified,
+                                                           dataset_scheduler,
+                                                           decode_process_pool,
+                                                           run_checkpoint,
+                                                           schema_cache,
+                                                           scheduler_record_counts),
+                                                   datasets_to_inspect)
+    while True:
+        if run_checkpoint.is_save_due(interval_seconds=CHECKPOINT_INTERVAL_SECONDS.value):
+            run_checkpoint.save(run_state=build_run_checkpoint_state(
+                run_date_string=run_date_string,
+                dataset_counters={"cached_dataset_counter": cached_dataset_counter,
+                                  "cell_counter": cell_counter,
+                                  "dataset_counter": dataset_counter,
+                                  "deferred_dataset_counter": deferred_dataset_counter,
+                                  "null_value_counter": null_value_counter,
+                                  "problem_dataset_counter": problem_dataset_counter,
+                                  "valid_no_null_dataset_counter": valid_no_null_dataset_counter,
+                                  "valid_nulls_dataset_counter": valid_nulls_dataset_counter},
+                report_writers=report_writers,
+                run_stage_timings=run_stage_timings,
+                deferred_api_ids=deferred_api_ids))
+        try:
+            dataset_result = dataset_results_iterator.next(timeout=CHECKPOINT_INTERVAL_SECONDS.value)
+        except TimeoutError:
+            continue
+        except StopIteration:
+            break
+        if dataset_result.is_deferred:
+            deferred_dataset_counter += 1
+            deferred_api_ids.append(dataset_result.dataset_api_id)
+            run_checkpoint.mark_dataset_finished(api_id=dataset_result.dataset_api_id)
             continue
-#____________________________________________________________________________________________________________
 
         dataset_counter += 1
-        print("{}: {} ............. {}".format(dataset_counter, dataset_name_with_spaces_but_no_illegal.upper(), dataset_api_id))
-
-        # Variables for next lower scope (alphabetic)
-        dataset_fields_string = None
-        field_headers = None
-        is_problematic = False
-        is_special_too_many_headers_dataset = False
-        json_file_contents = None
-        more_records_exist_than_response_limit_allows = True
-        null_count_for_each_field_dict = {}
-        number_of_columns_in_dataset = None
-        problem_message = None
-        problem_resource = None
-        socrata_record_offset_value = 0
-        socrata_response_info_key_list = None
-        socrata_url_response = None
-        total_record_count = 0
-
-        # Some datasets will have more records than are returned in a single response; varies with the limit_max value
-        while more_records_exist_than_response_limit_allows:
-
-            # Maryland Statewide Vehicle Crashes are excel files, not Socrata records,
-            #   but they will return empty json objects endlessly
-            if dataset_name.startswith(MD_STATEWIDE_VEHICLE_CRASH_STARTSWITH.value):
-                problem_message = "Intentionally skipped. Dataset was an excel file as of 20180409. Call to Socrata endlessly returns empty json objects."
-                is_problematic = True
-                break
-
-            cycle_record_count = 0
-            url = build_dataset_url(url_root=ROOT_URL_FOR_DATASET_ACCESS.value,
-                                    api_id=dataset_api_id,
-                                    limit_amount=LIMIT_MAX_AND_OFFSET.value,
-                                    offset=socrata_record_offset_value,
-                                    total_count=total_record_count)
-            print(url)
-
-            request = urllib2.Request(url)
-
-            try:
-                socrata_url_response = urllib2.urlopen(request)
-            except urllib2.URLError as e:
-                problem_resource = url
-                is_problematic = True
-                if hasattr(e, "reason"):
-                    problem_message = "Failed to reach a server. Reason: {}".format(e.reason)
-                    break
-                elif hasattr(e, "code"):
-                    problem_message = "The server couldn't fulfill the request. Error Code: {}".format(e.code)
-                    break
-
-            # For datasets with a lot of fields it looks like Socrata doesn't return the
-            #   field headers in the response.info() so the X-SODA2-Fields key DNE.
-            # Only need to get the list of socrata response keys the first time through
-            if socrata_response_info_key_list == None:
-                socrata_response_info_key_list = []
-                for key in socrata_url_response.info().keys():
-                    socrata_response_info_key_list.append(key.lower())
-            else:
-                pass
-
-            # Only need to get the field headers the first time through
-            if dataset_fields_string == None and "x-soda2-fields" in socrata_response_info_key_list:
-                dataset_fields_string = socrata_url_response.info()["X-SODA2-Fields"]
-            elif dataset_fields_string == None and "x-soda2-fields" not in socrata_response_info_key_list:
-                is_special_too_many_headers_dataset = True
-            else:
-                pass
-
-            # If Socrata didn't send the headers see if the dataset is one of the two known to be too big
-            if field_headers == None and is_special_too_many_headers_dataset and dataset_api_id == REAL_PROPERTY_HIDDEN_NAMES_API_ID.value:
-                json_file_contents = read_json_file(file_path=REAL_PROPERTY_HIDDEN_NAMES_JSON_FILE.value)
-            elif field_headers == None and is_special_too_many_headers_dataset and dataset_api_id == CORRECTIONAL_ENTERPRISES_EMPLOYEES_API_ID.value:
-                json_file_contents = read_json_file(file_path=CORRECTIONAL_ENTERPRISES_EMPLOYEES_JSON_FILE.value)
-            elif field_headers == None and is_special_too_many_headers_dataset:
-                # In case a new previously unknown dataset comes along with too many fields for transfer
-                problem_message = "Too many fields. Socrata suppressed X-SODA2-FIELDS value in response."
-                problem_resource = url
-                is_problematic = True
-                break
-            elif field_headers == None:
-                field_headers = re.findall("[a-zA-Z0-9_]+", dataset_fields_string)
-            else:
-                pass
-
-            # If special, first time through load the field names from their pre-made json files.
-            if json_file_contents != None:
-                json_loaded = load_json(json_file_contents=json_file_contents)
-                field_names_dictionary = grab_field_names_for_mega_columned_datasets(socrata_json_object=json_loaded)
-                field_headers = field_names_dictionary["visible"]
-            else:
-                pass
-
-            # Need a dictionary of headers to store null count
-            for header in field_headers:
-                null_count_for_each_field_dict[header] = 0
-
-            if number_of_columns_in_dataset == None:
-                number_of_columns_in_dataset = len(field_headers)
-
-            response_string = socrata_url_response.read()
-            json_objects_pythondict = json.loads(response_string)
-
-            # Some datasets are html or other type but socrata returns an empty object rather than a json object with
-            #   reason or code. These datasets are then not recognized as problematic and throw off the tracking counts.
-            if len(json_objects_pythondict) == 0:
-                problem_message = "Response json object was empty"
-                problem_resource = url
-                is_problematic = True
-                break
-
-            partial_function_for_multithreading = partial(inspect_record_for_null_values,
-                                                          null_count_for_each_field_dict)
-            # pool = Pool()
-            pool = ThreadPool(THREAD_COUNT.value)
-            pool.map(partial_function_for_multithreading, json_objects_pythondict)
-            pool.close()
-            pool.join()
-            record_count_increase = len(json_objects_pythondict)
-            cycle_record_count += record_count_increase
-            total_record_count += record_count_increase
-
-            # Any cycle_record_count that equals the max limit indicates another request is needed
-            if cycle_record_count == LIMIT_MAX_AND_OFFSET.value:
-                # Give Socrata servers small interval before requesting more
-                time.sleep(0.2)
-                socrata_record_offset_value = cycle_record_count + socrata_record_offset_value
-            else:
-                more_records_exist_than_response_limit_allows = False
+        if not dataset_result.is_from_cache:
+            dataset_scheduler.record_finished(api_id=dataset_result.dataset_api_id,
+                                              processing_time=dataset_result.processing_time)
+        if dataset_result.is_from_cache:
+            cached_dataset_counter += 1
+        elif (not dataset_result.is_problematic and dataset_result.last_modified is not None
+              and dataset_result.sampling_result is None):
+            result_cache.store_result(dataset_result=dataset_result, profile_csv_headers=profile_csv_headers)
+        dataset_name = dataset_result.dataset_name
+        dataset_name_with_spaces_but_no_illegal = dataset_result.dataset_name_with_spaces_but_no_illegal
+        field_null_counts = dataset_result.field_null_counts
+        number_of_columns_in_dataset = dataset_result.number_of_columns_in_dataset
+        total_record_count = dataset_result.total_record_count
+        print("{}: {} ............. {} ({:4.2f}s)".format(dataset_counter,
+                                                          dataset_name_with_spaces_but_no_illegal.upper(),
+                                                          dataset_result.dataset_api_id,
+                                                          dataset_result.processing_time))
 
         # Output the results, to a stand alone csv for each dataset containing null values,
         #   to a csv of problematic datasets, and to the overview for all datasets.
         total_number_of_null_values = calculate_total_number_of_empty_values_per_dataset(
-            null_counts_list=null_count_for_each_field_dict.values())
+            null_counts_list=field_null_counts.null_counts)
         percent_of_dataset_are_null_values = calculate_percent_null_for_dataset(
             null_count_total=total_number_of_null_values,
             total_records_processed=total_record_count,
             number_of_fields_in_dataset=number_of_columns_in_dataset)
 
-        if is_problematic:
+        csv_write_start_time = time.time()
+        if not dataset_result.is_problematic:
+            cell_counter += total_record_count * len(field_null_counts.field_names)
+            null_value_counter += total_number_of_null_values
+        if dataset_result.is_problematic:
             problem_dataset_counter += 1
-            write_problematic_datasets_to_csv(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
-                                              filename=problem_datasets_csv_filename,
+            write_problematic_datasets_to_csv(problem_report_writer=problem_report_writer,
                                               dataset_name=dataset_name_with_spaces_but_no_illegal,
-                                              message=problem_message,
-                                              resource=problem_resource)
+                                              message=dataset_result.problem_message,
+                                              resource=dataset_result.problem_resource)
         elif total_number_of_null_values > 0:
             valid_nulls_dataset_counter += 1
 
             # Write each datasets stats to its own csv
             dataset_name_no_spaces_no_illegal = handle_illegal_characters_in_string(string_with_illegals=dataset_name)
-            dataset_csv_filename = build_csv_file_name_with_date(today_date_string=build_today_date_string(),
+            if dataset_name_counts[dataset_name] > 1:
+                dataset_name_no_spaces_no_illegal = "{}_{}".format(dataset_name_no_spaces_no_illegal,
+                                                                   dataset_result.dataset_api_id)
+            dataset_csv_filename = build_csv_file_name_with_date(today_date_string=run_date_string,
                                                                  filename=dataset_name_no_spaces_no_illegal)
             # dataset_csv_file_path = os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value, dataset_csv_filename)
             write_dataset_results_to_csv(dataset_name=dataset_name_with_spaces_but_no_illegal,
                                          root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
                                          filename=dataset_csv_filename,
-                                         dataset_inspection_results=null_count_for_each_field_dict,
+                                         dataset_inspection_results=field_null_counts,
                                          total_records=total_record_count,
-                                         processing_time=calculate_time_taken(dataset_start_time))
+                                         processing_time=dataset_result.processing_time,
+                                         sampling_result=dataset_result.sampling_result,
+                                         field_profiles=dataset_result.field_profiles,
+                                         profile_csv_headers=profile_csv_headers)
 
             # Append the overview stats for each dataset to the overview stats csv
-            write_overview_stats_to_csv(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
-                                        filename=overview_csv_filename,
+            write_overview_stats_to_csv(overview_report_writer=overview_report_writer,
                                         dataset_name=dataset_name_with_spaces_but_no_illegal,
                                         dataset_csv_file_name=dataset_csv_filename,
                                         total_number_of_dataset_columns=number_of_columns_in_dataset,
                                         total_number_of_dataset_records=total_record_count,
-                                        data_provider=dict_of_socrata_dataset_providers[dataset_name_with_spaces_but_no_illegal],
+                                        data_provider=datasets_inventory[dataset_result.dataset_api_id].data_provider,
                                         total_number_of_null_fields=total_number_of_null_values,
-                                        percent_null=percent_of_dataset_are_null_values)
+                                        percent_null=percent_of_dataset_are_null_values,
+                                        is_sampled=dataset_result.sampling_result is not None)
         else:
             valid_no_null_dataset_counter += 1
 
             # Append the overview stats for each dataset to the overview stats csv
-            write_overview_stats_to_csv(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
-                                        filename=overview_csv_filename,
+            write_overview_stats_to_csv(overview_report_writer=overview_report_writer,
                                         dataset_name=dataset_name_with_spaces_but_no_illegal,
                                         dataset_csv_file_name=None,
                                         total_number_of_dataset_columns=number_of_columns_in_dataset,
                                         total_number_of_dataset_records=total_record_count,
-                                        data_provider=dict_of_socrata_dataset_providers[dataset_name_with_spaces_but_no_illegal],
+                                        data_provider=datasets_inventory[dataset_result.dataset_api_id].data_provider,
                                         total_number_of_null_fields=total_number_of_null_values,
-                                        percent_null=percent_of_dataset_are_null_values
-                                        )
+                                        percent_null=percent_of_dataset_are_null_values,
+                                        is_sampled=dataset_result.sampling_result is not None)
+        dataset_result.stage_timings.add_time(stage_name="csv_write", seconds=calculate_time_taken(csv_write_start_time))
+        write_dataset_stage_timings_to_csv(stage_timings_report_writer=stage_timings_report_writer,
+                                           dataset_name=dataset_name_with_spaces_but_no_illegal,
+                                           dataset_api_id=dataset_result.dataset_api_id,
+                                           processing_time=dataset_result.processing_time,
+                                           stage_timings=dataset_result.stage_timings)
+        run_stage_timings.merge(other_stage_timings=dataset_result.stage_timings)
+        history_store.store_result(run_date_string=run_date_string, dataset_result=dataset_result)
+        run_checkpoint.mark_dataset_finished(api_id=dataset_result.dataset_api_id)
+    pool.close()
+    pool.join()
+    if decode_process_pool is not None:
+        decode_process_pool.close()
+    http_client.close()
+    result_cache.close()
+    history_store.close()
+    problem_report_writer.close()
+    overview_report_writer.close()
+    stage_timings_report_writer.close()
 
-    performance_summary_filename = build_csv_file_name_with_date(today_date_string=build_today_date_string(),
-                                                                 filename=PERFORMANCE_SUMMARY_FILE_NAME.value)
+    performance_summary_filename = build_csv_file_name_with_date(
+        today_date_string=run_date_string,
+        filename=build_shard_file_name(filename=PERFORMANCE_SUMMARY_FILE_NAME.value,
+                                       shard_index=shard_index,
+                                       shard_count=shard_count))
     write_script_performance_summary(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
                                      filename=performance_summary_filename,
                                      start_time=process_start_time,
@@ -603,9 +4491,69 @@ def main():
                                      dataset_counter=dataset_counter,
                                      valid_nulls_dataset_counter=valid_nulls_dataset_counter,
                                      valid_no_null_dataset_counter=valid_no_null_dataset_counter,
-                                     problem_dataset_counter=problem_dataset_counter)
+                                     problem_dataset_counter=problem_dataset_counter,
+                                     cached_dataset_counter=cached_dataset_counter,
+                                     run_stage_timings=run_stage_timings,
+                                     final_requests_per_second=http_client.rate_limiter.requests_per_second,
+                                     deferred_dataset_counter=deferred_dataset_counter,
+                                     null_value_counter=null_value_counter,
+                                     cell_counter=cell_counter)
+    if deferred_api_ids:
+        print("{} datasets deferred to the next run by the time budget".format(len(deferred_api_ids)))
+        write_json_file_atomically(file_path=deferred_datasets_file_path,
+                                   json_object={"run_date": run_date_string, "deferred_api_ids": deferred_api_ids})
+    elif os.path.exists(deferred_datasets_file_path):
+        os.remove(deferred_datasets_file_path)
+    if shard_count > 1:
+        # Written last, so the merge can tell this shard completed
+        shard_summary_file_path = os.path.join(ROOT_PATH_FOR_CSV_OUTPUT.value, "{}_{}.json".format(
+            run_date_string, build_shard_file_name(filename=SHARD_SUMMARY_FILE_NAME.value,
+                                                   shard_index=shard_index,
+                                                   shard_count=shard_count)))
+        write_json_file_atomically(file_path=shard_summary_file_path, json_object={
+            "run_date": run_date_string,
+            "shard_index": shard_index,
+            "shard_count": shard_count,
+            "start_time": process_start_time,
+            "end_time": time.time(),
+            "number_of_datasets_in_data_freshness_report": number_of_datasets_in_data_freshness_report,
+            "dataset_counters": {"cached_dataset_counter": cached_dataset_counter,
+                                 "cell_counter": cell_counter,
+                                 "dataset_counter": dataset_counter,
+                                 "deferred_dataset_counter": deferred_dataset_counter,
+                                 "null_value_counter": null_value_counter,
+                                 "problem_dataset_counter": problem_dataset_counter,
+                                 "valid_no_null_dataset_counter": valid_no_null_dataset_counter,
+                                 "valid_nulls_dataset_counter": valid_nulls_dataset_counter},
+            "stage_seconds": dict(run_stage_timings.stage_seconds),
+            "stage_counters": dict(run_stage_timings.counters),
+            "final_requests_per_second": http_client.rate_limiter.requests_per_second})
+    # The run completed, so there is nothing to resume
+    run_checkpoint.remove()
 
     print("Process time (minutes) = {:4.2f}\n".format((time.time()-process_start_time)/60.0))
 
 if __name__ == "__main__":
-    main()
+    command_line_arguments = parse_command_line_arguments()
+    if command_line_arguments.diff is not None:
+        report_results_diff(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
+                            earlier_run_date_string=command_line_arguments.diff[0],
+                            later_run_date_string=(command_line_arguments.diff[1:] or [None])[0])
+    elif command_line_arguments.trend is not None:
+        report_results_trend(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
+                             api_id=command_line_arguments.trend[0],
+                             field_name=(command_line_arguments.trend[1:] or [None])[0])
+    elif command_line_arguments.plan:
+        plan_run(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
+                 shard_index=command_line_arguments.shard_index,
+                 shard_count=command_line_arguments.shard_count)
+    elif command_line_arguments.merge:
+        merge_shard_outputs(root_file_destination_location=ROOT_PATH_FOR_CSV_OUTPUT.value,
+                            run_date_string=command_line_arguments.run_date or build_today_date_string(),
+                            shard_count=command_line_arguments.shard_count)
+    else:
+        main(is_resume_requested=command_line_arguments.resume,
+             shard_index=command_line_arguments.shard_index,
+             shard_count=command_line_arguments.shard_count,
+             time_budget_seconds=(command_line_arguments.time_budget_minutes * 60
+                                  if command_line_arguments.time_budget_minutes is not None else None))